@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure how the reports scale with the size of the catalog.
+
+A throwaway Postgres cluster is created with initdb and filled with plain
+tables, partitioned tables and indexes, growing from one scale to the next.
+At every scale each report is run in a fresh process and timed:
+
+* server_ms: sending the statement until the result is in, which is almost
+  all server time
+* decode_ms: turning the result into Records
+* total_ms: calling the PgExtras method, post processing included
+* peak_rss_kb: peak resident set size of the process running the report,
+  baseline_rss_kb is the same process before the first run
+
+The results are written as JSON so two runs can be compared:
+
+    $ python benchmarks/bench.py run --scales 1000 10000 --output new.json
+    $ python benchmarks/bench.py compare old.json new.json
+
+initdb and pg_ctl are looked up in --bindir, else ``pg_config --bindir``,
+else the PATH. Like the server itself they refuse to run as root. When the
+server has pg_stat_statements it is preloaded and filled with --statements
+distinct statements; otherwise calls and outliers are reported as skipped.
+A report that fails is recorded with its error instead of timings.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+import psycopg2  # noqa: E402
+import psycopg2.extras  # noqa: E402
+from prettytable import PrettyTable  # noqa: E402
+
+import pgextras  # noqa: E402
+from pgextras import PgExtras  # noqa: E402
+from pgextras.sql_constants import REPORTS  # noqa: E402
+
+STATEMENT_REPORTS = ('calls', 'outliers')
+
+# One statement per table and shape shows up as its own pg_stat_statements
+# entry, the constants are normalized away.
+STATEMENT_SHAPES = [
+    "SELECT count(*) FROM bench.t_{} WHERE id > 0",
+    "SELECT max(id) FROM bench.t_{}",
+    "SELECT payload FROM bench.t_{} WHERE id = 1",
+    "UPDATE bench.t_{} SET payload = payload WHERE id = 1",
+]
+
+CREATE_TABLES = """
+DO $$
+BEGIN
+    FOR i IN {start}..{stop} LOOP
+        EXECUTE format(
+            'CREATE TABLE bench.t_%s ('
+            '    id integer PRIMARY KEY,'
+            '    payload text,'
+            '    created_at timestamptz DEFAULT now()'
+            ')', i);
+
+        FOR j IN 2..{indexes} LOOP
+            EXECUTE format(
+                'CREATE INDEX t_%s_%s ON bench.t_%s (payload, id)', i, j, i
+            );
+        END LOOP;
+
+        EXECUTE format(
+            'INSERT INTO bench.t_%s (id, payload)'
+            ' SELECT g, md5(g::text) FROM generate_series(1, {rows}) g', i);
+        -- leave some dead rows behind for vacuum_stats
+        EXECUTE format(
+            'UPDATE bench.t_%s SET payload = payload WHERE id %% 4 = 0', i);
+    END LOOP;
+END
+$$
+"""
+
+CREATE_PARTITIONED = """
+DO $$
+BEGIN
+    FOR i IN {start}..{stop} LOOP
+        EXECUTE format(
+            'CREATE TABLE bench.p_%s (id integer, payload text)'
+            ' PARTITION BY RANGE (id)', i);
+        EXECUTE format('CREATE INDEX ON bench.p_%s (id)', i);
+
+        FOR j IN 1..{partitions} LOOP
+            EXECUTE format(
+                'CREATE TABLE bench.p_%s_%s PARTITION OF bench.p_%s'
+                ' FOR VALUES FROM (%s) TO (%s)',
+                i, j, i, (j - 1) * {rows}, j * {rows});
+        END LOOP;
+
+        EXECUTE format(
+            'INSERT INTO bench.p_%s'
+            ' SELECT g, md5(g::text)'
+            ' FROM generate_series(0, {rows} * {partitions} - 1) g', i);
+    END LOOP;
+END
+$$
+"""
+
+LOAD_STATEMENTS = """
+DO $$
+BEGIN
+    FOR i IN 0..{count} - 1 LOOP
+        EXECUTE format(
+            (ARRAY[{shapes}])[i % {shape_count} + 1],
+            i / {shape_count} % {tables} + 1
+        );
+    END LOOP;
+END
+$$
+"""
+
+
+class Cluster(object):
+    """
+    A Postgres cluster in a temporary directory, listening on a unix socket
+    in that directory only. Removed again on exit.
+    """
+
+    def __init__(self, bindir=None, settings=None):
+        self.bindir = bindir
+        self.settings = settings or {}
+        self.directory = None
+
+    def binary(self, name):
+        if self.bindir:
+            return os.path.join(self.bindir, name)
+
+        try:
+            bindir = subprocess.check_output(
+                ['pg_config', '--bindir'], universal_newlines=True
+            ).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return name
+
+        path = os.path.join(bindir, name)
+
+        return path if os.path.exists(path) else name
+
+    @property
+    def data(self):
+        return os.path.join(self.directory, 'data')
+
+    @property
+    def dsn(self):
+        return 'host={} dbname=postgres user=postgres'.format(self.directory)
+
+    def has_extension(self, name):
+        sharedir = subprocess.check_output(
+            [self.binary('pg_config'), '--sharedir'], universal_newlines=True
+        ).strip()
+
+        return os.path.exists(
+            os.path.join(sharedir, 'extension', name + '.control')
+        )
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='pgextras-bench-')
+        subprocess.check_call(
+            [self.binary('initdb'), '--no-sync', '-A', 'trust',
+             '-U', 'postgres', '-D', self.data],
+            stdout=subprocess.DEVNULL
+        )
+
+        options = ["-k {}".format(self.directory), "-c listen_addresses=''",
+                   '-F']
+        options.extend(
+            '-c {}={}'.format(name, value)
+            for name, value in sorted(self.settings.items())
+        )
+
+        subprocess.check_call(
+            [self.binary('pg_ctl'), '-D', self.data, '-w',
+             '-l', os.path.join(self.directory, 'server.log'),
+             '-o', ' '.join(options), 'start'],
+            stdout=subprocess.DEVNULL
+        )
+
+        return self
+
+    def __exit__(self, *exc_info):
+        subprocess.call(
+            [self.binary('pg_ctl'), '-D', self.data, '-m', 'immediate',
+             '-w', 'stop'],
+            stdout=subprocess.DEVNULL
+        )
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def grow(conn, start, stop, args):
+    """
+    Create tables start..stop (and a share of partitioned tables) in
+    batches, so a single transaction never needs too many locks.
+    """
+
+    cursor = conn.cursor()
+    cursor.execute('CREATE SCHEMA IF NOT EXISTS bench')
+    batch = 500
+
+    for first in range(start, stop + 1, batch):
+        cursor.execute(CREATE_TABLES.format(
+            start=first, stop=min(first + batch - 1, stop),
+            indexes=args.indexes, rows=args.rows
+        ))
+
+    first_parent = int((start - 1) * args.partitioned) + 1
+    last_parent = int(stop * args.partitioned)
+
+    for first in range(first_parent, last_parent + 1, batch // 10):
+        cursor.execute(CREATE_PARTITIONED.format(
+            start=first, stop=min(first + batch // 10 - 1, last_parent),
+            partitions=args.partitions, rows=args.rows
+        ))
+
+    cursor.execute('ANALYZE')
+
+
+def load_statements(conn, tables, count):
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_stat_statements_reset()')
+    cursor.execute(LOAD_STATEMENTS.format(
+        count=count,
+        tables=tables,
+        shapes=', '.join(
+            "'{}'".format(shape.replace('{}', '%s').replace("'", "''"))
+            for shape in STATEMENT_SHAPES
+        ),
+        shape_count=len(STATEMENT_SHAPES),
+    ))
+
+
+def max_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # bytes on macOS, kilobytes everywhere else
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def measure(dsn, report, repeat):
+    """
+    Run one report repeat times. Meant to run in a fresh process so the
+    peak RSS belongs to this report alone.
+
+    :returns: dict
+    """
+
+    with PgExtras(dsn=dsn) as pg:
+        statement = pg.render(report)
+        params = pg.report_params(report, None)
+        method = getattr(pg, report)
+        pg.version()
+        baseline = max_rss_kb()
+        server, decode, total = [], [], []
+        rows = 0
+
+        for run in range(repeat):
+            with pg.connection() as conn:
+                cursor = conn.cursor(
+                    cursor_factory=psycopg2.extras.NamedTupleCursor
+                )
+                started = time.perf_counter()
+                cursor.execute(statement, params)
+                executed = time.perf_counter()
+                rows = len(cursor.fetchall())
+                server.append(executed - started)
+                decode.append(time.perf_counter() - executed)
+                cursor.close()
+
+            if run == 0:
+                tracemalloc.start()
+
+            started = time.perf_counter()
+            method()
+            total.append(time.perf_counter() - started)
+
+            if run == 0:
+                python_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+    def timings(values):
+        return {
+            'min': round(min(values) * 1000, 3),
+            'median': round(statistics.median(values) * 1000, 3),
+        }
+
+    return {
+        'report': report,
+        'rows': rows,
+        'server_ms': timings(server),
+        'decode_ms': timings(decode),
+        'total_ms': timings(total),
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': max_rss_kb(),
+        'python_peak_bytes': python_peak,
+    }
+
+
+def catalog_counts(conn):
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT
+            count(*) FILTER (WHERE relkind IN ('r', 'p')) AS tables,
+            count(*) FILTER (WHERE relkind IN ('i', 'I')) AS indexes,
+            count(*) FILTER (WHERE relispartition) AS partitions
+        FROM pg_class
+    """)
+
+    return dict(zip(('tables', 'indexes', 'partitions'), cursor.fetchone()))
+
+
+def run(args):
+    settings = {
+        'max_locks_per_transaction': 1024,
+        'autovacuum': 'off',
+    }
+    statements = Cluster(args.bindir).has_extension('pg_stat_statements')
+
+    if statements:
+        settings.update({
+            'shared_preload_libraries': 'pg_stat_statements',
+            'pg_stat_statements.max': max(args.statements, 100),
+            'pg_stat_statements.track': 'all',
+        })
+
+    reports = args.reports or sorted(
+        report for report in REPORTS if hasattr(PgExtras, report)
+    )
+    context = multiprocessing.get_context('spawn')
+    results = []
+
+    with Cluster(args.bindir, settings) as cluster:
+        conn = psycopg2.connect(cluster.dsn)
+        conn.autocommit = True
+
+        if statements:
+            conn.cursor().execute('CREATE EXTENSION pg_stat_statements')
+
+        created = 0
+
+        for scale in sorted(args.scales):
+            print('scale {}: creating tables'.format(scale), file=sys.stderr)
+            grow(conn, created + 1, scale, args)
+            created = scale
+
+            if statements:
+                load_statements(conn, scale, args.statements)
+
+            counts = catalog_counts(conn)
+
+            with context.Pool(1, maxtasksperchild=1) as pool:
+                for report in reports:
+                    if report in STATEMENT_REPORTS and not statements:
+                        results.append(dict(
+                            counts, scale=scale, report=report,
+                            skipped='pg_stat_statements is not available'
+                        ))
+                        continue
+
+                    print('scale {}: {}'.format(scale, report),
+                          file=sys.stderr)
+
+                    try:
+                        result = pool.apply(
+                            measure, (cluster.dsn, report, args.repeat)
+                        )
+                    except psycopg2.Error as error:
+                        result = {'report': report,
+                                  'error': str(error).strip()}
+
+                    results.append(dict(counts, scale=scale, **result))
+
+        cursor = conn.cursor()
+        cursor.execute('SHOW server_version')
+        server_version = cursor.fetchone()[0]
+        conn.close()
+
+    output = {
+        'meta': {
+            'pgextras': pgextras.__version__,
+            'revision': revision(),
+            'server_version': server_version,
+            'python': platform.python_version(),
+            'psycopg2': psycopg2.__version__,
+            'platform': platform.platform(),
+            'taken_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'repeat': args.repeat,
+            'indexes': args.indexes,
+            'rows': args.rows,
+            'partitioned': args.partitioned,
+            'partitions': args.partitions,
+            'statements': args.statements if statements else 0,
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+def revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(args):
+    """
+    Print the median total time of every report in both runs. Exits with 1
+    if any report got slower than --threshold times its old time.
+    """
+
+    def load(path):
+        with open(path) as result_file:
+            return dict(
+                ((result['scale'], result['report']), result)
+                for result in json.load(result_file)['results']
+                if 'total_ms' in result
+            )
+
+    old, new = load(args.old), load(args.new)
+    table = PrettyTable(['scale', 'report', 'old ms', 'new ms', 'ratio',
+                         'old rss kB', 'new rss kB'])
+    table.align = 'l'
+    regressed = False
+
+    for key in sorted(set(old) & set(new)):
+        before = old[key]['total_ms']['median']
+        after = new[key]['total_ms']['median']
+        ratio = after / before if before else 1.0
+        flag = ''
+
+        # Too fast to tell noise from a regression
+        if ratio > args.threshold and after >= args.min_ms:
+            regressed = True
+            flag = ' !'
+
+        table.add_row([
+            key[0], key[1], before, after, '{:.2f}{}'.format(ratio, flag),
+            old[key]['peak_rss_kb'], new[key]['peak_rss_kb'],
+        ])
+
+    print(table)
+
+    if regressed:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--scales', type=int, nargs='+',
+                            default=[1000, 10000, 100000],
+                            help='number of plain tables at each scale')
+    run_parser.add_argument('--indexes', type=int, default=2,
+                            help='indexes per table, primary key included')
+    run_parser.add_argument('--rows', type=int, default=10,
+                            help='rows per table and per partition')
+    run_parser.add_argument('--partitioned', type=float, default=0.1,
+                            help='partitioned tables per plain table')
+    run_parser.add_argument('--partitions', type=int, default=4,
+                            help='partitions per partitioned table')
+    run_parser.add_argument('--statements', type=int, default=5000,
+                            help='distinct pg_stat_statements entries')
+    run_parser.add_argument('--repeat', type=int, default=5,
+                            help='runs of every report at every scale')
+    run_parser.add_argument('--reports', nargs='+',
+                            help='reports to run, all by default')
+    run_parser.add_argument('--bindir', help='directory of initdb and pg_ctl')
+    run_parser.add_argument('--output', help='file to write the JSON to')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare',
+                                         help='compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=1.2,
+                                help='ratio of new to old time that counts '
+                                'as a regression')
+    compare_parser.add_argument('--min-ms', dest='min_ms', type=float,
+                                default=5, help='ignore reports faster '
+                                'than this')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
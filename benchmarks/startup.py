@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure how long ``import pgextras`` and the CLI take to start, and fail when
+they go over budget.
+
+Every command runs in a fresh interpreter, --repeat times, and the median
+wall time is compared against a reference:
+
+* import pgextras: against ``import psycopg2``, which it can't do without
+* pgextras --help: against an interpreter that does nothing
+
+    $ python benchmarks/startup.py --import-budget 15 --cli-budget 40
+
+Bytecode is cached in a temporary directory and every command is run once
+before it is timed, so the times are those of an installed package rather
+than of compiling the sources.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = os.path.join(ROOT, 'scripts', 'pgextras')
+
+COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import psycopg2', ['-c', 'import psycopg2']),
+    ('import pgextras', ['-c', 'import pgextras']),
+    ('pgextras --help', [SCRIPT, '--help']),
+]
+
+
+def measure(arguments, repeat, env):
+    """
+    :returns: list of wall times in milliseconds
+    """
+
+    command = [sys.executable] + arguments
+    subprocess.check_call(command, env=env, stdout=subprocess.DEVNULL)
+    times = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.check_call(command, env=env, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - started) * 1000)
+
+    return times
+
+
+def run(args):
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [env.get('PYTHONPATH')] if path]
+    )
+    medians = {}
+
+    with tempfile.TemporaryDirectory(prefix='pgextras-startup-') as cache:
+        env['PYTHONPYCACHEPREFIX'] = cache
+
+        for name, arguments in COMMANDS:
+            medians[name] = round(
+                statistics.median(measure(arguments, args.repeat, env)), 1
+            )
+
+    checks = [
+        ('import pgextras', 'import psycopg2', args.import_budget),
+        ('pgextras --help', 'python', args.cli_budget),
+    ]
+    results = []
+
+    for name, reference, budget in checks:
+        overhead = round(medians[name] - medians[reference], 1)
+        results.append({
+            'command': name,
+            'median_ms': medians[name],
+            'reference': reference,
+            'reference_ms': medians[reference],
+            'overhead_ms': overhead,
+            'budget_ms': budget,
+            'ok': overhead <= budget,
+        })
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        for result in results:
+            print('{command}: {median_ms}ms, {overhead_ms}ms over '
+                  '{reference} (budget {budget_ms}ms){flag}'.format(
+                      flag='' if result['ok'] else ' OVER BUDGET', **result))
+
+    if not all(result['ok'] for result in results):
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='runs of every command')
+    parser.add_argument('--import-budget', dest='import_budget', type=float,
+                        default=15, help='milliseconds import pgextras may '
+                        'take over import psycopg2')
+    parser.add_argument('--cli-budget', dest='cli_budget', type=float,
+                        default=40, help='milliseconds pgextras --help may '
+                        'take over an empty interpreter')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
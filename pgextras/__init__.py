@@ -1,26 +1,126 @@
 # -*- coding: utf-8 -*-
+import importlib
+import itertools
 import re
+import threading
+import time
+import weakref
+import zlib
 from collections import namedtuple
+from contextlib import contextmanager
 
 import psycopg2
-import psycopg2.extras
-from packaging.version import parse as parse_version
+import psycopg2.errorcodes
 
 from . import sql_constants as sql
+from .base import PRETTY_EXACT_BLOAT, BasePgExtras, is_error, normalize
+from .instrument import Execution, Statement, result_size
+from .instrument import Hook, Timings  # noqa: F401
+from .lockgraph import build_lock_graph
+from .profile import ServerProfile, get_profile, set_profile
+from .rows import (
+    ROW_FORMATS, Columns, RecordStream, RowsCursor, format_rows
+)
+from .rows import Rows  # noqa: F401
+from .statements import StatementSampler
 
 __author__ = 'Scott Woodall'
 __email__ = 'scott.woodall@gmail.com'
 __version__ = '0.2.1'
 
+# Names of the statements prepared on each connection, shared by every
+# instance that uses it (e.g. through a pool).
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+_cursor_ids = itertools.count()
+
+_placeholders = re.compile(r'%(?:\((\w+)\)s|%)')
+
+# Health checks run the CLI over and over, so whatever a report does not need
+# is imported on first use: the names below, psycopg2.extras, the thread pool
+# of exact bloat and the optional NumPy and pyarrow.
+_lazy = {
+    'MemoryBackend': '.cache',
+    'ResultCache': '.cache',
+    'SQLiteBackend': '.cache',
+}
+
+
+def __getattr__(name):
+    try:
+        module = _lazy[name]
+    except KeyError:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name)
+        )
+
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+
+    return value
+
+
+def _named_tuple_cursor():
+    import psycopg2.extras
+
+    return psycopg2.extras.NamedTupleCursor
+
+
+class PgExtras(BasePgExtras):
+    def __init__(self, dsn=None, connection=None, pool=None, prepare=False,
+                 statement_timeout=None, lock_timeout=None, timeouts=None,
+                 autocommit=True, readonly=True, hooks=None, explain=False,
+                 cache=None, row_format='record'):
+        """
+        :param dsn: connection string, PgExtras opens and owns the connection
+        :param connection: an open psycopg2 connection to use instead, it is
+            left open on close
+        :param pool: a pool such as psycopg2.pool.ThreadedConnectionPool, a
+            connection is borrowed for each report and put back afterwards
+        :param prepare: run reports as named server side prepared statements,
+            worthwhile when the same reports are sampled over and over
+        :param statement_timeout: default statement_timeout of the reports,
+            milliseconds or a string with a unit such as '5s'
+        :param lock_timeout: default lock_timeout of the reports
+        :param timeouts: overrides per report, e.g.
+            {'bloat': {'statement_timeout': '30s'}}
+        :param autocommit: run the connections PgExtras opens itself in
+            autocommit mode, so an idle instance never sits in an open
+            transaction holding back vacuum. Connections passed in or
+            borrowed from a pool are used as they are.
+        :param readonly: make those sessions default_transaction_read_only
+        :param hooks: instrumentation hooks called before and after every
+            statement, e.g. [pgextras.Timings()]
+        :param explain: have the hooks see the server time of every report,
+            measured by running it a second time under EXPLAIN ANALYZE
+        :param cache: a ResultCache to reuse the results of slow changing
+            reports from
+        :param row_format: what reports return, 'record' for a list of
+            Records, 'tuple' for Rows (plain tuples sharing their column
+            names) or 'columnar' for Columns (a dict of column name to NumPy
+            array), see pgextras.rows. Error Records stay Records.
+        """
+
+        if row_format not in ROW_FORMATS:
+            raise ValueError('Unknown row_format: {}'.format(row_format))
 
-class PgExtras(object):
-    def __init__(self, dsn=None):
         self.dsn = dsn
-        self._pg_stat_statement = None
+        self.pool = pool
+        self.prepare = prepare
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.timeouts = timeouts or {}
+        self.autocommit = autocommit
+        self.readonly = readonly
+        self.hooks = list(hooks or [])
+        self.explain = explain
+        self.cache = cache
+        self.row_format = row_format
         self._cursor = None
-        self._conn = None
-        self._is_pg_at_least_nine_two = None
-        self._is_pg_at_least_thirteen = None
+        self._conn = connection
+        self._owns_conn = connection is None
+        self._profile = None
 
     def __enter__(self):
         """
@@ -35,151 +135,709 @@ class PgExtras(object):
     @property
     def cursor(self):
         if self._cursor is None:
-            self._conn = psycopg2.connect(
-                self.dsn,
-                cursor_factory=psycopg2.extras.NamedTupleCursor
+            self._cursor = self._get_conn().cursor(
+                cursor_factory=_named_tuple_cursor()
             )
 
-            self._cursor = self._conn.cursor()
-
         return self._cursor
 
     @property
-    def query_column(self):
+    def profile(self):
+        """
+        Capabilities of the server we are connected to. The version comes
+        from the connection handshake, so resolving a profile costs a single
+        query for the installed extensions and is then shared by every
+        instance using the same connection string.
+
+        :returns: ServerProfile
+        """
+
+        if self._profile is None:
+            with self.connection() as conn:
+                key = conn.dsn
+                profile = get_profile(key)
+
+                if profile is None:
+                    with self._new_cursor(conn) as cursor:
+                        cursor.execute(sql.EXTENSIONS)
+                        extensions = dict(
+                            (row.extname, row.extversion)
+                            for row in cursor.fetchall()
+                        )
+
+                    profile = ServerProfile(conn.server_version, extensions)
+                    set_profile(key, profile)
+
+            self._profile = profile
+
+        return self._profile
+
+    def _get_conn(self):
+        if self._conn is None:
+            self._conn = self._connect()
+
+        return self._conn
+
+    def _connect(self):
+        conn = psycopg2.connect(
+            self.dsn,
+            cursor_factory=_named_tuple_cursor()
+        )
+        conn.set_session(
+            readonly=True if self.readonly else None,
+            autocommit=self.autocommit
+        )
+
+        return conn
+
+    def _new_cursor(self, conn, row_format='record'):
+        if row_format == 'record':
+            return conn.cursor(
+                cursor_factory=_named_tuple_cursor()
+            )
+
+        return conn.cursor(cursor_factory=RowsCursor)
+
+    @contextmanager
+    def connection(self):
         """
-        PG9.2 changed column names.
+        The connection to run one report on. With a pool it is borrowed for
+        the duration of the block and put back afterwards.
 
-        :returns: str
+            >>> with pg.connection() as conn:
+            ...     conn.server_version
         """
 
-        if self.is_pg_at_least_nine_two():
-            return 'query'
+        if self.pool is None:
+            yield self._get_conn()
         else:
-            return 'current_query'
+            conn = self.pool.getconn()
 
-    @property
-    def pid_column(self):
+            try:
+                yield conn
+            finally:
+                self.pool.putconn(conn)
+
+    def close_db_connection(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+        if self._conn is not None and self._owns_conn:
+            self._conn.close()
+            self._conn = None
+
+    def execute(self, statement, params=None, report=None,
+                row_format='record'):
+        """
+        Execute the given sql statement. It is always run with parameters,
+        so a literal % is written as %%, like in sql_constants.
+
+        :param statement: sql statement to run
+        :param params: query parameters, e.g. {'limit': 10}
+        :param report: name of the report the statement belongs to, reports
+            are run as prepared statements when prepare is on
+        :param row_format: 'record', 'tuple' or 'columnar'
+        :returns: list of Records, Rows or Columns
         """
-        PG9.2 changed column names.
 
-        :returns: str
+        params = {} if params is None else params
+
+        with self.connection() as conn:
+            with self._new_cursor(conn, row_format) as cursor:
+                if self.prepare and report is not None:
+                    rows = self._execute_prepared(
+                        conn, cursor, statement, params, report
+                    )
+                else:
+                    rows = self._instrumented(
+                        conn, cursor, statement, params, report
+                    )
+
+        if row_format == 'columnar':
+            return Columns(rows.columns, rows)
+
+        return rows
+
+    def _instrumented(self, conn, cursor, statement, params, report,
+                      executed=None, guarded=True):
+        """
+        Run the statement (or the prepared statement executed in its place)
+        under the report's timeouts, telling the hooks about it. Unguarded
+        statements take care of their own transaction and timeouts.
         """
 
-        if self.is_pg_at_least_nine_two():
-            return 'pid'
+        executed = executed or statement
+
+        if not guarded:
+            def run(conn, cursor, statement, params, report, timing=None):
+                return self._fetch(cursor, statement, params, timing)
         else:
-            return 'procpid'
+            run = self._guarded
 
-    @property
-    def total_time_column(self):
+        if not self.hooks:
+            return run(conn, cursor, executed, params, report)
+
+        for hook in self.hooks:
+            hook.before_execute(Statement(report, statement, params))
+
+        timing = {}
+        started = time.perf_counter()
+
+        try:
+            rows = run(conn, cursor, executed, params, report, timing)
+        except Exception as error:
+            self._after_execute(Execution(
+                report, statement, params,
+                (time.perf_counter() - started) * 1000,
+                timing.get('decode_time'), None, None, None, error
+            ))
+            raise
+
+        wall_time = (time.perf_counter() - started) * 1000
+
+        if self.explain and guarded:
+            server_time = self._server_time(
+                conn, cursor, executed, params, report
+            )
+        else:
+            server_time = None
+
+        self._after_execute(Execution(
+            report, statement, params, wall_time, timing.get('decode_time'),
+            server_time, len(rows), result_size(rows), None
+        ))
+
+        return rows
+
+    def _after_execute(self, execution):
+        for hook in self.hooks:
+            hook.after_execute(execution)
+
+    def _server_time(self, conn, cursor, statement, params, report):
+        """
+        :returns: planning plus execution time of the statement in
+            milliseconds, from EXPLAIN ANALYZE
+        """
+
+        plan = self._guarded(
+            conn, cursor, 'EXPLAIN (ANALYZE, FORMAT JSON) ' + statement,
+            params, report
+        )[0][0][0]
+
+        # Before 9.4 there is only the total runtime
+        return (
+            plan.get('Planning Time', 0)
+            + plan.get('Execution Time', plan.get('Total Runtime', 0))
+        )
+
+    def timeout_settings(self, report=None):
+        """
+        The timeouts a report runs with: the defaults, overridden by the
+        report's entry in timeouts.
+
+        :param report: name of the report method, e.g. 'bloat'
+        :returns: list of (setting, value)
+        """
+
+        settings = {
+            'statement_timeout': self.statement_timeout,
+            'lock_timeout': self.lock_timeout,
+        }
+        settings.update(self.timeouts.get(report, {}))
+
+        # lock_timeout was added in 9.3
+        if not self.profile.is_at_least(90300):
+            settings.pop('lock_timeout')
+
+        return [
+            (name, settings[name])
+            for name in ('statement_timeout', 'lock_timeout')
+            if settings.get(name) is not None
+        ]
+
+    def _guarded(self, conn, cursor, statement, params, report,
+                 timing=None):
         """
-        PG13 changed column names.
+        Run the statement under the report's timeouts. They are SET LOCAL in
+        a transaction (a savepoint when one is already open) that ends with
+        the statement, so they never outlast it and a cancelled statement
+        leaves the connection usable.
 
-        :returns: str
+        :param timing: dict to store the decode_time in
         """
 
-        if self.is_pg_at_least_thirteen():
-            return 'total_exec_time'
+        settings = self.timeout_settings(report)
+
+        if not settings:
+            return self._fetch(cursor, statement, params, timing)
+
+        if conn.autocommit:
+            begin = 'BEGIN;'
+            end = 'COMMIT'
+            abort = 'ROLLBACK'
         else:
-            return 'total_time'
+            begin = 'SAVEPOINT pgextras_timeouts;'
+            end = abort = (
+                'ROLLBACK TO SAVEPOINT pgextras_timeouts;'
+                'RELEASE SAVEPOINT pgextras_timeouts'
+            )
+
+        try:
+            rows = self._fetch(
+                cursor,
+                begin + self._set_local(conn, cursor, report) + statement,
+                params,
+                timing
+            )
+        except psycopg2.Error:
+            cursor.execute(abort)
+            raise
+
+        cursor.execute(end)
 
-    def pg_stat_statement(self):
+        return rows
+
+    def _fetch(self, cursor, statement, params, timing=None):
+        cursor.execute(statement, params)
+
+        if timing is None:
+            return cursor.fetchall()
+
+        started = time.perf_counter()
+        rows = cursor.fetchall()
+        timing['decode_time'] = (time.perf_counter() - started) * 1000
+
+        return rows
+
+    def _set_local(self, conn, cursor, report):
+        """
+        :returns: the SET LOCAL statements for the report's timeouts
         """
-        Some queries require the pg_stat_statement module to be installed.
-        http://www.postgresql.org/docs/current/static/pgstatstatements.html
 
-        :returns: boolean
+        encoding = psycopg2.extensions.encodings[conn.encoding]
+
+        return ''.join(
+            cursor.mogrify(
+                'SET LOCAL {} = %s;'.format(name), (value,)
+            ).decode(encoding)
+            for name, value in self.timeout_settings(report)
+        )
+
+    def _timed_out(self, report, error):
+        """
+        :returns: the timeout Record for error, None when it is not a
+            timeout of ours
         """
 
-        if self._pg_stat_statement is None:
-            results = self.execute(sql.PG_STAT_STATEMENT)
-            is_available = results[0].available
+        if not self.timeout_settings(report):
+            return None
 
-            if is_available:
-                self._pg_stat_statement = True
-            else:
-                self._pg_stat_statement = False
+        if isinstance(error, psycopg2.extensions.QueryCanceledError):
+            setting = 'statement_timeout'
+        elif error.pgcode == psycopg2.errorcodes.LOCK_NOT_AVAILABLE:
+            setting = 'lock_timeout'
+        else:
+            return None
 
-        return self._pg_stat_statement
+        return self.get_timeout_error(
+            report, setting, dict(self.timeout_settings(report)).get(setting),
+            error
+        )
 
-    def get_missing_pg_stat_statement_error(self):
-        Record = namedtuple('Record', 'error')
-        error = """
-            pg_stat_statements extension needs to be installed in the
-            public schema first. This extension is only available on
-            Postgres versions 9.2 or greater. You can install it by
-            adding pg_stat_statements to shared_preload_libraries in
-            postgresql.conf, restarting postgres and then running the
-            following sql statement in your database:
-            CREATE EXTENSION pg_stat_statements;
+    def _execute_prepared(self, conn, cursor, statement, params, report):
+        """
+        Run the statement as a prepared statement, see _prepared. A server
+        reset (pgbouncer's DISCARD ALL, for one) drops every prepared
+        statement of the session, so when the server no longer knows the
+        statement the names of the connection are forgotten and it is
+        prepared again.
         """
 
-        return Record(error)
+        try:
+            return self._instrumented(
+                conn, cursor, statement, params, report,
+                self._prepared(conn, cursor, report, statement)
+            )
+        except psycopg2.Error as error:
+            if (
+                error.pgcode != psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME
+                # Retrying would need a rollback of the caller's transaction
+                or conn.get_transaction_status()
+                == psycopg2.extensions.TRANSACTION_STATUS_INERROR
+            ):
+                raise
+
+        with _prepared_lock:
+            _prepared.pop(conn, None)
+
+        return self._instrumented(
+            conn, cursor, statement, params, report,
+            self._prepared(conn, cursor, report, statement)
+        )
 
-    def is_pg_at_least_nine_two(self):
+    def _prepared(self, conn, cursor, report, statement):
+        """
+        Prepare the statement on this connection unless it already was and
+        return the EXECUTE for it. The %(name)s parameters become $n
+        parameters of the prepared statement and arguments of the EXECUTE.
         """
-        Some queries have different syntax depending what version of postgres
-        we are querying against.
 
-        :returns: boolean
+        # A checksum rather than a hash: it only tells statements apart and
+        # keeps working where FIPS mode disables md5
+        name = 'pgextras_{}_{:08x}'.format(
+            report, zlib.crc32(statement.encode('utf-8'))
+        )
+
+        with _prepared_lock:
+            names = _prepared.setdefault(conn, set())
+
+        params = []
+
+        def to_server_param(match):
+            if match.group(1) is None:
+                return '%'
+
+            if match.group(1) not in params:
+                params.append(match.group(1))
+
+            return '${}'.format(params.index(match.group(1)) + 1)
+
+        server_statement = _placeholders.sub(to_server_param, statement)
+
+        if name not in names:
+            # Prepared statements outlive the transaction they were created
+            # in, so this only has to succeed once per connection.
+            cursor.execute('PREPARE {} AS {}'.format(name, server_statement))
+            names.add(name)
+
+        if not params:
+            return 'EXECUTE {}'.format(name)
+
+        return 'EXECUTE {}({})'.format(
+            name, ', '.join('%({})s'.format(param) for param in params)
+        )
+
+    def run_report(self, report, params=None, row_format=None, **options):
         """
+        Render and execute a report.
 
-        if self._is_pg_at_least_nine_two is None:
-            results = self.version()
-            regex = re.compile(r"PostgreSQL (\d+(\.\d+)+) on")
-            matches = regex.match(results[0].version)
-            version = matches.groups()[0]
+        :param report: name of the report method, e.g. 'ps'
+        :param params: query parameters overriding the report's defaults
+        :param row_format: overrides the instance's row_format
+        :param options: passed on to render
+        :returns: list of Records, Rows or Columns
+        """
 
-            if parse_version(version) > parse_version('9.2.0'):
-                self._is_pg_at_least_nine_two = True
-            else:
-                self._is_pg_at_least_nine_two = False
+        row_format = row_format or self.row_format
 
-        return self._is_pg_at_least_nine_two
+        if self.cache is None:
+            return self._run_report(report, params, row_format, options)
+
+        if self.dsn is not None:
+            dsn = self.dsn
+        else:
+            with self.connection() as conn:
+                dsn = conn.dsn
 
-    def is_pg_at_least_thirteen(self):
+        key = self.cache.key(
+            dsn, report, self.report_params(report, params),
+            dict(options, row_format=row_format)
+        )
+
+        return self.cache.get_or_run(
+            key,
+            report,
+            lambda: self._run_report(report, params, row_format, options)
+        )
+
+    def _run_report(self, report, params, row_format, options):
+        try:
+            return self.execute(
+                self.render(report, **options),
+                self.report_params(report, params),
+                report=report,
+                row_format=row_format
+            )
+        except psycopg2.OperationalError as error:
+            timed_out = self._timed_out(report, error)
+
+            if timed_out is None:
+                raise
+
+            return [timed_out]
+
+    def iter_report(self, report, itersize=2000, params=None, **options):
         """
-        Some queries have different syntax depending what version of postgres
-        we are querying against.
+        Stream a report through a server side cursor instead of fetching it
+        all at once, so memory stays flat however large the catalog is.
+
+            >>> for record in pg.iter_report('vacuum_stats', itersize=500):
+            ...     print(record.table)
 
-        :returns: boolean
+        A report that hits one of its timeouts ends with the timeout Record,
+        after whatever rows arrived before.
+
+        :param report: name of the report method, e.g. 'vacuum_stats'
+        :param itersize: rows fetched from the server per round trip
+        :param params: query parameters overriding the report's defaults
+        :param options: passed on to render
+        :returns: RecordStream, an iterator of Records
         """
 
-        if self._is_pg_at_least_thirteen is None:
-            results = self.version()
-            regex = re.compile(r"PostgreSQL (\d+(\.\d+)+) on")
-            matches = regex.match(results[0].version)
-            version = matches.groups()[0]
+        stream = RecordStream()
+        stream.records = self._iter_report(
+            stream, report, itersize, params, options
+        )
 
-            if parse_version(version) >= parse_version('13'):
-                self._is_pg_at_least_thirteen = True
-            else:
-                self._is_pg_at_least_thirteen = False
+        return stream
+
+    def _iter_report(self, stream, report, itersize, params, options):
+        if report in ('calls', 'outliers') and not self.pg_stat_statement():
+            yield self.get_missing_pg_stat_statement_error()
+            return
+
+        statement = self.render(report, **options)
+        name = 'pgextras_{}_{}'.format(report, next(_cursor_ids))
+        timed_out = None
+
+        with self.connection() as conn, self._transaction(conn):
+            with conn.cursor() as setup:
+                # The SET LOCAL timeouts are undone with the savepoint
+                setup.execute(
+                    'SAVEPOINT pgextras_iter;'
+                    + self._set_local(conn, setup, report)
+                )
+
+            try:
+                with conn.cursor(
+                    name=name,
+                    cursor_factory=_named_tuple_cursor()
+                ) as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(
+                        statement, self.report_params(report, params)
+                    )
+
+                    for record in cursor:
+                        yield record
+
+                    # Known once the first rows were fetched
+                    stream.columns = [
+                        column.name for column in cursor.description
+                    ]
+            except psycopg2.OperationalError as error:
+                timed_out = self._timed_out(report, error)
+
+                if timed_out is None:
+                    raise
+            finally:
+                # An abandoned generator may only be finished after the
+                # connection was closed
+                if not conn.closed:
+                    with conn.cursor() as setup:
+                        setup.execute(
+                            'ROLLBACK TO SAVEPOINT pgextras_iter;'
+                            'RELEASE SAVEPOINT pgextras_iter'
+                        )
+
+        if timed_out is not None:
+            yield timed_out
+
+    @contextmanager
+    def _transaction(self, conn):
+        """
+        A transaction for the length of the block on an autocommit
+        connection, e.g. for a server side cursor. Any other connection is
+        left as it is.
 
-        return self._is_pg_at_least_thirteen
+        Switching autocommit back on resets the session defaults psycopg2
+        applied, so they are applied again afterwards.
+        """
 
-    def close_db_connection(self):
-        if self._cursor is not None:
-            self._cursor.close()
+        if not conn.autocommit:
+            yield
+            return
 
-        if self._conn is not None:
-            self._conn.close()
+        readonly = conn.readonly
+        conn.autocommit = False
 
-    def execute(self, statement):
+        try:
+            yield
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.set_session(readonly=readonly, autocommit=True)
+
+    def export(self, report, file, format='csv', params=None, **options):
+        """
+        Write a report to a file as CSV (with a header), NDJSON, Arrow or
+        Parquet through COPY ... TO STDOUT, without holding its rows in
+        memory.
+
+            >>> with open('vacuum_stats.csv', 'wb') as export_file:
+            ...     pg.export('vacuum_stats', export_file, raw=True)
+            30412
+
+        Values are written the way the server prints them, so raw=True is
+        what you want for anything but reading.
+
+        :param report: name of the report method, e.g. 'vacuum_stats'
+        :param file: binary file object to write to
+        :param format: 'csv', 'ndjson', 'arrow' or 'parquet'
+        :param params: query parameters overriding the report's defaults
+        :param options: passed on to render
+        :returns: int, rows written
         """
-        Execute the given sql statement.
 
-        :param statement: sql statement to run
-        :returns: list
+        from .export import FORMATS, copy_statement, write_arrow
+
+        if format not in FORMATS:
+            raise ValueError('Unknown format: {}'.format(format))
+
+        # row_to_json came with 9.2
+        if format == 'ndjson' and not self.profile.is_at_least(90200):
+            raise psycopg2.NotSupportedError(
+                'NDJSON exports need PostgreSQL 9.2 or later'
+            )
+
+        with self.connection() as conn, self._transaction(conn):
+            with conn.cursor() as cursor:
+                # COPY takes no parameters, they are interpolated here
+                statement = cursor.mogrify(
+                    self.render(report, **options),
+                    self.report_params(report, params)
+                ).decode(psycopg2.extensions.encodings[conn.encoding])
+
+                # The SET LOCAL timeouts are undone with the savepoint
+                cursor.execute(
+                    'SAVEPOINT pgextras_export;'
+                    + self._set_local(conn, cursor, report)
+                )
+
+                try:
+                    if format in ('arrow', 'parquet'):
+                        rows = write_arrow(cursor, statement, file, format)
+                    else:
+                        cursor.copy_expert(
+                            copy_statement(statement, format), file
+                        )
+                        rows = cursor.rowcount
+                finally:
+                    cursor.execute(
+                        'ROLLBACK TO SAVEPOINT pgextras_export;'
+                        'RELEASE SAVEPOINT pgextras_export'
+                    )
+
+        return rows
+
+    def snapshot(self, reports):
         """
+        Run several reports against one consistent view of the database. All
+        statements are sent together in a single round trip inside a
+        REPEATABLE READ, READ ONLY transaction, so e.g. locks and blocking
+        can't contradict each other.
 
-        # Make the sql statement easier to read in case some of the queries we
-        # run end up in the output
-        sql = statement.replace('\n', '')
-        sql = ' '.join(sql.split())
-        self.cursor.execute(sql)
+        Rows travel as json, so values come back as json types (intervals
+        and timestamps are strings, numerics are floats).
 
-        return self.cursor.fetchall()
+        Record(
+            taken_at=datetime.datetime(2014, 5, 6, 10, 1, 22, 313000),
+            results={'locks': [Record(...)], 'blocking': []}
+        )
+
+        :param reports: names of the report methods to run
+        :returns: Record
+        """
+
+        results = {}
+        included = []
+
+        for report in reports:
+            if (report in ('calls', 'outliers')
+                    and not self.pg_stat_statement()):
+                results[report] = [self.get_missing_pg_stat_statement_error()]
+            else:
+                included.append(report)
+
+        with self.connection() as conn:
+            # End whatever transaction earlier reports left open and send our
+            # own BEGIN along with the statement instead of letting psycopg2
+            # spend a round trip on it. A caller's transaction is not ours to
+            # end though.
+            if conn.status != psycopg2.extensions.STATUS_READY:
+                if not self._owns_conn:
+                    raise psycopg2.ProgrammingError(
+                        'snapshot() needs a connection outside a transaction'
+                    )
+
+                conn.rollback()
+
+            autocommit = conn.autocommit
+            conn.autocommit = True
+
+            try:
+                with self._new_cursor(conn) as cursor:
+                    # Each report binds its own parameters, so they are
+                    # interpolated client side before the statements are
+                    # combined.
+                    columns = [
+                        sql.SNAPSHOT_COLUMN.format(
+                            statement=cursor.mogrify(
+                                self.render(report),
+                                self.report_params(report)
+                            ).decode(
+                                psycopg2.extensions.encodings[conn.encoding]
+                            ),
+                            report=report
+                        )
+                        for report in included
+                    ]
+                    statement = (
+                        normalize(sql.SNAPSHOT_BEGIN)
+                        + self._set_local(conn, cursor, 'snapshot')
+                        + normalize(sql.SNAPSHOT).format(
+                            columns=''.join(columns)
+                        )
+                    )
+
+                    try:
+                        rows = self._instrumented(
+                            conn, cursor, statement, None, 'snapshot',
+                            guarded=False
+                        )
+                    except psycopg2.Error as error:
+                        cursor.execute('ROLLBACK')
+                        timed_out = self._timed_out('snapshot', error)
+
+                        if timed_out is None:
+                            raise
+
+                        rows = None
+                    else:
+                        cursor.execute('COMMIT')
+            finally:
+                conn.autocommit = autocommit
+
+        Snapshot = namedtuple('Record', 'taken_at results')
+
+        if rows is None:
+            for report in included:
+                results[report] = [timed_out._replace(report=report)]
+
+            return Snapshot(None, results)
+
+        snapshot = rows[0]._asdict()
+        taken_at = snapshot.pop('taken_at')
+
+        for report, rows in snapshot.items():
+            if rows:
+                Record = namedtuple('Record', rows[0].keys())
+                rows = [Record(**row) for row in rows]
+
+            results[report] = rows
+
+        return Snapshot(taken_at, results)
 
     def cache_hit(self):
         """
@@ -193,24 +851,26 @@ class PgExtras(object):
         :returns: list of Records
         """
 
-        return self.execute(sql.CACHE_HIT)
+        return self.run_report('cache_hit')
 
-    def index_usage(self):
+    def index_usage(self, limit=None):
         """
         Calculates your index hit rate (effective databases are at 99% and up).
 
         Record(
+            schemaname='public',
             relname='pgbench_history',
             percent_of_times_index_used=None,
             rows_in_table=249976
         )
 
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(sql.INDEX_USAGE)
+        return self.run_report('index_usage', params={'limit': limit})
 
-    def calls(self, truncate=False):
+    def calls(self, truncate=False, raw=False, limit=10):
         """
         Show 10 most frequently called queries. Requires the pg_stat_statements
         Postgres module to be installed.
@@ -224,29 +884,55 @@ class PgExtras(object):
         )
 
         :param truncate: trim the Record.query output if greater than 40 chars
+        :param raw: return the proportion and call count as numbers
+        :param limit: number of queries to return
         :returns: list of Records
         """
 
         if self.pg_stat_statement():
-            if truncate:
-                select = """
-                    SELECT CASE
-                        WHEN length(query) < 40
-                        THEN query
-                        ELSE substr(query, 0, 38) || '..'
-                    END AS qry,
-                """
-            else:
-                select = 'SELECT query,'
+            return self.run_report(
+                'calls',
+                truncate=truncate,
+                raw=raw,
+                params={'limit': limit}
+            )
+        else:
+            return [self.get_missing_pg_stat_statement_error()]
+
+    def statement_rates(self, interval=5, limit=10):
+        """
+        Sample pg_stat_statements twice, interval seconds apart, and show the
+        statements that were busiest in between. Unlike calls() and
+        outliers() this reflects what is expensive right now. Requires the
+        pg_stat_statements Postgres module to be installed.
 
-            return self.execute(sql.CALLS.format(select=select, tot_time=self.total_time_column))
+        Record(
+            queryid=-2419287450163284467,
+            query='UPDATE pgbench_tellers SET tbalance = tbalance + $1',
+            calls_per_sec=412.5,
+            exec_time_per_sec=181.2,
+            blks_read_per_sec=0.0,
+            rows_per_sec=412.5,
+            mean_time=0.439
+        )
+
+        :param interval: seconds between the two samples
+        :param limit: number of statements to return
+        :returns: list of Records, times are in milliseconds
+        """
+
+        if self.pg_stat_statement():
+            sampler = StatementSampler(self, limit)
+
+            return list(sampler.run(interval))[-1]
         else:
             return [self.get_missing_pg_stat_statement_error()]
 
-    def blocking(self):
+    def blocking(self, limit=None):
         """
         Display queries holding locks other queries are waiting to be
-        released.
+        released, one row per waiting and blocking pair. See lock_graph()
+        for whole wait chains.
 
         Record(
             pid=40821,
@@ -256,17 +942,44 @@ class PgExtras(object):
             query='SELECT pg_sleep(10);'
         )
 
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(
-            sql.BLOCKING.format(
-                query_column=self.query_column,
-                pid_column=self.pid_column
-            )
+        return self.run_report('blocking', params={'limit': limit})
+
+    def lock_graph(self):
+        """
+        Every backend that waits for a lock or holds one others wait for,
+        with the root blockers everything is queued up behind, how deep in a
+        wait chain each backend is, how many backends wait for it directly
+        (fan_out) and in total, and any cycle (deadlock) it is part of. Waits
+        for any kind of lock are included: relations, rows, transactions,
+        advisory locks and so on.
+
+        Record(
+            pid=4102,
+            blocked_by=[],
+            root_blockers=[4102],
+            depth=0,
+            fan_out=3,
+            blocked_total=41,
+            cycle=None,
+            duration=datetime.timedelta(0, 312, 52),
+            query='ALTER TABLE accounts ADD COLUMN note text'
         )
 
-    def outliers(self, truncate=False):
+        :returns: list of Records, root blockers first
+        """
+
+        records = self.run_report('lock_graph', row_format='record')
+
+        if is_error(records):
+            return records
+
+        return build_lock_graph(records)
+
+    def outliers(self, truncate=False, raw=False, limit=10):
         """
         Show 10 queries that have longest execution time in aggregate. Requires
         the pg_stat_statments Postgres module to be installed.
@@ -280,25 +993,25 @@ class PgExtras(object):
         )
 
         :param truncate: trim the Record.qry output if greater than 40 chars
+        :param raw: return the proportion and call count as numbers
+        :param limit: number of queries to return
         :returns: list of Records
         """
 
         if self.pg_stat_statement():
-            if truncate:
-                query = """
-                    CASE WHEN length(query) < 40
-                        THEN query
-                        ELSE substr(query, 0, 38) || '..'
-                    END
-                """
-            else:
-                query = 'query'
-
-            return self.execute(sql.OUTLIERS.format(query=query, tot_time=self.total_time_column))
+            return self.run_report(
+                'outliers',
+                truncate=truncate,
+                raw=raw,
+                params={'limit': limit}
+            )
         else:
             return [self.get_missing_pg_stat_statement_error()]
 
-    def vacuum_stats(self):
+    def vacuum_stats(
+            self, raw=False, limit=None, schemas=None, exclude_schemas=None,
+            relations=None
+    ):
         """
         Show dead rows and whether an automatic vacuum is expected to be
         triggered.
@@ -314,15 +1027,38 @@ class PgExtras(object):
             expect_autovacuum=None
         )
 
+        :param raw: return sizes in bytes and counts as numbers
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
         :returns: list of Records
         """
 
-        return self.execute(sql.VACUUM_STATS)
+        return self.run_report(
+            'vacuum_stats',
+            raw=raw,
+            params={
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
 
-    def bloat(self):
+    def bloat(
+            self, raw=False, limit=None, schemas=None, exclude_schemas=None,
+            relations=None, exact=False, exact_top=10, max_workers=4
+    ):
         """
         Table and index bloat in your database ordered by most wasteful.
 
+        The bloat is estimated from the planner statistics, which is cheap
+        but can be far off. With exact=True the exact_top most wasteful
+        estimates are measured with the pgstattuple extension instead
+        (pgstattuple_approx for tables, pgstatindex for btree indexes),
+        spread over up to max_workers connections of their own.
+
         Record(
             type='index',
             schemaname='public',
@@ -331,14 +1067,148 @@ class PgExtras(object):
             waste='0 bytes'
         )
 
+        :param raw: return sizes in bytes and counts as numbers, along with
+            the oid of the table or index
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        :param exact: measure the worst candidates with pgstattuple
+        :param exact_top: number of candidates to measure
+        :param max_workers: candidates measured at the same time
         :returns: list of Records
         """
 
-        return self.execute(sql.BLOAT)
+        params = {
+            'limit': limit,
+            'schemas': schemas,
+            'exclude_schemas': exclude_schemas,
+            'relations': relations
+        }
+
+        if not exact:
+            return self.run_report('bloat', raw=raw, params=params)
+
+        if not self.profile.has_extension('pgstattuple'):
+            return [self.get_missing_pgstattuple_error()]
+
+        params['limit'] = exact_top
+
+        try:
+            candidates = self.execute(
+                self.render('bloat', raw=True),
+                self.report_params('bloat', params),
+                report='bloat',
+                row_format='tuple'
+            )
+            columns, candidates = candidates.columns, candidates.records()
+            measured = self._measure_bloat(candidates, max_workers)
+        except psycopg2.OperationalError as error:
+            timed_out = self._timed_out('bloat', error)
+
+            if timed_out is None:
+                raise
+
+            return [timed_out]
+
+        records = self.merge_exact_bloat(candidates, measured, limit)
+
+        if raw:
+            return format_rows(
+                columns, [tuple(record) for record in records],
+                self.row_format
+            )
+
+        return self.execute(
+            PRETTY_EXACT_BLOAT,
+            self.exact_bloat_params(records),
+            row_format=self.row_format
+        )
+
+    def _measure_bloat(self, candidates, max_workers):
+        """
+        Measure the bloat candidates pgstattuple can handle. Without a pool
+        or a connection string of our own they are measured one by one on
+        the one connection we have.
 
-    def long_running_queries(self):
+        :returns: dict of oid to Record(bloat, waste)
         """
-        Show all queries longer than five minutes by descending duration.
+
+        indexes = [c.oid for c in candidates if c.type == 'index']
+
+        with self.connection() as conn:
+            with self._new_cursor(conn) as cursor:
+                cursor.execute(sql.BTREE_INDEXES, {'oids': indexes})
+                btree = set(row.oid for row in cursor.fetchall())
+
+        measurable = [
+            candidate for candidate in candidates
+            if candidate.type == 'table' or candidate.oid in btree
+        ]
+
+        if self.pool is None and not self._owns_conn:
+            max_workers = 1
+
+        workers = max(min(max_workers, len(measurable)), 1)
+        batches = [measurable[worker::workers] for worker in range(workers)]
+
+        if workers == 1:
+            return self._measure_batch(self.connection, batches[0])
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                self._measure_batch,
+                [self._worker_connection] * workers,
+                batches
+            )
+
+            measured = {}
+
+            for result in results:
+                measured.update(result)
+
+        return measured
+
+    def _measure_batch(self, connection, candidates):
+        measured = {}
+
+        with connection() as conn:
+            with self._new_cursor(conn) as cursor:
+                for candidate in candidates:
+                    measured[candidate.oid] = self._instrumented(
+                        conn,
+                        cursor,
+                        self.exact_bloat_statement(candidate.type),
+                        {'oid': candidate.oid},
+                        'bloat'
+                    )[0]
+
+        return measured
+
+    @contextmanager
+    def _worker_connection(self):
+        """
+        A connection for one of several threads: borrowed from the pool, or
+        opened just for the thread.
+        """
+
+        if self.pool is not None:
+            with self.connection() as conn:
+                yield conn
+        else:
+            conn = self._connect()
+
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def long_running_queries(self, min_duration='5 minutes', limit=None):
+        """
+        Show all queries running longer than min_duration (five minutes by
+        default) by descending duration.
 
         Record(
             pid=19578,
@@ -346,37 +1216,50 @@ class PgExtras(object):
             query='SELECT * FROM students'
         )
 
+        :param min_duration: only show queries running longer than this,
+            an interval string or a timedelta
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        if self.is_pg_at_least_nine_two():
-            idle = "AND state <> 'idle'"
-        else:
-            idle = "AND current_query <> '<IDLE>'"
-
-        return self.execute(
-            sql.LONG_RUNNING_QUERIES.format(
-                pid_column=self.pid_column,
-                query_column=self.query_column,
-                idle=idle
-            )
+        return self.run_report(
+            'long_running_queries',
+            params={'min_duration': min_duration, 'limit': limit}
         )
 
-    def seq_scans(self):
+    def seq_scans(
+            self, limit=None, schemas=None, exclude_schemas=None,
+            relations=None
+    ):
         """
         Show the count of sequential scans by table descending by order.
 
         Record(
+            schemaname='public',
             name='pgbench_branches',
             count=237
         )
 
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
         :returns: list of Records
         """
 
-        return self.execute(sql.SEQ_SCANS)
+        return self.run_report(
+            'seq_scans',
+            params={
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
 
-    def unused_indexes(self):
+    def unused_indexes(
+            self, raw=False, max_scans=50, min_size_bytes=0, limit=None
+    ):
         """
         Show unused and almost unused indexes, ordered by their size relative
         to the number of index scans. Exclude indexes of very small tables
@@ -390,12 +1273,28 @@ class PgExtras(object):
             index_scans=0
         )
 
+        :param raw: return sizes in bytes and counts as numbers
+        :param max_scans: indexes scanned at least this many times count
+            as used
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(sql.UNUSED_INDEXES)
+        return self.run_report(
+            'unused_indexes',
+            raw=raw,
+            params={
+                'max_scans': max_scans,
+                'min_size_bytes': min_size_bytes,
+                'limit': limit
+            }
+        )
 
-    def total_table_size(self):
+    def total_table_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
         """
         Show the size of the tables (including indexes), descending by size.
 
@@ -404,12 +1303,29 @@ class PgExtras(object):
             size='15 MB'
         )
 
+        :param raw: return sizes in bytes and counts as numbers, with the
+            schemaname of each table
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
         :returns: list of Records
         """
 
-        return self.execute(sql.TOTAL_TABLE_SIZE)
+        return self.run_report(
+            'total_table_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
 
-    def total_indexes_size(self):
+    def total_indexes_size(self, raw=False, min_size_bytes=0, limit=None):
         """
         Show the total size of all the indexes on each table, descending by
         size.
@@ -419,30 +1335,77 @@ class PgExtras(object):
             index_size='2208 kB'
         )
 
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(sql.TOTAL_INDEXES_SIZE)
+        return self.run_report(
+            'total_indexes_size',
+            raw=raw,
+            params={'min_size_bytes': min_size_bytes, 'limit': limit}
+        )
 
-    def table_size(self):
+    def table_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
         """
         Show the size of the tables (excluding indexes), descending by size.
 
+        :param raw: return sizes in bytes and counts as numbers, with the
+            schemaname of each table
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
         :returns: list
         """
 
-        return self.execute(sql.TABLE_SIZE)
+        return self.run_report(
+            'table_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
 
-    def index_size(self):
+    def index_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
         """
         Show the size of indexes, descending by size.
 
+        :param raw: return sizes in bytes and counts as numbers, with the
+            schemaname of each index
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at indexes with these names
         :returns: list
         """
 
-        return self.execute(sql.INDEX_SIZE)
+        return self.run_report(
+            'index_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
 
-    def total_index_size(self):
+    def total_index_size(self, raw=False):
         """
         Show the total size of all indexes.
 
@@ -450,12 +1413,13 @@ class PgExtras(object):
             size='2240 kB'
         )
 
+        :param raw: return sizes in bytes and counts as numbers
         :returns: list of Records
         """
 
-        return self.execute(sql.TOTAL_INDEX_SIZE)
+        return self.run_report('total_index_size', raw=raw)
 
-    def locks(self):
+    def locks(self, limit=None):
         """
         Display queries with active locks.
 
@@ -468,17 +1432,13 @@ class PgExtras(object):
             age=datetime.timedelta(0, 0, 288174),
         )
 
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(
-            sql.LOCKS.format(
-                pid_column=self.pid_column,
-                query_column=self.query_column
-            )
-        )
+        return self.run_report('locks', params={'limit': limit})
 
-    def table_indexes_size(self):
+    def table_indexes_size(self, raw=False, min_size_bytes=0, limit=None):
         """
         Show the total size of all the indexes on each table, descending by
         size.
@@ -488,12 +1448,19 @@ class PgExtras(object):
             index_size='2208 kB'
         )
 
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        return self.execute(sql.TABLE_INDEXES_SIZE)
+        return self.run_report(
+            'table_indexes_size',
+            raw=raw,
+            params={'min_size_bytes': min_size_bytes, 'limit': limit}
+        )
 
-    def ps(self):
+    def ps(self, limit=None):
         """
         View active queries with execution time.
 
@@ -505,21 +1472,11 @@ class PgExtras(object):
             query='UPDATE pgbench_accounts SET abalance = abalance + 423;'
         )
 
+        :param limit: return at most this many rows
         :returns: list of Records
         """
 
-        if self.is_pg_at_least_nine_two():
-            idle = "AND state <> 'idle'"
-        else:
-            idle = "AND current_query <> '<IDLE>'"
-
-        return self.execute(
-            sql.PS.format(
-                pid_column=self.pid_column,
-                query_column=self.query_column,
-                idle=idle
-            )
-        )
+        return self.run_report('ps', params={'limit': limit})
 
     def version(self):
         """
@@ -532,4 +1489,4 @@ class PgExtras(object):
         :returns: list of Records
         """
 
-        return self.execute(sql.VERSION)
+        return self.run_report('version')
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio client with the same reports as PgExtras. Needs the aiopg package
+(pip install pgextras[async]).
+"""
+
+import asyncio
+
+import aiopg
+import psycopg2.extras
+
+from . import sql_constants as sql
+from .base import PRETTY_EXACT_BLOAT, BasePgExtras
+from .lockgraph import build_lock_graph
+from .profile import ServerProfile, get_profile, set_profile
+
+
+class AsyncPgExtras(BasePgExtras):
+    """
+    Every report is a coroutine and borrows a connection from a small pool,
+    so several reports can run at the same time:
+
+        >>> async with AsyncPgExtras(dsn='dbname=testing') as pg:
+        ...     ps, locks = await asyncio.gather(pg.ps(), pg.locks())
+    """
+
+    def __init__(self, dsn=None, pool_size=4):
+        self.dsn = dsn
+        self.pool_size = pool_size
+        self._pool = None
+        self._profile = None
+
+    async def __aenter__(self):
+        await self.connect()
+
+        return self
+
+    async def __aexit__(self, type, value, trace):
+        await self.close_db_connection()
+
+    @property
+    def profile(self):
+        """
+        :returns: ServerProfile
+        """
+
+        if self._profile is None:
+            raise RuntimeError('Call connect() before running reports')
+
+        return self._profile
+
+    async def connect(self):
+        """
+        Open the connection pool and resolve the server profile.
+        """
+
+        if self._pool is not None:
+            return
+
+        # hstore support costs a catalog query per connection and none of the
+        # reports need it.
+        self._pool = await aiopg.create_pool(
+            self.dsn,
+            minsize=1,
+            maxsize=self.pool_size,
+            enable_hstore=False
+        )
+
+        async with self._pool.acquire() as conn:
+            key = conn.dsn
+            profile = get_profile(key)
+
+            if profile is None:
+                async with conn.cursor(
+                    cursor_factory=psycopg2.extras.NamedTupleCursor
+                ) as cursor:
+                    await cursor.execute(sql.EXTENSIONS)
+                    rows = await cursor.fetchall()
+
+                extensions = dict(
+                    (row.extname, row.extversion) for row in rows
+                )
+                profile = ServerProfile(conn.server_version, extensions)
+                set_profile(key, profile)
+
+            self._profile = profile
+
+    async def close_db_connection(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    async def execute(self, statement, params=None):
+        """
+        Execute the given sql statement on a pooled connection. It is always
+        run with parameters, so a literal % is written as %%.
+
+        :param statement: sql statement to run
+        :param params: query parameters, e.g. {'limit': 10}
+        :returns: list
+        """
+
+        params = {} if params is None else params
+
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(
+                cursor_factory=psycopg2.extras.NamedTupleCursor
+            ) as cursor:
+                await cursor.execute(statement, params)
+
+                return await cursor.fetchall()
+
+    async def run_report(self, report, params=None, **options):
+        """
+        Render and execute a report.
+
+        :param report: name of the report method, e.g. 'ps'
+        :param params: query parameters overriding the report's defaults
+        :param options: passed on to render
+        :returns: list of Records
+        """
+
+        return await self.execute(
+            self.render(report, **options),
+            self.report_params(report, params)
+        )
+
+    async def run(self, reports):
+        """
+        Run several reports concurrently.
+
+        :param reports: names of the report methods to run
+        :returns: dict of report name to list of Records
+        """
+
+        results = await asyncio.gather(
+            *[getattr(self, report)() for report in reports]
+        )
+
+        return dict(zip(reports, results))
+
+    async def cache_hit(self):
+        """
+        See PgExtras.cache_hit.
+        """
+
+        return await self.run_report('cache_hit')
+
+    async def index_usage(self, limit=None):
+        """
+        See PgExtras.index_usage.
+
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report('index_usage', params={'limit': limit})
+
+    async def calls(self, truncate=False, raw=False, limit=10):
+        """
+        See PgExtras.calls.
+
+        :param limit: number of queries to return
+        """
+
+        if self.pg_stat_statement():
+            return await self.run_report(
+                'calls',
+                truncate=truncate,
+                raw=raw,
+                params={'limit': limit}
+            )
+        else:
+            return [self.get_missing_pg_stat_statement_error()]
+
+    async def blocking(self, limit=None):
+        """
+        See PgExtras.blocking.
+
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report('blocking', params={'limit': limit})
+
+    async def lock_graph(self):
+        """
+        See PgExtras.lock_graph.
+        """
+
+        return build_lock_graph(await self.run_report('lock_graph'))
+
+    async def outliers(self, truncate=False, raw=False, limit=10):
+        """
+        See PgExtras.outliers.
+
+        :param limit: number of queries to return
+        """
+
+        if self.pg_stat_statement():
+            return await self.run_report(
+                'outliers',
+                truncate=truncate,
+                raw=raw,
+                params={'limit': limit}
+            )
+        else:
+            return [self.get_missing_pg_stat_statement_error()]
+
+    async def vacuum_stats(
+            self, raw=False, limit=None, schemas=None, exclude_schemas=None,
+            relations=None
+    ):
+        """
+        See PgExtras.vacuum_stats.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        """
+
+        return await self.run_report(
+            'vacuum_stats',
+            raw=raw,
+            params={
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
+
+    async def bloat(
+            self, raw=False, limit=None, schemas=None, exclude_schemas=None,
+            relations=None, exact=False, exact_top=10, max_workers=4
+    ):
+        """
+        See PgExtras.bloat. Exact measurements run on pooled connections,
+        so pool_size caps them as well.
+
+        :param raw: return sizes in bytes and counts as numbers, along with
+            the oid of the table or index
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        :param exact: measure the worst candidates with pgstattuple
+        :param exact_top: number of candidates to measure
+        :param max_workers: candidates measured at the same time
+        """
+
+        params = {
+            'limit': limit,
+            'schemas': schemas,
+            'exclude_schemas': exclude_schemas,
+            'relations': relations
+        }
+
+        if not exact:
+            return await self.run_report('bloat', raw=raw, params=params)
+
+        if not self.profile.has_extension('pgstattuple'):
+            return [self.get_missing_pgstattuple_error()]
+
+        params['limit'] = exact_top
+        candidates = await self.run_report('bloat', raw=True, params=params)
+        btree = await self.execute(
+            sql.BTREE_INDEXES,
+            {'oids': [c.oid for c in candidates if c.type == 'index']}
+        )
+        btree = set(row.oid for row in btree)
+        measurable = [
+            candidate for candidate in candidates
+            if candidate.type == 'table' or candidate.oid in btree
+        ]
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def measure(candidate):
+            async with semaphore:
+                rows = await self.execute(
+                    self.exact_bloat_statement(candidate.type),
+                    {'oid': candidate.oid}
+                )
+
+            return candidate.oid, rows[0]
+
+        measured = dict(
+            await asyncio.gather(*[measure(c) for c in measurable])
+        )
+        records = self.merge_exact_bloat(candidates, measured, limit)
+
+        if raw:
+            return records
+
+        return await self.execute(
+            PRETTY_EXACT_BLOAT, self.exact_bloat_params(records)
+        )
+
+    async def long_running_queries(self, min_duration='5 minutes', limit=None):
+        """
+        See PgExtras.long_running_queries.
+
+        :param min_duration: only show queries running longer than this,
+            an interval string or a timedelta
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report(
+            'long_running_queries',
+            params={'min_duration': min_duration, 'limit': limit}
+        )
+
+    async def seq_scans(
+            self, limit=None, schemas=None, exclude_schemas=None,
+            relations=None
+    ):
+        """
+        See PgExtras.seq_scans.
+
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        """
+
+        return await self.run_report(
+            'seq_scans',
+            params={
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
+
+    async def unused_indexes(
+            self, raw=False, max_scans=50, min_size_bytes=0, limit=None
+    ):
+        """
+        See PgExtras.unused_indexes.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param max_scans: indexes scanned at least this many times count
+            as used
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report(
+            'unused_indexes',
+            raw=raw,
+            params={
+                'max_scans': max_scans,
+                'min_size_bytes': min_size_bytes,
+                'limit': limit
+            }
+        )
+
+    async def total_table_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
+        """
+        See PgExtras.total_table_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        """
+
+        return await self.run_report(
+            'total_table_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
+
+    async def total_indexes_size(
+            self, raw=False, min_size_bytes=0, limit=None
+    ):
+        """
+        See PgExtras.total_indexes_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report(
+            'total_indexes_size',
+            raw=raw,
+            params={'min_size_bytes': min_size_bytes, 'limit': limit}
+        )
+
+    async def table_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
+        """
+        See PgExtras.table_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at tables with these names
+        """
+
+        return await self.run_report(
+            'table_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
+
+    async def index_size(
+            self, raw=False, min_size_bytes=0, limit=None, schemas=None,
+            exclude_schemas=None, relations=None
+    ):
+        """
+        See PgExtras.index_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        :param schemas: only look at these schemas
+        :param exclude_schemas: leave out these schemas
+        :param relations: only look at indexes with these names
+        """
+
+        return await self.run_report(
+            'index_size',
+            raw=raw,
+            params={
+                'min_size_bytes': min_size_bytes,
+                'limit': limit,
+                'schemas': schemas,
+                'exclude_schemas': exclude_schemas,
+                'relations': relations
+            }
+        )
+
+    async def total_index_size(self, raw=False):
+        """
+        See PgExtras.total_index_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        """
+
+        return await self.run_report('total_index_size', raw=raw)
+
+    async def locks(self, limit=None):
+        """
+        See PgExtras.locks.
+
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report('locks', params={'limit': limit})
+
+    async def table_indexes_size(
+            self, raw=False, min_size_bytes=0, limit=None
+    ):
+        """
+        See PgExtras.table_indexes_size.
+
+        :param raw: return sizes in bytes and counts as numbers
+        :param min_size_bytes: leave out anything smaller than this
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report(
+            'table_indexes_size',
+            raw=raw,
+            params={'min_size_bytes': min_size_bytes, 'limit': limit}
+        )
+
+    async def ps(self, limit=None):
+        """
+        See PgExtras.ps.
+
+        :param limit: return at most this many rows
+        """
+
+        return await self.run_report('ps', params={'limit': limit})
+
+    async def version(self):
+        """
+        See PgExtras.version.
+        """
+
+        return await self.run_report('version')
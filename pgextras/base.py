@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+
+"""
+Logic shared by the blocking and the asyncio clients: everything that only
+depends on the server profile, not on how statements are sent.
+"""
+
+from collections import namedtuple
+
+from . import sql_constants as sql
+
+
+def is_error(records):
+    """
+    Whether a report returned an error Record (a timeout, a missing
+    extension) in place of its rows. Error Records have none of the report's
+    columns, so anything built on the rows has to check for them first.
+
+    :param records: list of Records, Rows or Columns
+    :returns: bool
+    """
+
+    return any(getattr(record, 'error', None) for record in records)
+
+
+def normalize(statement):
+    """
+    Collapse a statement onto one line. Makes the sql statement easier to read
+    in case some of the queries we run end up in the output.
+
+    :param statement: sql statement
+    :returns: str
+    """
+
+    statement = statement.replace('\n', '')
+
+    return ' '.join(statement.split())
+
+
+# Templates are normalized once here and every rendered statement is kept per
+# server version, so running a report repeatedly costs no string work and the
+# server always sees byte for byte the same statement.
+TEMPLATES = dict(
+    (report, normalize(template)) for report, template in sql.REPORTS.items()
+)
+PRETTY = dict(
+    (report, normalize(template)) for report, template in sql.PRETTY.items()
+)
+CALLS_TRUNCATED_SELECT = normalize(sql.CALLS_TRUNCATED_SELECT)
+OUTLIERS_TRUNCATED_QUERY = normalize(sql.OUTLIERS_TRUNCATED_QUERY)
+LOCK_WAITS = normalize(sql.LOCK_WAITS)
+LOCK_WAITS_PG_LOCKS = normalize(sql.LOCK_WAITS_PG_LOCKS)
+PRETTY_EXACT_BLOAT = PRETTY['bloat'].format(
+    statement=normalize(sql.BLOAT_EXACT_ROWS)
+)
+
+_rendered = {}
+
+
+class BasePgExtras(object):
+    """
+    Subclasses provide a ``profile`` attribute holding the ServerProfile of
+    the server they talk to.
+    """
+
+    @property
+    def query_column(self):
+        """
+        PG9.2 changed column names.
+
+        :returns: str
+        """
+
+        if self.is_pg_at_least_nine_two():
+            return 'query'
+        else:
+            return 'current_query'
+
+    @property
+    def pid_column(self):
+        """
+        PG9.2 changed column names.
+
+        :returns: str
+        """
+
+        if self.is_pg_at_least_nine_two():
+            return 'pid'
+        else:
+            return 'procpid'
+
+    @property
+    def total_time_column(self):
+        """
+        PG13 changed column names.
+
+        :returns: str
+        """
+
+        if self.is_pg_at_least_thirteen():
+            return 'total_exec_time'
+        else:
+            return 'total_time'
+
+    def pg_stat_statement(self):
+        """
+        Some queries require the pg_stat_statement module to be installed.
+        http://www.postgresql.org/docs/current/static/pgstatstatements.html
+
+        :returns: boolean
+        """
+
+        return self.profile.has_extension('pg_stat_statements')
+
+    def get_missing_pg_stat_statement_error(self):
+        Record = namedtuple('Record', 'error')
+        error = """
+            pg_stat_statements extension needs to be installed in the
+            public schema first. This extension is only available on
+            Postgres versions 9.2 or greater. You can install it by
+            adding pg_stat_statements to shared_preload_libraries in
+            postgresql.conf, restarting postgres and then running the
+            following sql statement in your database:
+            CREATE EXTENSION pg_stat_statements;
+        """
+
+        return Record(error)
+
+    def get_timeout_error(self, report, setting, value, error):
+        """
+        What a report returns instead of raising when it was cancelled by
+        one of its timeouts.
+
+        Record(
+            error='canceling statement due to statement timeout',
+            report='bloat',
+            setting='statement_timeout',
+            value='5s'
+        )
+        """
+
+        Record = namedtuple('Record', 'error report setting value')
+
+        return Record(str(error).strip(), report, setting, value)
+
+    def get_missing_pgstattuple_error(self):
+        Record = namedtuple('Record', 'error')
+        error = """
+            pgstattuple extension needs to be installed to measure bloat
+            exactly. You can install it by running the following sql
+            statement in your database: CREATE EXTENSION pgstattuple;
+        """
+
+        return Record(error)
+
+    def exact_bloat_statement(self, type):
+        """
+        The statement measuring one bloat candidate with pgstattuple.
+
+        :param type: 'table' or 'index'
+        :returns: str
+        """
+
+        if type == 'index':
+            return sql.BLOAT_EXACT_INDEX
+
+        version = self.profile.extension_version('pgstattuple')
+
+        if tuple(int(part) for part in version.split('.')) >= (1, 3):
+            return sql.BLOAT_EXACT_TABLE
+        else:
+            return sql.BLOAT_EXACT_TABLE_SCAN
+
+    def merge_exact_bloat(self, candidates, measured, limit=None):
+        """
+        Replace the estimates of the measured candidates, most wasteful
+        first.
+
+        :param candidates: raw bloat Records
+        :param measured: dict of oid to Record(bloat, waste)
+        :param limit: only return this many Records
+        :returns: list of Records
+        """
+
+        merged = [
+            candidate._replace(**measured[candidate.oid]._asdict())
+            if candidate.oid in measured else candidate
+            for candidate in candidates
+        ]
+        merged.sort(
+            key=lambda record: (record.waste, record.bloat), reverse=True
+        )
+
+        return merged[:limit]
+
+    def exact_bloat_params(self, records):
+        """
+        :param records: raw bloat Records
+        :returns: parameters of sql.BLOAT_EXACT_ROWS
+        """
+
+        return dict(
+            (field, [getattr(record, field) for record in records])
+            for field in ('type', 'schemaname', 'object_name', 'bloat',
+                          'waste', 'oid')
+        )
+
+    def is_pg_at_least_nine_two(self):
+        """
+        Some queries have different syntax depending what version of postgres
+        we are querying against.
+
+        :returns: boolean
+        """
+
+        return self.profile.is_at_least(90200)
+
+    def is_pg_at_least_thirteen(self):
+        """
+        Some queries have different syntax depending what version of postgres
+        we are querying against.
+
+        :returns: boolean
+        """
+
+        return self.profile.is_at_least(130000)
+
+    def report_params(self, report, params=None):
+        """
+        Query parameters for a report: the defaults, overridden by params.
+        They are sent along with the statement so the server does the
+        filtering.
+
+        :param report: name of the report method, e.g. 'ps'
+        :param params: dict of parameter values, e.g. {'limit': 5}
+        :returns: dict
+        """
+
+        values = dict(sql.PARAMS)
+        values.update(sql.REPORT_PARAMS.get(report, {}))
+
+        for name, value in (params or {}).items():
+            # psycopg2 sends lists as arrays but tuples as records, names
+            # are compared with = ANY(array).
+            if isinstance(value, (tuple, set, frozenset)):
+                value = list(value)
+
+            values[name] = value
+
+        return values
+
+    def render(self, report, truncate=False, raw=False):
+        """
+        Build the sql statement behind a report for the connected server. The
+        result is cached per report and server version.
+
+        :param report: name of the report method, e.g. 'ps'
+        :param truncate: trim the query text of calls and outliers
+        :param raw: keep sizes, counts, ratios and timestamps as numbers and
+            datetimes instead of formatting them for display
+        :returns: str
+        """
+
+        key = (report, truncate, raw, self.profile.version_num)
+
+        try:
+            return _rendered[key]
+        except KeyError:
+            pass
+
+        try:
+            template = TEMPLATES[report]
+        except KeyError:
+            raise ValueError('Unknown report: {}'.format(report))
+
+        if self.is_pg_at_least_nine_two():
+            idle = "AND state <> 'idle'"
+        else:
+            idle = "AND current_query <> '<IDLE>'"
+
+        # pg_stat_statements only exposes queryid since 9.4
+        if self.profile.is_at_least(90400):
+            queryid = 'queryid'
+        else:
+            queryid = 'md5(query)'
+
+        if self.profile.is_at_least(90600):
+            waits = LOCK_WAITS
+        else:
+            waits = LOCK_WAITS_PG_LOCKS
+
+        if truncate:
+            select = CALLS_TRUNCATED_SELECT
+            query = OUTLIERS_TRUNCATED_QUERY
+        else:
+            select = 'SELECT query,'
+            query = 'query'
+
+        statement = template.format(
+            pid_column=self.pid_column,
+            query_column=self.query_column,
+            tot_time=self.total_time_column,
+            idle=idle,
+            select=select,
+            query=query,
+            queryid=queryid,
+            waits=waits
+        )
+
+        if not raw and report in PRETTY:
+            statement = PRETTY[report].format(
+                statement=statement,
+                qry='qry' if truncate else 'query'
+            )
+
+        _rendered[key] = statement
+
+        return statement
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reuse the results of reports that change slowly instead of scanning the
+catalog on every call:
+
+    >>> cache = ResultCache(ttls={'bloat': 600})
+    >>> pg = PgExtras(dsn=dsn, cache=cache)
+    >>> pg.bloat()    # runs the report
+    >>> pg.bloat()    # served from the cache for the next 10 minutes
+
+Results are kept per connection string, report and parameters. By default
+they live in memory, shared by the threads of one process. A SQLiteBackend
+shares them between processes through a file; whichever process finds an
+entry stale first refreshes it while the others keep serving the stale
+result, so a report is never run by several workers at once.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from .base import is_error
+from .rows import Columns, Rows, format_rows
+
+Entry = namedtuple('Entry', 'expires records')
+
+# Reports whose results are cached unless told otherwise, and for how long
+# (seconds). Anything about activity (locks, ps, blocking, ...) has to be
+# current to be of any use and is not cached.
+DEFAULT_TTLS = {
+    'bloat': 3600,
+    'index_size': 300,
+    'table_indexes_size': 300,
+    'table_size': 300,
+    'total_index_size': 300,
+    'total_indexes_size': 300,
+    'total_table_size': 300,
+    'unused_indexes': 600,
+    'version': 86400,
+}
+
+
+def dump_records(records):
+    """
+    Records are namedtuples made up on the fly by the cursor, so every row
+    format is stored as its column names and plain tuples.
+
+    :param records: list of Records, Rows or Columns
+    :returns: bytes
+    """
+
+    if isinstance(records, Columns):
+        value = ('columnar', records.columns, records.rows())
+    elif isinstance(records, Rows):
+        value = ('tuple', records.columns, list(records))
+    else:
+        value = (
+            'record',
+            records[0]._fields if records else [],
+            [tuple(record) for record in records]
+        )
+
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def copy_records(records):
+    """
+    A copy of the containers, so a caller changing its result can't change
+    what the next one is served. Records and rows are tuples and are shared.
+
+    :param records: list of Records, Rows or Columns
+    :returns: list of Records, Rows or Columns
+    """
+
+    if isinstance(records, Columns):
+        return Columns(records.columns, records.rows())
+
+    if isinstance(records, Rows):
+        return Rows(records.columns, records)
+
+    return list(records)
+
+
+def load_records(data):
+    """
+    :param data: bytes from dump_records
+    :returns: list of Records, Rows or Columns
+    """
+
+    row_format, columns, rows = pickle.loads(data)
+
+    return format_rows(columns, rows, row_format)
+
+
+class MemoryBackend(object):
+    """
+    A least recently used cache in this process, bounded by the number of
+    entries and their size.
+
+    :param max_entries: most entries kept
+    :param max_bytes: most bytes kept, measured as the pickled records
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :returns: Entry, None if there is none
+        """
+
+        with self._lock:
+            try:
+                entry, size = self._entries.pop(key)
+            except KeyError:
+                return None
+
+            self._entries[key] = (entry, size)
+
+        return Entry(entry.expires, copy_records(entry.records))
+
+    def set(self, key, expires, records):
+        size = len(dump_records(records))
+
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (
+                Entry(expires, copy_records(records)), size
+            )
+            self.size += size
+
+            while (len(self._entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def acquire(self, key, seconds):
+        """
+        Take the lease to refresh key for at most seconds.
+
+        :returns: bool, False if somebody else holds it
+        """
+
+        now = time.time()
+
+        with self._lock:
+            if self._leases.get(key, 0) > now:
+                return False
+
+            self._leases[key] = now + seconds
+
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._leases.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._leases.clear()
+            self.size = 0
+
+
+class SQLiteBackend(object):
+    """
+    Entries in a SQLite database, shared by every process that opens the
+    same file. Bounded like MemoryBackend, the least recently used entries
+    are removed first.
+
+    :param path: file of the database, created if it does not exist
+    :param max_entries: most entries kept
+    :param max_bytes: most bytes kept, measured as the pickled records
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            expires REAL NOT NULL,
+            used REAL NOT NULL,
+            records BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            until REAL NOT NULL
+        );
+    """
+
+    PRUNE = """
+        DELETE FROM entries
+        WHERE key IN (
+            SELECT key
+            FROM (
+                SELECT
+                    key,
+                    row_number() OVER (ORDER BY used DESC) AS position,
+                    sum(length(records)) OVER (
+                        ORDER BY used DESC
+                        ROWS UNBOUNDED PRECEDING
+                    ) AS total
+                FROM entries
+            )
+            WHERE position > ? OR total > ?
+        )
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(self.SCHEMA)
+
+    def _connect(self):
+        # A connection per call keeps this safe to use from any thread
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def get(self, key):
+        db = self._connect()
+
+        try:
+            row = db.execute(
+                'SELECT expires, records FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            db.execute(
+                'UPDATE entries SET used = ? WHERE key = ?',
+                (time.time(), key)
+            )
+        finally:
+            db.close()
+
+        return Entry(row[0], load_records(row[1]))
+
+    def set(self, key, expires, records):
+        data = dump_records(records)
+        db = self._connect()
+
+        try:
+            if len(data) > self.max_bytes:
+                db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return
+
+            db.execute('BEGIN IMMEDIATE')
+            db.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (key, expires, time.time(), sqlite3.Binary(data))
+            )
+            db.execute(self.PRUNE, (self.max_entries, self.max_bytes))
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def acquire(self, key, seconds):
+        """
+        Take the lease to refresh key for at most seconds, unless another
+        process holds it.
+
+        :returns: bool
+        """
+
+        now = time.time()
+        db = self._connect()
+
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                'SELECT until FROM leases WHERE key = ?', (key,)
+            ).fetchone()
+
+            if row is not None and row[0] > now:
+                db.execute('ROLLBACK')
+                return False
+
+            db.execute(
+                'INSERT OR REPLACE INTO leases VALUES (?, ?)',
+                (key, now + seconds)
+            )
+            db.execute('COMMIT')
+
+            return True
+        finally:
+            db.close()
+
+    def release(self, key):
+        db = self._connect()
+
+        try:
+            db.execute('DELETE FROM leases WHERE key = ?', (key,))
+        finally:
+            db.close()
+
+    def clear(self):
+        db = self._connect()
+
+        try:
+            db.execute('DELETE FROM entries')
+            db.execute('DELETE FROM leases')
+        finally:
+            db.close()
+
+
+class ResultCache(object):
+    """
+    :param ttls: seconds the results of a report are reused, merged into
+        DEFAULT_TTLS; None for a report turns its caching off
+    :param default_ttl: seconds for reports not in ttls, by default they are
+        not cached
+    :param backend: MemoryBackend (the default) or SQLiteBackend
+    :param lease: seconds one refresh may take before another process or
+        thread gives up waiting for it and runs the report itself
+    """
+
+    def __init__(self, ttls=None, default_ttl=None, backend=None, lease=60):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.lease = lease
+
+    def ttl(self, report):
+        return self.ttls.get(report, self.default_ttl)
+
+    def key(self, dsn, report, params, options):
+        """
+        :returns: str, a digest so connection strings (and passwords in them)
+            are not written to a shared backend
+        """
+
+        return hashlib.sha1(json.dumps(
+            [dsn, report, params, options], sort_keys=True, default=str
+        ).encode('utf-8')).hexdigest()
+
+    def get_or_run(self, key, report, run):
+        """
+        The cached records of key, or the records of run() when there are
+        none or they expired.
+
+        :param key: from key()
+        :param report: name of the report, for its TTL
+        :param run: function returning the records
+        :returns: list of Records
+        """
+
+        ttl = self.ttl(report)
+
+        if not ttl:
+            return run()
+
+        entry = self.backend.get(key)
+
+        if entry is not None and entry.expires > time.time():
+            return entry.records
+
+        deadline = time.time() + self.lease
+
+        while not self.backend.acquire(key, self.lease):
+            # Somebody else is refreshing it. Serve what we have, or wait
+            # for theirs rather than running the report as well.
+            if entry is not None:
+                return entry.records
+
+            if time.time() > deadline:
+                return run()
+
+            time.sleep(0.05)
+            entry = self.backend.get(key)
+
+            if entry is not None and entry.expires > time.time():
+                return entry.records
+
+        try:
+            records = run()
+
+            if not is_error(records):
+                self.backend.set(key, time.time() + ttl, records)
+        finally:
+            self.backend.release(key)
+
+        return records
+
+    def clear(self):
+        self.backend.clear()
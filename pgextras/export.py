@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write reports out with COPY (...) TO STDOUT. The rows go from the server
+straight into the file as they arrive, they are never turned into Python
+objects, so exporting a report costs the same little memory however many
+rows it has.
+
+CSV and NDJSON are written as the server produces them. Arrow and Parquet
+need pyarrow (pip install pgextras[arrow]); the CSV stream is parsed into
+record batches as it comes in, typed by the report's column types.
+"""
+
+import os
+import threading
+
+# pyarrow takes longer to import than all of pgextras, so it is imported by
+# the first Arrow or Parquet export: False until then, None if it is not
+# installed.
+pyarrow = False
+
+FORMATS = ('csv', 'ndjson', 'arrow', 'parquet')
+
+COPY_CSV = 'COPY ({statement}) TO STDOUT WITH CSV HEADER'
+
+# The json text has to reach the file untouched. The text format would
+# escape its backslashes, so it is sent as CSV with a quote and a delimiter
+# json never contains unescaped.
+COPY_NDJSON = (
+    "COPY (SELECT row_to_json(report) FROM ({statement}) report) "
+    "TO STDOUT WITH CSV QUOTE E'\\x01' DELIMITER E'\\x02'"
+)
+
+DESCRIBE = 'SELECT * FROM ({statement}) report LIMIT 0'
+
+
+def copy_statement(statement, format):
+    """
+    :param statement: the report's statement, its parameters interpolated
+    :param format: 'csv' or 'ndjson', Arrow and Parquet are read as CSV
+    :returns: str
+    """
+
+    if format == 'ndjson':
+        return COPY_NDJSON.format(statement=statement)
+
+    return COPY_CSV.format(statement=statement)
+
+
+def load_pyarrow():
+    """
+    :returns: the pyarrow module, None if it is not installed
+    """
+
+    global pyarrow
+
+    if pyarrow is False:
+        try:
+            import pyarrow
+            import pyarrow.csv
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            pyarrow = None
+
+    return pyarrow
+
+
+def arrow_type(type_code):
+    """
+    The Arrow type of a column of a Postgres type, by oid. Whatever has no
+    obvious counterpart (intervals, arrays, ...) is kept as its text.
+    """
+
+    if type_code == 16:
+        return pyarrow.bool_()
+
+    if type_code in (20, 21, 23, 26):
+        return pyarrow.int64()
+
+    if type_code in (700, 701, 1700):
+        return pyarrow.float64()
+
+    if type_code == 1082:
+        return pyarrow.date32()
+
+    if type_code == 1114:
+        return pyarrow.timestamp('us')
+
+    if type_code == 1184:
+        return pyarrow.timestamp('us', tz='UTC')
+
+    return pyarrow.string()
+
+
+def write_arrow(cursor, statement, file, format):
+    """
+    Stream the CSV of statement into an Arrow IPC or Parquet file. COPY
+    writes into a pipe on a thread of its own while the batches are read
+    off the other end.
+
+    :param cursor: cursor to run the COPY on
+    :param statement: the report's statement, its parameters interpolated
+    :param file: binary file object to write to
+    :param format: 'arrow' or 'parquet'
+    :returns: int, rows written
+    """
+
+    if load_pyarrow() is None:
+        raise ImportError(
+            'Arrow and Parquet exports need pyarrow: '
+            'pip install pgextras[arrow]'
+        )
+
+    cursor.execute(DESCRIBE.format(statement=statement))
+    column_types = dict(
+        (column.name, arrow_type(column.type_code))
+        for column in cursor.description
+    )
+
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def copy():
+        with os.fdopen(write_fd, 'wb') as pipe:
+            try:
+                cursor.copy_expert(copy_statement(statement, 'csv'), pipe)
+            except Exception as error:
+                errors.append(error)
+
+    thread = threading.Thread(target=copy)
+    thread.start()
+    rows = 0
+
+    try:
+        with os.fdopen(read_fd, 'rb') as pipe:
+            reader = pyarrow.csv.open_csv(
+                pipe,
+                convert_options=pyarrow.csv.ConvertOptions(
+                    column_types=column_types,
+                    strings_can_be_null=True,
+                    quoted_strings_can_be_null=False,
+                    true_values=['t'],
+                    false_values=['f'],
+                )
+            )
+
+            if format == 'parquet':
+                writer = pyarrow.parquet.ParquetWriter(file, reader.schema)
+            else:
+                writer = pyarrow.ipc.new_file(file, reader.schema)
+
+            with writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+    except Exception:
+        # Closing our end has stopped a COPY we are no longer reading from.
+        # If the COPY failed first, that is the error worth reporting.
+        thread.join()
+
+        if errors:
+            raise errors[0]
+
+        raise
+
+    thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return rows
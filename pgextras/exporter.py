@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+"""
+Serve report results as OpenMetrics text for Prometheus to scrape.
+
+Every collector turns one report into labelled gauges and counters. Results
+are cached per target and collector for the collector's TTL and refreshed in
+the background on a thread pool, so a slow collector (bloat) never holds up
+a scrape of the fast ones: a scrape waits at most scrape_timeout seconds and
+serves the last result of anything that is still running.
+
+    >>> exporter = Exporter(['dbname=app host=db1', 'dbname=app host=db2'])
+    >>> serve(exporter, port=9187)
+"""
+
+import datetime
+import decimal
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from . import PgExtras
+from .base import is_error
+from .fleet import target_label
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+Family = namedtuple('Family', 'name type help')
+Sample = namedtuple('Sample', 'family labels value')
+
+FAMILIES = [
+    Family('pgextras_collector_up', 'gauge',
+           'Whether the last run of the collector succeeded.'),
+    Family('pgextras_collector_duration_seconds', 'gauge',
+           'Time the last run of the collector took.'),
+    Family('pgextras_cache_hit_ratio', 'gauge',
+           'Share of index and table blocks read from shared buffers.'),
+    Family('pgextras_table_live_rows', 'gauge',
+           'Estimated live rows of the table.'),
+    Family('pgextras_table_dead_rows', 'gauge',
+           'Estimated dead rows of the table.'),
+    Family('pgextras_table_autovacuum_threshold_rows', 'gauge',
+           'Dead rows that trigger an automatic vacuum of the table.'),
+    Family('pgextras_table_autovacuum_expected', 'gauge',
+           'Whether an automatic vacuum of the table is expected.'),
+    Family('pgextras_table_last_vacuum_timestamp_seconds', 'gauge',
+           'Time of the last manual vacuum of the table.'),
+    Family('pgextras_table_last_autovacuum_timestamp_seconds', 'gauge',
+           'Time of the last automatic vacuum of the table.'),
+    Family('pgextras_table_seq_scans', 'counter',
+           'Sequential scans started on the table.'),
+    Family('pgextras_table_index_usage_ratio', 'gauge',
+           'Share of scans on the table that used an index.'),
+    Family('pgextras_exclusive_locks', 'gauge',
+           'Exclusive locks held or awaited by other backends.'),
+    Family('pgextras_exclusive_lock_max_age_seconds', 'gauge',
+           'Age of the oldest query holding or awaiting an exclusive lock.'),
+    Family('pgextras_queries', 'gauge',
+           'Queries running, by application.'),
+    Family('pgextras_query_max_duration_seconds', 'gauge',
+           'Age of the longest running query, by application.'),
+    Family('pgextras_bloat_ratio', 'gauge',
+           'Estimated size of the table or index relative to its ideal size.'),
+    Family('pgextras_bloat_waste_bytes', 'gauge',
+           'Estimated bytes wasted by bloat in the table or index.'),
+]
+
+
+def checked(records):
+    """
+    :returns: records, unless the report returned an error Record (a
+        timeout, a missing extension) instead of its rows
+    :raises RuntimeError: for the error Record, which marks the collector
+        as down
+    """
+
+    if is_error(records):
+        raise RuntimeError(str(records[0].error).strip())
+
+    return records
+
+
+def collect_cache_hit(pg):
+    for record in checked(pg.cache_hit()):
+        yield Sample('pgextras_cache_hit_ratio',
+                     [('name', record.name)], record.ratio)
+
+
+def collect_vacuum_stats(pg):
+    for record in checked(pg.vacuum_stats(raw=True)):
+        labels = [('schema', record.schema), ('table', record.table)]
+
+        yield Sample('pgextras_table_live_rows', labels, record.rowcount)
+        yield Sample('pgextras_table_dead_rows', labels, record.dead_rowcount)
+        yield Sample('pgextras_table_autovacuum_threshold_rows', labels,
+                     record.autovacuum_threshold)
+        yield Sample('pgextras_table_autovacuum_expected', labels,
+                     record.expect_autovacuum)
+        yield Sample('pgextras_table_last_vacuum_timestamp_seconds', labels,
+                     record.last_vacuum)
+        yield Sample('pgextras_table_last_autovacuum_timestamp_seconds',
+                     labels, record.last_autovacuum)
+
+
+def collect_seq_scans(pg):
+    for record in checked(pg.seq_scans()):
+        yield Sample('pgextras_table_seq_scans',
+                     [('schema', record.schemaname), ('table', record.name)],
+                     record.count)
+
+
+def collect_index_usage(pg):
+    for record in checked(pg.index_usage()):
+        try:
+            ratio = int(record.percent_of_times_index_used) / 100.0
+        except (TypeError, ValueError):
+            # "Insufficient data" or no scans at all
+            continue
+
+        yield Sample('pgextras_table_index_usage_ratio',
+                     [('schema', record.schemaname),
+                      ('table', record.relname)], ratio)
+
+
+def collect_locks(pg):
+    locks = {}
+    oldest = None
+
+    for record in checked(pg.locks()):
+        labels = (('relation', record.relname or ''),
+                  ('granted', str(record.granted).lower()))
+        locks[labels] = locks.get(labels, 0) + 1
+
+        if record.age is not None and (oldest is None or record.age > oldest):
+            oldest = record.age
+
+    for labels, count in sorted(locks.items()):
+        yield Sample('pgextras_exclusive_locks', list(labels), count)
+
+    yield Sample('pgextras_exclusive_lock_max_age_seconds', [],
+                 oldest or datetime.timedelta(0))
+
+
+def collect_ps(pg):
+    queries = {}
+    longest = {}
+
+    for record in checked(pg.ps()):
+        source = record.source or ''
+        queries[source] = queries.get(source, 0) + 1
+
+        if record.running_for is not None:
+            longest[source] = max(
+                longest.get(source, record.running_for), record.running_for
+            )
+
+    for source in sorted(queries):
+        labels = [('application', source)]
+
+        yield Sample('pgextras_queries', labels, queries[source])
+
+        if source in longest:
+            yield Sample('pgextras_query_max_duration_seconds', labels,
+                         longest[source])
+
+
+def collect_bloat(pg):
+    for record in checked(pg.bloat(raw=True)):
+        labels = [
+            ('type', record.type),
+            ('schema', record.schemaname),
+            ('object', record.object_name),
+        ]
+
+        yield Sample('pgextras_bloat_ratio', labels, record.bloat)
+        yield Sample('pgextras_bloat_waste_bytes', labels, record.waste)
+
+
+# name, function, default TTL in seconds
+COLLECTORS = [
+    ('bloat', collect_bloat, 3600),
+    ('cache_hit', collect_cache_hit, 15),
+    ('index_usage', collect_index_usage, 60),
+    ('locks', collect_locks, 15),
+    ('ps', collect_ps, 15),
+    ('seq_scans', collect_seq_scans, 60),
+    ('vacuum_stats', collect_vacuum_stats, 60),
+]
+
+DEFAULT_COLLECTORS = [
+    'cache_hit', 'index_usage', 'locks', 'ps', 'seq_scans', 'vacuum_stats',
+]
+
+
+def format_value(value):
+    """
+    :param value: number, bool, Decimal, timedelta or datetime
+    :returns: str, None if there is no value
+    """
+
+    if value is None:
+        return None
+
+    if isinstance(value, datetime.timedelta):
+        value = value.total_seconds()
+    elif isinstance(value, datetime.datetime):
+        value = value.timestamp()
+    elif isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, decimal.Decimal):
+        value = float(value)
+
+    return repr(value)
+
+
+def escape(value):
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\n', '\\n')
+            .replace('"', '\\"'))
+
+
+def render_metrics(samples):
+    """
+    OpenMetrics text of the samples, grouped by family.
+
+    :param samples: list of Samples
+    :returns: str
+    """
+
+    by_family = {}
+
+    for sample in samples:
+        by_family.setdefault(sample.family, []).append(sample)
+
+    lines = []
+
+    for family in FAMILIES:
+        if family.name not in by_family:
+            continue
+
+        suffix = '_total' if family.type == 'counter' else ''
+        lines.append('# TYPE {} {}'.format(family.name, family.type))
+        lines.append('# HELP {} {}'.format(family.name, family.help))
+
+        for sample in by_family[family.name]:
+            value = format_value(sample.value)
+
+            if value is None:
+                continue
+
+            labels = ','.join(
+                '{}="{}"'.format(name, escape(label))
+                for name, label in sample.labels
+            )
+
+            if labels:
+                labels = '{' + labels + '}'
+
+            lines.append('{}{}{} {}'.format(
+                family.name, suffix, labels, value
+            ))
+
+    lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
+
+
+class Exporter(object):
+    """
+    Collects metrics of several targets, caching each collector's samples
+    for its TTL.
+
+    :param dsns: connection strings of the targets
+    :param collectors: names of the collectors to run, see COLLECTORS
+    :param ttls: dict of collector name to seconds its samples are reused
+    :param max_workers: collectors run at the same time across all targets
+    :param scrape_timeout: seconds a scrape waits for collectors to refresh
+        before serving what it has
+    :param statement_timeout: statement_timeout of every report
+    :param lock_timeout: lock_timeout of every report
+    """
+
+    def __init__(self, dsns, collectors=None, ttls=None, max_workers=10,
+                 scrape_timeout=10, statement_timeout=None,
+                 lock_timeout=None):
+        available = dict((name, (function, ttl))
+                         for name, function, ttl in COLLECTORS)
+
+        for name in list(collectors or []) + list(ttls or {}):
+            if name not in available:
+                raise ValueError('Unknown collector: {}'.format(name))
+
+        self.dsns = list(dsns)
+        self.collectors = [
+            (name, available[name][0])
+            for name in collectors or DEFAULT_COLLECTORS
+        ]
+        self.ttls = dict((name, ttl) for name, (_, ttl) in available.items())
+        self.ttls.update(ttls or {})
+        self.scrape_timeout = scrape_timeout
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._running = {}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def collect(self, dsn, name, function):
+        """
+        Run one collector against one target. A collector that raises,
+        e.g. through checked() when a report returned an error Record,
+        is marked as down.
+
+        :returns: list of Samples
+        """
+
+        started = time.time()
+        target = [('target', target_label(dsn))]
+
+        try:
+            with PgExtras(
+                dsn=dsn,
+                statement_timeout=self.statement_timeout,
+                lock_timeout=self.lock_timeout
+            ) as pg:
+                samples = list(function(pg))
+        except Exception:
+            samples = None
+
+        labels = target + [('collector', name)]
+        meta = [
+            Sample('pgextras_collector_up', labels, samples is not None),
+            Sample('pgextras_collector_duration_seconds', labels,
+                   time.time() - started),
+        ]
+
+        return meta + [
+            Sample(sample.family, target + sample.labels, sample.value)
+            for sample in samples or []
+        ]
+
+    def _refresh(self, dsn, name, function):
+        """
+        Start refreshing the samples of a collector unless they are fresh or
+        already being refreshed.
+
+        :returns: Future of the refresh, None if the samples are fresh
+        """
+
+        key = (dsn, name)
+
+        with self._lock:
+            if key in self._running:
+                return self._running[key]
+
+            expires, _ = self._cache.get(key, (0, None))
+
+            if expires > time.time():
+                return None
+
+            future = self._executor.submit(self.collect, dsn, name, function)
+            self._running[key] = future
+
+        def done(future):
+            with self._lock:
+                del self._running[key]
+
+                if not future.exception():
+                    self._cache[key] = (
+                        time.time() + self.ttls[name], future.result()
+                    )
+
+        future.add_done_callback(done)
+
+        return future
+
+    def samples(self):
+        """
+        Samples of every target and collector, refreshing whatever has
+        expired.
+
+        :returns: list of Samples
+        """
+
+        futures = [
+            self._refresh(dsn, name, function)
+            for dsn in self.dsns
+            for name, function in self.collectors
+        ]
+        futures = [future for future in futures if future is not None]
+
+        if futures:
+            wait(futures, timeout=self.scrape_timeout)
+
+        samples = []
+
+        with self._lock:
+            for dsn in self.dsns:
+                for name, _ in self.collectors:
+                    _, cached = self._cache.get((dsn, name), (0, None))
+                    samples.extend(cached or [])
+
+        return samples
+
+    def scrape(self):
+        """
+        :returns: str, OpenMetrics text
+        """
+
+        return render_metrics(self.samples())
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(exporter, host='', port=9187):
+    """
+    Serve the exporter's metrics on /metrics until interrupted.
+
+    :param exporter: Exporter
+    :param host: address to listen on, all addresses by default
+    :param port: port to listen on
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = exporter.scrape().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        exporter.close()
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+
+"""
+Run reports against many Postgres servers at once, or many reports against
+one server at once.
+"""
+
+import math
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+)
+
+from psycopg2.extensions import make_dsn, parse_dsn
+
+from . import PgExtras
+from .instrument import Timings
+
+HostResult = namedtuple('HostResult', 'dsn results error elapsed timings')
+
+
+def with_timeout(dsn, timeout):
+    """
+    Bound how long connecting to a host may take. Only libpq reads
+    connect_timeout, so it works through poolers such as pgbouncer that
+    refuse startup options.
+
+    :param dsn: connection string
+    :param timeout: seconds
+    :returns: str
+    """
+
+    return make_dsn(dsn, connect_timeout=max(int(math.ceil(timeout)), 1))
+
+
+def host_statement_timeout(timeout, statement_timeout):
+    """
+    The statement_timeout of a host's reports: statement_timeout if given,
+    otherwise none may take longer than the host as a whole.
+
+    :returns: statement_timeout setting, None for no limit
+    """
+
+    if statement_timeout is not None or timeout is None:
+        return statement_timeout
+
+    return '{}ms'.format(int(timeout * 1000))
+
+
+def target_label(dsn):
+    """
+    The target label of a connection string, without the password.
+
+    :param dsn: connection string
+    :returns: str
+    """
+
+    params = parse_dsn(dsn)
+    params.pop('password', None)
+
+    return make_dsn(**params)
+
+
+def run_host(dsn, reports, timeout=None, snapshot=False,
+             statement_timeout=None, lock_timeout=None, timings=False,
+             explain=False):
+    """
+    Run reports against a single host. Errors are returned, not raised, so
+    one unreachable host can't stop the rest of the fleet.
+
+    :param dsn: connection string
+    :param reports: names of the report methods to run
+    :param timeout: seconds allowed to connect, and for each statement
+        unless statement_timeout is given
+    :param snapshot: run all reports in one consistent snapshot
+    :param statement_timeout: per report statement_timeout, a report that
+        hits it returns a timeout Record instead of failing the host
+    :param lock_timeout: per report lock_timeout
+    :param timings: collect the time spent on each report, see Timings
+    :param explain: include the server time of each report in the timings
+    :returns: HostResult
+    """
+
+    started = time.time()
+    connect_dsn = dsn if timeout is None else with_timeout(dsn, timeout)
+    hooks = [Timings()] if timings else []
+
+    try:
+        with PgExtras(
+            dsn=connect_dsn,
+            statement_timeout=host_statement_timeout(
+                timeout, statement_timeout
+            ),
+            lock_timeout=lock_timeout,
+            hooks=hooks,
+            explain=explain
+        ) as pg:
+            if snapshot:
+                results = pg.snapshot(reports).results
+            else:
+                results = dict(
+                    (report, getattr(pg, report)()) for report in reports
+                )
+    except Exception as error:
+        return HostResult(dsn, None, error, time.time() - started, None)
+
+    return HostResult(
+        dsn, results, None, time.time() - started,
+        hooks[0].summary() if hooks else None
+    )
+
+
+def run_fleet(dsns, reports, max_workers=10, timeout=None, snapshot=False,
+              statement_timeout=None, lock_timeout=None, timings=False,
+              explain=False):
+    """
+    Run reports against every host on a bounded thread pool, yielding each
+    host's result as soon as it finishes.
+
+        >>> for host in run_fleet(dsns, ['bloat'], timeout=30):
+        ...     print(host.dsn, host.error or len(host.results['bloat']))
+
+    :param dsns: connection strings
+    :param reports: names of the report methods to run
+    :param max_workers: hosts queried at the same time
+    :param timeout: seconds each host may take in all, a host that takes
+        longer is reported with a TimeoutError; connecting and each
+        statement are bounded by it too
+    :param snapshot: run each host's reports in one consistent snapshot
+    :param statement_timeout: per report statement_timeout
+    :param lock_timeout: per report lock_timeout
+    :param timings: collect the time spent on each report per host
+    :param explain: include the server time of each report in the timings
+    :returns: generator of HostResults
+    """
+
+    return on_pool(
+        dsns, max_workers, run_host, reports, timeout, snapshot,
+        statement_timeout, lock_timeout, timings, explain, timeout=timeout
+    )
+
+
+def on_pool(dsns, max_workers, function, *args, timeout=None):
+    """
+    Call function(dsn, *args) for every host on a bounded thread pool.
+
+    :param timeout: seconds a host may take from when it starts. A host
+        that takes longer is given up on and reported as a HostResult with
+        a TimeoutError; its thread is left to finish in the background.
+    :returns: generator of the results, in the order they finish
+    """
+
+    dsns = list(dsns)
+
+    if not dsns:
+        return
+
+    started = {}
+
+    def call(position, dsn):
+        started[position] = time.time()
+
+        return function(dsn, *args)
+
+    pool = ThreadPoolExecutor(max_workers=min(max_workers, len(dsns)))
+
+    try:
+        pending = dict(
+            (pool.submit(call, position, dsn), position)
+            for position, dsn in enumerate(dsns)
+        )
+
+        while pending:
+            deadlines = [
+                started[position] + timeout
+                for position in pending.values() if position in started
+            ] if timeout is not None else []
+            done, _ = wait(
+                pending,
+                timeout=(
+                    max(min(deadlines) - time.time(), 0) if deadlines
+                    else None if timeout is None else 0.05
+                ),
+                return_when=FIRST_COMPLETED
+            )
+
+            for future in done:
+                del pending[future]
+
+                yield future.result()
+
+            for future, position in list(pending.items()):
+                if position in started and (
+                    time.time() - started[position] >= timeout
+                ):
+                    del pending[future]
+
+                    yield HostResult(
+                        dsns[position], None,
+                        TimeoutError('no result within {}s'.format(timeout)),
+                        time.time() - started[position], None
+                    )
+    finally:
+        # Don't wait for hosts that were given up on
+        pool.shutdown(wait=False)
+
+
+def run_parallel(dsn, reports, max_workers=4, **options):
+    """
+    Run the reports of one host at the same time, each on a connection of
+    its own, yielding each report's records as soon as it finishes. The
+    whole takes about as long as the slowest report instead of the sum of
+    them all.
+
+        >>> for report, records in run_parallel(dsn, ['bloat', 'locks']):
+        ...     print(report, len(records))
+
+    :param dsn: connection string
+    :param reports: names of the report methods to run
+    :param max_workers: reports run at the same time
+    :param options: passed on to PgExtras, e.g. statement_timeout or hooks
+    :returns: generator of (report, records), in the order they finish
+    """
+
+    def run(report):
+        with PgExtras(dsn=dsn, **options) as pg:
+            return report, getattr(pg, report)()
+
+    reports = list(reports)
+
+    if not reports:
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(reports))
+    ) as pool:
+        futures = [pool.submit(run, report) for report in reports]
+
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def record_host(dsn, history, reports=None, timeout=None,
+                statement_timeout=None, lock_timeout=None):
+    """
+    Record reports of a single host into a History, see History.record.
+    Errors are returned, not raised.
+
+    :param dsn: connection string
+    :param history: pgextras.history.History
+    :param reports: names of the reports to record, the History's defaults
+        by default
+    :param timeout: seconds allowed to connect, and for each statement
+        unless statement_timeout is given
+    :param statement_timeout: per report statement_timeout
+    :param lock_timeout: per report lock_timeout
+    :returns: HostResult, results are the rows that changed per report
+    """
+
+    started = time.time()
+    connect_dsn = dsn if timeout is None else with_timeout(dsn, timeout)
+
+    try:
+        with PgExtras(
+            dsn=connect_dsn,
+            statement_timeout=host_statement_timeout(
+                timeout, statement_timeout
+            ),
+            lock_timeout=lock_timeout
+        ) as pg:
+            results = history.record(pg, reports, target=target_label(dsn))
+    except Exception as error:
+        return HostResult(dsn, None, error, time.time() - started, None)
+
+    return HostResult(dsn, results, None, time.time() - started, None)
+
+
+def record_fleet(dsns, history, reports=None, max_workers=10, timeout=None,
+                 statement_timeout=None, lock_timeout=None):
+    """
+    Record reports of every host into one History on a bounded thread pool,
+    see record_host.
+
+        >>> history = History('pgextras.db')
+        >>> for host in record_fleet(dsns, history):
+        ...     print(host.dsn, host.error or host.results)
+
+    :returns: generator of HostResults
+    """
+
+    return on_pool(
+        dsns, max_workers, record_host, history, reports, timeout,
+        statement_timeout, lock_timeout, timeout=timeout
+    )
+
+
+def export_path(directory, dsn, report, format):
+    """
+    Where export_host writes a report of a host: host_port_dbname_report
+    with the format as extension.
+
+    :returns: str
+    """
+
+    params = parse_dsn(dsn)
+    host = '_'.join(
+        params.get(name, '') for name in ('host', 'port', 'dbname')
+    )
+    host = re.sub(r'[^\w.-]+', '_', host).strip('_')
+
+    return os.path.join(
+        directory, '{}_{}.{}'.format(host, report, format)
+    )
+
+
+def export_host(dsn, reports, directory, format='csv', timeout=None,
+                statement_timeout=None, lock_timeout=None):
+    """
+    Export reports of a single host to files in directory, see
+    PgExtras.export. Errors are returned, not raised.
+
+    :param dsn: connection string
+    :param reports: names of the reports to export
+    :param directory: where to write the files, see export_path
+    :param format: 'csv', 'ndjson', 'arrow' or 'parquet'
+    :param timeout: seconds allowed to connect, and for each statement
+        unless statement_timeout is given
+    :param statement_timeout: per report statement_timeout
+    :param lock_timeout: per report lock_timeout
+    :returns: HostResult, results are the rows written per report
+    """
+
+    started = time.time()
+    connect_dsn = dsn if timeout is None else with_timeout(dsn, timeout)
+    results = {}
+
+    try:
+        with PgExtras(
+            dsn=connect_dsn,
+            statement_timeout=host_statement_timeout(
+                timeout, statement_timeout
+            ),
+            lock_timeout=lock_timeout
+        ) as pg:
+            for report in reports:
+                path = export_path(directory, dsn, report, format)
+
+                with open(path, 'wb') as export_file:
+                    results[report] = pg.export(
+                        report, export_file, format, raw=True
+                    )
+    except Exception as error:
+        return HostResult(dsn, None, error, time.time() - started, None)
+
+    return HostResult(dsn, results, None, time.time() - started, None)
+
+
+def export_fleet(dsns, reports, directory, format='csv', max_workers=10,
+                 timeout=None, statement_timeout=None, lock_timeout=None):
+    """
+    Export reports of every host on a bounded thread pool, see export_host.
+
+        >>> for host in export_fleet(dsns, ['vacuum_stats'], 'dumps'):
+        ...     print(host.dsn, host.error or host.results)
+
+    :returns: generator of HostResults
+    """
+
+    return on_pool(
+        dsns, max_workers, export_host, reports, directory, format, timeout,
+        statement_timeout, lock_timeout, timeout=timeout
+    )
+
+
+def read_dsn_file(path):
+    """
+    One connection string per line; blank lines and # comments are skipped.
+
+    :param path: file to read
+    :returns: list of str
+    """
+
+    with open(path) as dsn_file:
+        lines = [line.strip() for line in dsn_file]
+
+    return [line for line in lines if line and not line.startswith('#')]
@@ -0,0 +1,537 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keep the results of reports over time, to see how fast a table grows or
+when the cache hit ratio dropped:
+
+    >>> history = History('pgextras.db')
+    >>> with PgExtras(dsn=dsn) as pg:
+    ...     history.record(pg)    # e.g. every minute from cron
+    >>> history.series('dbname=app', 'table_size')
+    [Record(first_seen=..., last_seen=..., name='accounts', size=...), ...]
+
+The store is a SQLite file. A row is kept as a point with the time it was
+first and last seen with these values, so a row that did not change since
+the last snapshot costs nothing but moving its last_seen. Text describing a
+row rather than measuring it (the query of a statement) is kept once per
+row, not in every point. Older points are
+downsampled: past each age in resolution only the last point per interval
+is kept, covering the whole interval.
+
+Values are stored as json, so they come back as json types (timestamps are
+strings, numerics are floats).
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+import time
+
+from .base import is_error
+from .fleet import target_label
+from .output import json_default
+from .rows import key_columns, row_keys, to_records
+
+# Reports recorded unless told otherwise, with their options. statement
+# counters are only recorded where pg_stat_statements is installed.
+DEFAULT_REPORTS = {
+    'cache_hit': {},
+    'index_size': {'raw': True},
+    'seq_scans': {},
+    'statement_counters': {},
+    'table_size': {'raw': True},
+    'total_table_size': {'raw': True},
+    'vacuum_stats': {'raw': True},
+}
+
+# Columns that differ on every run without anything having changed
+IGNORED = {
+    'statement_counters': ('sampled_at',),
+}
+
+# Columns that describe a row rather than measure it, stored with the row's
+# series instead of with each of its points
+DESCRIBED = {
+    'statement_counters': ('query',),
+}
+
+# (age, interval) in seconds: points older than a day are kept one per hour,
+# older than 30 days one per day.
+DEFAULT_RESOLUTION = [(86400, 3600), (30 * 86400, 86400)]
+
+
+def to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+class History(object):
+    """
+    :param path: file of the database, created if it does not exist
+    :param resolution: list of (age, interval) in seconds, see
+        DEFAULT_RESOLUTION
+    :param retention: seconds after which points are removed altogether,
+        None to keep them
+    :param compact_every: seconds between the compactions record() runs
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS series (
+            id INTEGER PRIMARY KEY,
+            target TEXT NOT NULL,
+            report TEXT NOT NULL,
+            key TEXT NOT NULL,
+            columns TEXT NOT NULL,
+            described TEXT NOT NULL DEFAULT '[]',
+            UNIQUE (target, report, key)
+        );
+        CREATE TABLE IF NOT EXISTS points (
+            series INTEGER NOT NULL,
+            first_seen REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (series, first_seen)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS snapshots (
+            target TEXT NOT NULL,
+            report TEXT NOT NULL,
+            taken_at REAL NOT NULL,
+            rows INTEGER NOT NULL,
+            PRIMARY KEY (target, report, taken_at)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        );
+    """
+
+    LATEST = """
+        SELECT series.key, series.id, series.columns, series.described,
+               points.first_seen, points.last_seen, points.value
+        FROM series
+        JOIN points ON points.series = series.id
+        WHERE series.target = ? AND series.report = ?
+        AND points.first_seen = (
+            SELECT max(first_seen) FROM points WHERE series = series.id
+        )
+    """
+
+    # The last point of every interval stands for the whole interval
+    DOWNSAMPLE = """
+        CREATE TEMP TABLE downsampled AS
+        SELECT series, first_seen, bucket_first, bucket_last, position
+        FROM (
+            SELECT
+                series,
+                first_seen,
+                min(first_seen) OVER bucket AS bucket_first,
+                max(last_seen) OVER bucket AS bucket_last,
+                row_number() OVER (
+                    PARTITION BY series, CAST(first_seen / :interval AS INT)
+                    ORDER BY first_seen DESC
+                ) AS position
+            FROM points
+            WHERE last_seen < :cutoff
+            WINDOW bucket AS (
+                PARTITION BY series, CAST(first_seen / :interval AS INT)
+            )
+        )
+        WHERE position > 1 OR bucket_first < first_seen;
+
+        DELETE FROM points
+        WHERE EXISTS (
+            SELECT 1 FROM downsampled
+            WHERE downsampled.series = points.series
+            AND downsampled.first_seen = points.first_seen
+            AND downsampled.position > 1
+        );
+
+        UPDATE points
+        SET first_seen = (
+                SELECT bucket_first FROM downsampled
+                WHERE downsampled.series = points.series
+                AND downsampled.first_seen = points.first_seen
+            ),
+            last_seen = (
+                SELECT bucket_last FROM downsampled
+                WHERE downsampled.series = points.series
+                AND downsampled.first_seen = points.first_seen
+            )
+        WHERE EXISTS (
+            SELECT 1 FROM downsampled
+            WHERE downsampled.series = points.series
+            AND downsampled.first_seen = points.first_seen
+        );
+
+        DELETE FROM snapshots
+        WHERE taken_at < :cutoff
+        AND taken_at < (
+            SELECT max(later.taken_at) FROM snapshots later
+            WHERE later.target = snapshots.target
+            AND later.report = snapshots.report
+            AND CAST(later.taken_at / :interval AS INT)
+                = CAST(snapshots.taken_at / :interval AS INT)
+        );
+
+        DROP TABLE downsampled;
+    """
+
+    def __init__(self, path, resolution=None, retention=None,
+                 compact_every=3600):
+        self.path = os.path.abspath(path)
+        self.resolution = sorted(
+            resolution if resolution is not None else DEFAULT_RESOLUTION
+        )
+        self.retention = retention
+        self.compact_every = compact_every
+
+        db = self._connect()
+
+        try:
+            # Lets compact() hand the pages it frees back to the file system,
+            # only takes effect on a new database
+            db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(self.SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # A connection per call keeps this safe to use from any thread
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def record(self, pg, reports=None, taken_at=None, target=None):
+        """
+        Run reports and store their rows.
+
+        :param pg: PgExtras
+        :param reports: dict of report name to its options, or a list of
+            names, DEFAULT_REPORTS by default
+        :param taken_at: time of the snapshot as a unix timestamp, now by
+            default
+        :param target: what to store the rows under, by default the
+            connection string of pg without its password
+        :returns: dict of report to the number of rows that changed
+        """
+
+        if reports is None:
+            reports = DEFAULT_REPORTS
+        elif not isinstance(reports, dict):
+            reports = dict(
+                (report, DEFAULT_REPORTS.get(report, {})) for report in reports
+            )
+
+        taken_at = time.time() if taken_at is None else taken_at
+        target = self.target(pg) if target is None else target
+        results = {}
+
+        for report, options in sorted(reports.items()):
+            if report == 'statement_counters' and not pg.pg_stat_statement():
+                continue
+
+            results[report] = pg.run_report(
+                report, row_format='record', **options
+            )
+
+        changed = {}
+        db = self._connect()
+
+        try:
+            db.execute('BEGIN IMMEDIATE')
+
+            for report, records in results.items():
+                if is_error(records):
+                    continue
+
+                changed[report] = self._store(
+                    db, target, report, records, taken_at
+                )
+
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+        if self._compaction_due(taken_at):
+            self.compact(taken_at)
+
+        return changed
+
+    def target(self, pg):
+        """
+        :returns: str, the connection string of pg without its password
+        """
+
+        if pg.dsn is not None:
+            return target_label(pg.dsn)
+
+        with pg.connection() as conn:
+            return target_label(conn.dsn)
+
+    def _store(self, db, target, report, records, taken_at):
+        latest = dict(
+            (row[0], row[1:])
+            for row in db.execute(self.LATEST, (target, report))
+        )
+        # Only rows that were there the last time are still the same point,
+        # one that was gone in between starts a new one
+        last_taken_at = db.execute(
+            'SELECT max(taken_at) FROM snapshots '
+            'WHERE target = ? AND report = ?', (target, report)
+        ).fetchone()[0]
+        ignored = IGNORED.get(report, ())
+        described = DESCRIBED.get(report, ())
+        seen = []
+        changed = 0
+
+        for key, record in zip(row_keys(report, records), records):
+            keys = key_columns(report, record._fields)
+            columns = [
+                column for column in record._fields if column not in ignored
+            ]
+            key = json.dumps(key, default=json_default)
+            value = json.dumps(
+                [
+                    getattr(record, c) for c in columns
+                    if c not in keys and c not in described
+                ],
+                default=json_default
+            )
+            description = json.dumps(
+                [getattr(record, c) for c in columns if c in described],
+                default=json_default
+            )
+            columns = json.dumps(columns)
+
+            try:
+                (series, previous_columns, previous_description, first_seen,
+                 last_seen, previous) = latest[key]
+            except KeyError:
+                series = None
+            else:
+                if (previous_columns, previous, last_seen) == (
+                    columns, value, last_taken_at
+                ):
+                    if previous_description != description:
+                        db.execute(
+                            'UPDATE series SET described = ? WHERE id = ?',
+                            (description, series)
+                        )
+
+                    seen.append((taken_at, series, first_seen))
+                    continue
+
+            if series is None:
+                db.execute(
+                    'INSERT OR IGNORE INTO series (target, report, key, '
+                    'columns) VALUES (?, ?, ?, ?)',
+                    (target, report, key, columns)
+                )
+                series = db.execute(
+                    'SELECT id FROM series WHERE target = ? AND report = ? '
+                    'AND key = ?', (target, report, key)
+                ).fetchone()[0]
+
+            db.execute(
+                'UPDATE series SET columns = ?, described = ? WHERE id = ?',
+                (columns, description, series)
+            )
+            db.execute(
+                'INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?)',
+                (series, taken_at, taken_at, value)
+            )
+            changed += 1
+
+        db.executemany(
+            'UPDATE points SET last_seen = ? '
+            'WHERE series = ? AND first_seen = ?',
+            seen
+        )
+        db.execute(
+            'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)',
+            (target, report, taken_at, len(records))
+        )
+
+        return changed
+
+    def _compaction_due(self, now):
+        db = self._connect()
+
+        try:
+            row = db.execute(
+                "SELECT value FROM meta WHERE name = 'compacted_at'"
+            ).fetchone()
+        finally:
+            db.close()
+
+        return row is None or now - row[0] >= self.compact_every
+
+    def compact(self, now=None):
+        """
+        Downsample the points past each age in resolution, drop those past
+        retention and give the freed space back.
+
+        :param now: unix timestamp the ages are counted from, now by default
+        """
+
+        now = time.time() if now is None else now
+        db = self._connect()
+
+        try:
+            db.execute('BEGIN IMMEDIATE')
+
+            for age, interval in self.resolution:
+                for statement in self.DOWNSAMPLE.split(';'):
+                    if statement.strip():
+                        db.execute(statement, {
+                            'cutoff': now - age,
+                            'interval': interval,
+                        })
+
+            if self.retention is not None:
+                db.execute(
+                    'DELETE FROM points WHERE last_seen < ?',
+                    (now - self.retention,)
+                )
+                db.execute(
+                    'DELETE FROM snapshots WHERE taken_at < ?',
+                    (now - self.retention,)
+                )
+                db.execute(
+                    'DELETE FROM series WHERE NOT EXISTS '
+                    '(SELECT 1 FROM points WHERE series = series.id)'
+                )
+
+            db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('compacted_at', ?)",
+                (now,)
+            )
+            db.execute('COMMIT')
+            db.execute('PRAGMA incremental_vacuum')
+        except Exception:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+    def targets(self):
+        """
+        :returns: list of the targets with snapshots
+        """
+
+        db = self._connect()
+
+        try:
+            return [
+                row[0] for row in db.execute(
+                    'SELECT DISTINCT target FROM snapshots ORDER BY target'
+                )
+            ]
+        finally:
+            db.close()
+
+    def snapshots(self, target, report):
+        """
+        :returns: list of (datetime, rows) of the snapshots of a report
+        """
+
+        db = self._connect()
+
+        try:
+            return [
+                (to_datetime(taken_at), rows)
+                for taken_at, rows in db.execute(
+                    'SELECT taken_at, rows FROM snapshots '
+                    'WHERE target = ? AND report = ? ORDER BY taken_at',
+                    (target, report)
+                )
+            ]
+        finally:
+            db.close()
+
+    def series(self, target, report, since=None, until=None, **key):
+        """
+        The points of a report, each row's from oldest to newest.
+
+            >>> history.series('dbname=app', 'table_size', name='accounts')
+
+        Record(
+            first_seen=datetime.datetime(2014, 5, 6, 10, 1, tzinfo=...utc),
+            last_seen=datetime.datetime(2014, 5, 6, 10, 14, tzinfo=...utc),
+            name='accounts',
+            size=13631488
+        )
+
+        :param target: from targets()
+        :param report: name of the report
+        :param since: only points last seen at or after this datetime
+        :param until: only points first seen at or before this datetime
+        :param key: only the rows with these values, e.g. name='accounts'
+        :returns: list of Records
+        """
+
+        statement = (
+            'SELECT series.key, series.columns, series.described, '
+            'points.first_seen, points.last_seen, points.value '
+            'FROM series JOIN points ON points.series = series.id '
+            'WHERE series.target = ? AND series.report = ?'
+        )
+        params = [target, report]
+
+        if since is not None:
+            statement += ' AND points.last_seen >= ?'
+            params.append(since.timestamp())
+
+        if until is not None:
+            statement += ' AND points.first_seen <= ?'
+            params.append(until.timestamp())
+
+        db = self._connect()
+
+        try:
+            rows = db.execute(
+                statement + ' ORDER BY series.id, points.first_seen', params
+            ).fetchall()
+        finally:
+            db.close()
+
+        columns = []
+        points = []
+
+        described = DESCRIBED.get(report, ())
+
+        for (key_values, series_columns, description, first_seen, last_seen,
+             value) in rows:
+            series_columns = json.loads(series_columns)
+            keys = key_columns(report, series_columns)
+            values = dict(zip(keys, json.loads(key_values)))
+            values.update(zip(
+                [c for c in series_columns if c in described],
+                json.loads(description)
+            ))
+            values.update(zip(
+                [
+                    c for c in series_columns
+                    if c not in keys and c not in described
+                ],
+                json.loads(value)
+            ))
+
+            if any(values.get(name) != wanted for name, wanted in key.items()):
+                continue
+
+            # Rows recorded before an upgrade may lack newer columns
+            columns.extend(c for c in series_columns if c not in columns)
+            points.append((first_seen, last_seen, values))
+
+        return to_records(
+            ['first_seen', 'last_seen'] + columns,
+            [
+                [to_datetime(first_seen), to_datetime(last_seen)]
+                + [values.get(column) for column in columns]
+                for first_seen, last_seen, values in points
+            ]
+        )
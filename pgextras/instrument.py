@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hooks that see every statement PgExtras executes:
+
+    >>> class SlowReports(Hook):
+    ...     def after_execute(self, execution):
+    ...         if execution.wall_time > 1000:
+    ...             log.warning('%s took %dms', execution.report,
+    ...                         execution.wall_time)
+    ...
+    >>> pg = PgExtras(dsn=dsn, hooks=[SlowReports()])
+
+Timings is the built-in one, it sums up the executions per report.
+"""
+
+import threading
+from collections import namedtuple
+
+# What is about to run
+Statement = namedtuple('Statement', 'report statement params')
+
+# What ran. Times are in milliseconds: wall_time from sending the statement
+# to having the Records, decode_time the part of it spent turning rows into
+# Records, server_time planning plus execution on the server as reported by
+# EXPLAIN ANALYZE (None unless asked for).
+Execution = namedtuple('Execution', [
+    'report',
+    'statement',
+    'params',
+    'wall_time',
+    'decode_time',
+    'server_time',
+    'rows',
+    'bytes',
+    'error',
+])
+
+Timing = namedtuple('Record', [
+    'report',
+    'calls',
+    'errors',
+    'total_time',
+    'mean_time',
+    'max_time',
+    'server_time',
+    'decode_time',
+    'rows',
+    'bytes',
+])
+
+
+class Hook(object):
+    """
+    Base class of instrumentation hooks, override what you need. Hooks are
+    called on the thread that runs the statement and must not raise.
+    """
+
+    def before_execute(self, statement):
+        """
+        :param statement: Statement
+        """
+
+    def after_execute(self, execution):
+        """
+        Called after every statement, including the ones that failed.
+
+        :param execution: Execution
+        """
+
+
+def result_size(rows):
+    """
+    Size of the result in the text format it came over the wire in,
+    estimated from the decoded values.
+
+    :param rows: list of Records
+    :returns: int, bytes
+    """
+
+    return sum(
+        len(str(value))
+        for row in rows
+        for value in row
+        if value is not None
+    )
+
+
+class Timings(Hook):
+    """
+    Aggregates the executions per report. Thread safe, so one instance can
+    be shared by everything that runs reports.
+
+        >>> timings = Timings()
+        >>> pg = PgExtras(dsn=dsn, hooks=[timings])
+        >>> pg.bloat()
+        >>> timings.summary()
+        [Record(report='bloat', calls=1, errors=0, total_time=84.2, ...)]
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports = {}
+
+    def after_execute(self, execution):
+        report = execution.report or 'other'
+
+        with self._lock:
+            totals = self._reports.setdefault(report, {
+                'calls': 0,
+                'errors': 0,
+                'total_time': 0.0,
+                'max_time': 0.0,
+                'server_time': None,
+                'decode_time': 0.0,
+                'rows': 0,
+                'bytes': 0,
+            })
+            totals['calls'] += 1
+            totals['total_time'] += execution.wall_time
+            totals['max_time'] = max(totals['max_time'], execution.wall_time)
+            totals['decode_time'] += execution.decode_time or 0.0
+            totals['rows'] += execution.rows or 0
+            totals['bytes'] += execution.bytes or 0
+
+            if execution.error is not None:
+                totals['errors'] += 1
+
+            if execution.server_time is not None:
+                totals['server_time'] = (
+                    (totals['server_time'] or 0.0) + execution.server_time
+                )
+
+    def reset(self):
+        with self._lock:
+            self._reports.clear()
+
+    def summary(self):
+        """
+        Record(
+            report='bloat',
+            calls=3,
+            errors=0,
+            total_time=252.6,
+            mean_time=84.2,
+            max_time=97.1,
+            server_time=231.0,
+            decode_time=12.3,
+            rows=1173,
+            bytes=48211
+        )
+
+        :returns: list of Records, most time spent first, times are in
+            milliseconds
+        """
+
+        with self._lock:
+            timings = [
+                Timing(
+                    report,
+                    totals['calls'],
+                    totals['errors'],
+                    round(totals['total_time'], 3),
+                    round(totals['total_time'] / totals['calls'], 3),
+                    round(totals['max_time'], 3),
+                    None if totals['server_time'] is None
+                    else round(totals['server_time'], 3),
+                    round(totals['decode_time'], 3),
+                    totals['rows'],
+                    totals['bytes'],
+                )
+                for report, totals in self._reports.items()
+            ]
+
+        timings.sort(key=lambda timing: timing.total_time, reverse=True)
+
+        return timings
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+The wait-for graph of lock waits. Every backend points at the backends it
+waits for; following the arrows leads to the root blockers, the backends
+everything else is queued up behind. A set of backends that wait for each
+other in a circle is a deadlock the server has not broken up (yet).
+"""
+
+from collections import namedtuple
+
+Node = namedtuple('Record', [
+    'pid',
+    'blocked_by',
+    'root_blockers',
+    'depth',
+    'fan_out',
+    'blocked_total',
+    'cycle',
+    'duration',
+    'query',
+])
+
+
+def strongly_connected(pids, edges):
+    """
+    Tarjan's algorithm without recursion, so long wait chains can't exhaust
+    the stack.
+
+    :param pids: every node of the graph
+    :param edges: dict of pid to the pids it waits for
+    :returns: list of lists of pids, a component comes after every
+        component it waits for
+    """
+
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    for start in pids:
+        if start in index:
+            continue
+
+        work = [(start, iter(edges.get(start, ())))]
+        index[start] = lowlink[start] = len(index)
+        stack.append(start)
+        on_stack.add(start)
+
+        while work:
+            pid, successors = work[-1]
+            descended = False
+
+            for successor in successors:
+                if successor not in index:
+                    index[successor] = lowlink[successor] = len(index)
+                    stack.append(successor)
+                    on_stack.add(successor)
+                    work.append(
+                        (successor, iter(edges.get(successor, ())))
+                    )
+                    descended = True
+                    break
+                elif successor in on_stack:
+                    lowlink[pid] = min(lowlink[pid], index[successor])
+
+            if descended:
+                continue
+
+            work.pop()
+
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[pid])
+
+            if lowlink[pid] == index[pid]:
+                component = []
+
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+
+                    if member == pid:
+                        break
+
+                components.append(component)
+
+    return components
+
+
+def build_lock_graph(rows):
+    """
+    Analyse the wait-for graph. Runs in linear time in the number of waits,
+    apart from blocked_total which costs a bit per waiting backend per
+    blocker.
+
+    Record(
+        pid=4102,
+        blocked_by=[],
+        root_blockers=[4102],
+        depth=0,
+        fan_out=3,
+        blocked_total=41,
+        cycle=None,
+        duration=datetime.timedelta(0, 312, 52),
+        query='ALTER TABLE accounts ADD COLUMN note text'
+    )
+
+    :param rows: Records with pid, blocked_by, duration and query
+    :returns: list of Records, root blockers first with the one holding up
+        the most backends at the top, then the waiting backends by depth
+    """
+
+    info = {}
+    edges = {}
+
+    for row in rows:
+        info[row.pid] = row
+        edges[row.pid] = sorted(set(row.blocked_by or ()))
+
+    for blockers in list(edges.values()):
+        for blocker in blockers:
+            edges.setdefault(blocker, [])
+
+    pids = sorted(edges)
+    components = strongly_connected(pids, edges)
+    component_of = {}
+
+    for number, component in enumerate(components):
+        for pid in component:
+            component_of[pid] = number
+
+    successors = [set() for _ in components]
+    predecessors = [set() for _ in components]
+
+    for pid, blockers in edges.items():
+        for blocker in blockers:
+            if component_of[pid] != component_of[blocker]:
+                successors[component_of[pid]].add(component_of[blocker])
+                predecessors[component_of[blocker]].add(component_of[pid])
+
+    # Components come after everything they wait for, so walking them in
+    # order sees the blockers first and walking backwards the waiters first.
+    depth = [0] * len(components)
+    roots = [frozenset()] * len(components)
+
+    for number, component in enumerate(components):
+        if successors[number]:
+            depth[number] = 1 + max(depth[s] for s in successors[number])
+            roots[number] = frozenset().union(
+                *[roots[s] for s in successors[number]]
+            )
+        else:
+            roots[number] = frozenset(component)
+
+    # Sets of waiting backends as bitmasks, one bit per pid
+    bits = dict((pid, 1 << position) for position, pid in enumerate(pids))
+    waiting = [0] * len(components)
+
+    for number in reversed(range(len(components))):
+        for predecessor in predecessors[number]:
+            waiting[number] |= waiting[predecessor]
+
+            for pid in components[predecessor]:
+                waiting[number] |= bits[pid]
+
+    fan_out = dict((pid, 0) for pid in pids)
+
+    for blockers in edges.values():
+        for blocker in blockers:
+            fan_out[blocker] += 1
+
+    # The members of a cycle wait for each other as well
+    cycles = [None] * len(components)
+
+    for number, component in enumerate(components):
+        if len(component) > 1:
+            cycles[number] = sorted(component)
+
+            for member in component:
+                waiting[number] |= bits[member]
+
+    roots = [sorted(members) for members in roots]
+    nodes = []
+
+    for pid in pids:
+        number = component_of[pid]
+        row = info.get(pid)
+
+        nodes.append(Node(
+            pid,
+            edges[pid],
+            roots[number],
+            depth[number],
+            fan_out[pid],
+            bin(waiting[number] & ~bits[pid]).count('1'),
+            cycles[number],
+            getattr(row, 'duration', None),
+            getattr(row, 'query', None),
+        ))
+
+    nodes.sort(key=lambda node: (node.depth, -node.blocked_total, node.pid))
+
+    return nodes
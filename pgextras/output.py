@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write reports out as they arrive, for the CLI and anything else that pipes
+them somewhere:
+
+* 'table': a PrettyTable per report (needs every row before printing)
+* 'json': one array of {"report": ..., "records": [...]} objects
+* 'ndjson': a {"report": ..., "record": {...}} line per row, a single line
+  with "record": null for a report without rows
+* 'csv': a block per report, separated by an empty line: a line with the
+  name of the report, the header and the rows. A report without rows still
+  gets its block, with its header when the records know their columns
+  (iter_report() does). Error Records get a block of their own.
+
+    >>> writer = get_writer('ndjson')
+    >>> writer.write('vacuum_stats', pg.iter_report('vacuum_stats'))
+    >>> writer.close()
+
+With host, e.g. when reporting for a fleet, the host goes along with every
+report ("host" in json, a first column in csv).
+"""
+
+import abc
+import csv
+import datetime
+import decimal
+import json
+import sys
+
+FORMATS = ('table', 'json', 'ndjson', 'csv')
+
+
+def to_dict(record):
+    return record._asdict()
+
+
+def json_default(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+
+    return str(value)
+
+
+def dumps(value):
+    return json.dumps(value, default=json_default)
+
+
+class Writer(abc.ABC):
+    """
+    :param file: text file object to write to, stdout by default
+    """
+
+    def __init__(self, file=None):
+        self.file = file if file is not None else sys.stdout
+
+    @abc.abstractmethod
+    def write(self, report, records, host=None):
+        """
+        :param report: name of the report
+        :param records: iterable of Records, written as they come
+        :param host: where the records come from
+        """
+
+    def close(self):
+        self.file.flush()
+
+
+class TableWriter(Writer):
+    def write(self, report, records, host=None):
+        # Only tables need it, machine readable output starts faster without
+        from prettytable import PrettyTable
+
+        records = list(records)
+
+        try:
+            table = PrettyTable(to_dict(records[0]).keys())
+        except IndexError:
+            table = 'No records'
+        else:
+            table.align = 'l'
+
+            for record in records:
+                table.add_row(to_dict(record).values())
+
+        print(' ', file=self.file)
+        print(report, file=self.file)
+        print('#' * 79, file=self.file)
+        print(table, file=self.file)
+        self.file.flush()
+
+
+class JsonWriter(Writer):
+    def __init__(self, file=None):
+        super(JsonWriter, self).__init__(file)
+        self.reports = 0
+
+    def write(self, report, records, host=None):
+        self.file.write('[\n' if not self.reports else ',\n')
+        self.reports += 1
+        self.file.write('{"report": ' + dumps(report))
+
+        if host is not None:
+            self.file.write(', "host": ' + dumps(host))
+
+        self.file.write(', "records": [')
+
+        for position, record in enumerate(records):
+            self.file.write(
+                ('\n' if not position else ',\n') + dumps(to_dict(record))
+            )
+            self.file.flush()
+
+        self.file.write(']}')
+        self.file.flush()
+
+    def close(self):
+        self.file.write('[]\n' if not self.reports else '\n]\n')
+        super(JsonWriter, self).close()
+
+
+class NdjsonWriter(Writer):
+    def write(self, report, records, host=None):
+        envelope = {'report': report}
+
+        if host is not None:
+            envelope['host'] = host
+
+        envelope['record'] = None
+
+        for record in records:
+            envelope['record'] = to_dict(record)
+            self.file.write(dumps(envelope) + '\n')
+            self.file.flush()
+
+        if envelope['record'] is None:
+            self.file.write(dumps(envelope) + '\n')
+            self.file.flush()
+
+
+class CsvWriter(Writer):
+    def __init__(self, file=None):
+        super(CsvWriter, self).__init__(file)
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.reports = 0
+
+    def write(self, report, records, host=None):
+        prefix = [] if host is None else [host]
+        fields = None
+
+        for record in records:
+            # A timeout Record after the rows has columns of its own
+            if record._fields != fields:
+                fields = record._fields
+                self._start(report, prefix, fields)
+
+            self.writer.writerow(prefix + list(record))
+            self.file.flush()
+
+        if fields is None:
+            self._start(report, prefix, getattr(records, 'columns', None))
+            self.file.flush()
+
+    def _start(self, report, prefix, fields):
+        """
+        Start a block: the report's name, then the header if fields are
+        known.
+        """
+
+        if self.reports:
+            self.file.write('\n')
+
+        self.reports += 1
+        self.writer.writerow([report])
+
+        if fields is not None:
+            self.writer.writerow((['host'] if prefix else []) + list(fields))
+
+
+WRITERS = {
+    'table': TableWriter,
+    'json': JsonWriter,
+    'ndjson': NdjsonWriter,
+    'csv': CsvWriter,
+}
+
+
+def get_writer(format, file=None):
+    """
+    :param format: one of FORMATS
+    :param file: text file object to write to, stdout by default
+    :returns: Writer
+    """
+
+    try:
+        return WRITERS[format](file)
+    except KeyError:
+        raise ValueError('Unknown format: {}'.format(format))
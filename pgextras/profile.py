@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Server capabilities are resolved once per connection string and shared by
+every PgExtras instance talking to the same server.
+"""
+
+import threading
+from collections import namedtuple
+
+_profiles = {}
+_lock = threading.Lock()
+
+
+class ServerProfile(namedtuple('ServerProfile', 'version_num extensions')):
+    """
+    What the server can do, as far as the reports are concerned.
+
+    ServerProfile(
+        version_num=130004,
+        extensions={'plpgsql': '1.0', 'pg_stat_statements': '1.8'}
+    )
+    """
+
+    __slots__ = ()
+
+    def is_at_least(self, version_num):
+        """
+        :param version_num: version in server_version_num form, e.g. 90200
+        :returns: boolean
+        """
+
+        return self.version_num >= version_num
+
+    def has_extension(self, name):
+        """
+        :returns: boolean
+        """
+
+        return name in self.extensions
+
+    def extension_version(self, name):
+        """
+        :returns: str or None when the extension is not installed
+        """
+
+        return self.extensions.get(name)
+
+
+def get_profile(key):
+    """
+    :param key: connection string the profile was resolved for
+    :returns: ServerProfile or None
+    """
+
+    return _profiles.get(key)
+
+
+def set_profile(key, profile):
+    with _lock:
+        _profiles[key] = profile
+
+
+def clear_profiles():
+    """
+    Forget every cached profile, e.g. after installing an extension or
+    upgrading the server.
+    """
+
+    with _lock:
+        _profiles.clear()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lighter weight results than a namedtuple per row, for reports over large
+catalogs:
+
+* 'record': a list of Records, namedtuples (the default)
+* 'tuple': Rows, a list of plain tuples with the column names kept once
+* 'columnar': Columns, a dict of column name to a NumPy array (a list
+  without NumPy) of its values
+
+Rows and Columns turn back into Records with records().
+"""
+
+from collections import OrderedDict, namedtuple
+
+import psycopg2.extensions
+
+ROW_FORMATS = ('record', 'tuple', 'columnar')
+
+# NumPy takes longer to import than all of pgextras, so it is imported with
+# the first columnar result: False until then, None if it is not installed.
+numpy = False
+
+
+def load_numpy():
+    """
+    :returns: the numpy module, None if it is not installed
+    """
+
+    global numpy
+
+    if numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+    return numpy
+
+
+# Columns that identify a row of a report from one run to the next, so its
+# other values can be compared. Reports not listed are keyed by their first
+# column.
+KEYS = {
+    'bloat': ('type', 'schemaname', 'object_name'),
+    'blocking': ('blocked_pid', 'blocking_pid'),
+    'calls': ('query',),
+    'index_size': ('schemaname', 'name'),
+    'index_usage': ('schemaname', 'relname'),
+    'locks': ('pid', 'relname', 'transactionid'),
+    'outliers': ('query',),
+    'seq_scans': ('schemaname', 'name'),
+    'statement_counters': ('userid', 'dbid', 'queryid'),
+    'table_size': ('schemaname', 'name'),
+    'total_table_size': ('schemaname', 'name'),
+    'unused_indexes': ('table', 'index'),
+    'vacuum_stats': ('schema', 'table'),
+}
+
+
+def key_columns(report, columns):
+    # Sizes only have their schemaname with raw=True
+    keys = tuple(
+        column for column in KEYS.get(report, ()) if column in columns
+    )
+
+    return keys or tuple(columns[:1])
+
+
+def row_keys(report, records):
+    """
+    :returns: list of keys, the values of the key columns and a counter, one
+        per record and unique within the report
+    """
+
+    keys = []
+    seen = {}
+
+    for record in records:
+        key = tuple(
+            getattr(record, column)
+            for column in key_columns(report, record._fields)
+        )
+        # A pid can hold several locks on the same relation
+        seen[key] = seen.get(key, 0) + 1
+        keys.append(key + (seen[key],))
+
+    return keys
+
+
+def to_records(columns, rows):
+    Record = namedtuple('Record', columns, rename=True)
+
+    return [Record._make(row) for row in rows]
+
+
+class Rows(list):
+    """
+    Plain tuples sharing one list of column names.
+
+        >>> rows = pg.vacuum_stats()
+        >>> rows.columns
+        ['schema', 'table', 'last_vacuum', ...]
+        >>> rows[0]
+        ('public', 'pgbench_accounts', None, ...)
+    """
+
+    def __init__(self, columns, rows=()):
+        super(Rows, self).__init__(rows)
+        self.columns = list(columns)
+
+    def records(self):
+        """
+        :returns: list of Records
+        """
+
+        return to_records(self.columns, self)
+
+
+class RecordStream(object):
+    """
+    Records as they arrive from a server side cursor, see
+    PgExtras.iter_report(). Once they are all read, columns holds the names
+    of the report's columns, also when it returned no rows.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.records = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.records)
+
+    def close(self):
+        self.records.close()
+
+
+class RowsCursor(psycopg2.extensions.cursor):
+    """
+    A cursor whose fetchall() returns Rows.
+    """
+
+    def fetchall(self):
+        rows = super(RowsCursor, self).fetchall()
+
+        return Rows([column.name for column in self.description], rows)
+
+
+def to_array(values):
+    if load_numpy() is None:
+        return list(values)
+
+    # Anything NumPy has no type for (Decimal, datetime with a time zone,
+    # a mix with None) stays as Python objects.
+    try:
+        array = numpy.array(values)
+    except ValueError:
+        array = None
+
+    if array is None or array.ndim != 1:
+        # Array values, e.g. blocked_by, would add a dimension
+        array = numpy.empty(len(values), dtype=object)
+
+        for position, value in enumerate(values):
+            array[position] = value
+
+    return array
+
+
+class Columns(OrderedDict):
+    """
+    The values of each column together, in column order.
+
+        >>> columns = pg.vacuum_stats(raw=True)
+        >>> columns['dead_rowcount'].sum()
+        41290
+    """
+
+    def __init__(self, columns, rows=()):
+        super(Columns, self).__init__()
+        rows = list(rows)
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+
+        for column, column_values in zip(columns, values):
+            self[column] = to_array(column_values)
+
+        self.length = len(rows)
+
+    @property
+    def columns(self):
+        return list(self)
+
+    def rows(self):
+        """
+        :returns: list of tuples
+        """
+
+        values = [
+            column.tolist() if hasattr(column, 'tolist') else column
+            for column in self.values()
+        ]
+
+        return list(zip(*values)) if values else []
+
+    def records(self):
+        """
+        :returns: list of Records
+        """
+
+        return to_records(self.columns, self.rows())
+
+
+def format_rows(columns, rows, row_format):
+    """
+    :param columns: column names
+    :param rows: tuples
+    :param row_format: one of ROW_FORMATS
+    :returns: list of Records, Rows or Columns
+    """
+
+    if row_format == 'columnar':
+        return Columns(columns, rows)
+
+    if row_format == 'tuple':
+        return Rows(columns, rows)
+
+    return to_records(columns, rows)
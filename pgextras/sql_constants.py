@@ -11,17 +11,24 @@ VACUUM_STATS = """
     pg_class.oid, relname, nspname, array_to_string(reloptions, '') AS relopts
     FROM
      pg_class INNER JOIN pg_namespace ns ON relnamespace = ns.oid
+    WHERE
+    (%(schemas)s::text[] IS NULL
+        OR nspname = ANY(%(schemas)s::text[]))
+    AND (%(exclude_schemas)s::text[] IS NULL
+        OR nspname <> ALL(%(exclude_schemas)s::text[]))
+    AND (%(relations)s::text[] IS NULL
+        OR relname = ANY(%(relations)s::text[]))
     ), vacuum_settings AS (
     SELECT
     oid, relname, nspname,
     CASE
-      WHEN relopts LIKE '%autovacuum_vacuum_threshold%'
+      WHEN relopts LIKE '%%autovacuum_vacuum_threshold%%'
         THEN substring(relopts,
             '.*autovacuum_vacuum_threshold=([0-9.]+).*')::integer
         ELSE current_setting('autovacuum_vacuum_threshold')::integer
       END AS autovacuum_vacuum_threshold,
     CASE
-      WHEN relopts LIKE '%autovacuum_vacuum_scale_factor%'
+      WHEN relopts LIKE '%%autovacuum_vacuum_scale_factor%%'
         THEN substring(relopts,
             '.*autovacuum_vacuum_scale_factor=([0-9.]+).*')::real
         ELSE current_setting('autovacuum_vacuum_scale_factor')::real
@@ -32,32 +39,28 @@ VACUUM_STATS = """
     SELECT
     vacuum_settings.nspname AS schema,
     vacuum_settings.relname AS table,
-    to_char(psut.last_vacuum, 'YYYY-MM-DD HH24:MI') AS last_vacuum,
-    to_char(psut.last_autovacuum, 'YYYY-MM-DD HH24:MI') AS last_autovacuum,
-    to_char(pg_class.reltuples, '9G999G999G999') AS rowcount,
-    to_char(psut.n_dead_tup, '9G999G999G999') AS dead_rowcount,
-    to_char(autovacuum_vacuum_threshold
-       + (autovacuum_vacuum_scale_factor::numeric * pg_class.reltuples),
-        '9G999G999G999') AS autovacuum_threshold,
-    CASE
-    WHEN autovacuum_vacuum_threshold +
+    psut.last_vacuum,
+    psut.last_autovacuum,
+    pg_class.reltuples::bigint AS rowcount,
+    psut.n_dead_tup AS dead_rowcount,
+    round(autovacuum_vacuum_threshold
+       + (autovacuum_vacuum_scale_factor::numeric * pg_class.reltuples)
+    )::bigint AS autovacuum_threshold,
+    autovacuum_vacuum_threshold +
         (autovacuum_vacuum_scale_factor::numeric * pg_class.reltuples) <
-            psut.n_dead_tup
-    THEN 'yes'
-    END AS expect_autovacuum
+            psut.n_dead_tup AS expect_autovacuum
     FROM
     pg_stat_user_tables psut INNER JOIN pg_class ON psut.relid = pg_class.oid
     INNER JOIN vacuum_settings ON pg_class.oid = vacuum_settings.oid
     ORDER BY 1
+    LIMIT %(limit)s
 """
 
 OUTLIERS = """
     SELECT {query} AS qry,
         interval '1 millisecond' * {tot_time} AS exec_time,
-        to_char(({tot_time}/sum({tot_time}) OVER()) * 100,
-            'FM90D0') || '%' AS
-        prop_exec_time,
-        to_char(calls, 'FM999G999G999G990') AS ncalls,
+        {tot_time}/sum({tot_time}) OVER() AS prop_exec_time,
+        calls AS ncalls,
         interval '1 millisecond' * (blk_read_time + blk_write_time)
             AS sync_io_time
     FROM pg_stat_statements
@@ -68,28 +71,91 @@ OUTLIERS = """
         LIMIT 1
     )
     ORDER BY {tot_time} DESC
-    LIMIT 10
+    LIMIT %(limit)s
+"""
+
+# Who waits for whom, as (pid, blocking_pid) pairs. pg_blocking_pids()
+# (Postgres 9.6) knows about every lock type and the lock mode conflicts.
+LOCK_WAITS = """
+    SELECT DISTINCT
+        pid,
+        unnest(pg_blocking_pids(pid)) AS blocking_pid
+    FROM pg_catalog.pg_stat_activity
+    WHERE wait_event_type = 'Lock'
+"""
+
+# Older servers pair every ungranted lock with the granted locks on the same
+# object. Lock modes are not compared, so holders of a compatible lock on the
+# object are listed as well. The coalesces keep the join hashable.
+LOCK_WAITS_PG_LOCKS = """
+    SELECT DISTINCT
+        blocked.pid,
+        blocking.pid AS blocking_pid
+    FROM pg_catalog.pg_locks blocked
+        JOIN pg_catalog.pg_locks blocking
+            ON blocking.locktype = blocked.locktype
+            AND coalesce(blocking.database, 0) = coalesce(blocked.database, 0)
+            AND coalesce(blocking.relation, 0) = coalesce(blocked.relation, 0)
+            AND coalesce(blocking.page, -1) = coalesce(blocked.page, -1)
+            AND coalesce(blocking.tuple, -1) = coalesce(blocked.tuple, -1)
+            AND coalesce(blocking.virtualxid, '')
+                = coalesce(blocked.virtualxid, '')
+            AND coalesce(blocking.transactionid, '0')
+                = coalesce(blocked.transactionid, '0')
+            AND coalesce(blocking.classid, 0) = coalesce(blocked.classid, 0)
+            AND coalesce(blocking.objid, 0) = coalesce(blocked.objid, 0)
+            AND coalesce(blocking.objsubid, 0) = coalesce(blocked.objsubid, 0)
+            AND blocking.pid <> blocked.pid
+            AND blocking.granted
+    WHERE NOT blocked.granted
 """
 
 BLOCKING = """
+    WITH waits AS ({waits})
     SELECT
-        bl.pid AS blocked_pid,
+        waits.pid AS blocked_pid,
         ka.{query_column} AS blocking_statement,
         now() - ka.query_start AS blocking_duration,
-        kl.pid AS blocking_pid,
+        waits.blocking_pid,
         a.{query_column} AS blocked_statement,
         now() - a.query_start AS blocked_duration
     FROM
-        pg_catalog.pg_locks bl
-        JOIN pg_catalog.pg_stat_activity a ON bl.pid = a.{pid_column}
-        JOIN pg_catalog.pg_locks kl
-        JOIN pg_catalog.pg_stat_activity ka ON kl.pid = ka.{pid_column}
-            ON bl.transactionid = kl.transactionid AND bl.pid != kl.pid
-    WHERE NOT bl.granted
+        waits
+        JOIN pg_catalog.pg_stat_activity a ON waits.pid = a.{pid_column}
+        JOIN pg_catalog.pg_stat_activity ka
+            ON waits.blocking_pid = ka.{pid_column}
+    LIMIT %(limit)s
+"""
+
+# Every backend that waits or is waited for, along with whom it waits for.
+# Blockers that are not backends (prepared transactions) have no activity.
+LOCK_GRAPH = """
+    WITH waits AS ({waits}), involved AS (
+        SELECT
+            pid,
+            array_agg(blocking_pid) AS blocked_by
+        FROM waits
+        GROUP BY pid
+        UNION ALL
+        SELECT DISTINCT
+            blocking_pid,
+            '{{}}'::integer[]
+        FROM waits
+        WHERE blocking_pid NOT IN (SELECT pid FROM waits)
+    )
+    SELECT
+        involved.pid,
+        involved.blocked_by,
+        now() - a.query_start AS duration,
+        a.{query_column} AS query
+    FROM involved
+        LEFT JOIN pg_catalog.pg_stat_activity a
+            ON involved.pid = a.{pid_column}
 """
 
 INDEX_USAGE = """
     SELECT
+        schemaname,
         relname,
         CASE idx_scan
             WHEN 0 THEN 'Insufficient data'
@@ -98,13 +164,13 @@ INDEX_USAGE = """
         n_live_tup rows_in_table
     FROM pg_stat_user_tables
     ORDER BY n_live_tup DESC
+    LIMIT %(limit)s
 """
 
 CALLS = """
     {select} interval '1 millisecond' * {tot_time} AS exec_time,
-        to_char(({tot_time}/sum({tot_time}) OVER()) * 100, 'FM90D0') || '%'
-            AS prop_exec_time,
-        to_char(calls, 'FM999G999G990') AS ncalls,
+        {tot_time}/sum({tot_time}) OVER() AS prop_exec_time,
+        calls AS ncalls,
         interval '1 millisecond' * (blk_read_time + blk_write_time)
             AS sync_io_time
     FROM pg_stat_statements
@@ -114,7 +180,7 @@ CALLS = """
         WHERE usename = current_user LIMIT 1
     )
     ORDER BY calls DESC
-    LIMIT 10
+    LIMIT %(limit)s
 """
 
 LOCKS = """
@@ -134,6 +200,12 @@ LOCKS = """
             AND pg_locks.mode = 'ExclusiveLock'
             AND pg_stat_activity.{pid_column} <> pg_backend_pid()
     ORDER BY query_start
+    LIMIT %(limit)s
+"""
+
+EXTENSIONS = """
+    SELECT extname, extversion
+    FROM pg_extension
 """
 
 PG_STAT_STATEMENT = """
@@ -150,91 +222,102 @@ BLOAT = """
             current_setting('block_size')::numeric AS bs,
             23 AS hdr,
             4 AS ma
+    ), table_stats AS (
+        SELECT
+            c.oid AS relid,
+            n.nspname AS schemaname,
+            c.relname AS tablename,
+            c.relpages,
+            c.reltuples,
+            SUM((1-s.null_frac)*s.avg_width) AS datawidth,
+            MAX(s.null_frac) AS maxfracsum,
+            SUM(CASE WHEN s.null_frac<>0 THEN 1 ELSE 0 END) AS nullcols
+        FROM pg_stats s
+            JOIN pg_namespace n ON n.nspname = s.schemaname
+            JOIN pg_class c ON c.relnamespace = n.oid
+                AND c.relname = s.tablename
+        WHERE
+            NOT s.inherited
+            AND c.relkind IN ('r', 'm')
+            AND n.nspname <> 'information_schema'
+            AND (%(schemas)s::text[] IS NULL
+                OR n.nspname = ANY(%(schemas)s::text[]))
+            AND (%(exclude_schemas)s::text[] IS NULL
+                OR n.nspname <> ALL(%(exclude_schemas)s::text[]))
+            AND (%(relations)s::text[] IS NULL
+                OR c.relname = ANY(%(relations)s::text[]))
+        GROUP BY 1,2,3,4,5
     ), bloat_info AS (
         SELECT
-            ma,
-            bs,
+            relid,
             schemaname,
             tablename,
+            relpages,
+            reltuples,
+            ma,
+            bs,
             (datawidth+(
                 hdr+ma-(
                     CASE
-                        WHEN hdr%ma=0
+                        WHEN hdr%%ma=0
                         THEN ma
-                        ELSE hdr%ma
+                        ELSE hdr%%ma
                     END
                 )
             ))::numeric AS datahdr,
             (maxfracsum*(
                 nullhdr+ma-(
                     CASE
-                        WHEN nullhdr%ma=0
+                        WHEN nullhdr%%ma=0
                         THEN ma
-                        ELSE nullhdr%ma
+                        ELSE nullhdr%%ma
                     END
                 )
             )) AS nullhdr2
         FROM (
             SELECT
-                schemaname,
-                tablename,
+                table_stats.*,
+                hdr+1+nullcols::integer/8 AS nullhdr,
                 hdr,
                 ma,
-                bs,
-                SUM((1-null_frac)*avg_width) AS datawidth,
-                MAX(null_frac) AS maxfracsum,
-                hdr+(
-                    SELECT 1+count(*)/8
-                    FROM pg_stats s2
-                    WHERE
-                        null_frac<>0
-                        AND s2.schemaname = s.schemaname
-                        AND s2.tablename = s.tablename
-                ) AS nullhdr
+                bs
             FROM
-                pg_stats s,
+                table_stats,
                 constants
-            GROUP BY 1,2,3,4,5
         ) AS foo
     ), table_bloat AS (
         SELECT
+            relid,
             schemaname,
             tablename,
-            cc.relpages,
+            relpages,
             bs,
             CEIL(
-                (cc.reltuples*(
+                (reltuples*(
                     (datahdr+ma-(
                         CASE
-                            WHEN datahdr%ma=0
+                            WHEN datahdr%%ma=0
                             THEN ma
-                            ELSE datahdr%ma
+                            ELSE datahdr%%ma
                         END
                     ))+nullhdr2+4
                 ))/(bs-20::float)
             ) AS otta
         FROM bloat_info
-            JOIN pg_class cc ON cc.relname = bloat_info.tablename
-            JOIN pg_namespace nn ON cc.relnamespace = nn.oid
-                AND nn.nspname = bloat_info.schemaname
-                AND nn.nspname <> 'information_schema'
     ), index_bloat AS (
         SELECT
+            c2.oid AS indexrelid,
             schemaname,
             tablename,
             bs,
-            COALESCE(c2.relname,'?') AS iname,
-            COALESCE(c2.reltuples,0) AS ituples,
-            COALESCE(c2.relpages,0) AS ipages,
+            c2.relname AS iname,
+            c2.reltuples AS ituples,
+            c2.relpages AS ipages,
             COALESCE(
                 CEIL((c2.reltuples*(datahdr-12))/(bs-20::float)),0
             ) AS iotta
         FROM bloat_info
-            JOIN pg_class cc ON cc.relname = bloat_info.tablename
-            JOIN pg_namespace nn ON cc.relnamespace = nn.oid
-                AND nn.nspname = bloat_info.schemaname
-                AND nn.nspname <> 'information_schema'
-            JOIN pg_index i ON indrelid = cc.oid
+            JOIN pg_index i ON i.indrelid = bloat_info.relid
             JOIN pg_class c2 ON c2.oid = i.indexrelid
      )
      SELECT
@@ -242,48 +325,127 @@ BLOAT = """
         schemaname,
         object_name,
         bloat,
-        pg_size_pretty(raw_waste) AS waste
+        raw_waste AS waste,
+        oid
      FROM (
         SELECT
             'table' AS type,
             schemaname,
             tablename || '' AS object_name,
-            ROUND(
-                CASE
-                    WHEN otta=0
-                    THEN 0.0
-                    ELSE table_bloat.relpages/otta::numeric
-                END,
-            1) AS bloat,
+            CASE
+                WHEN otta=0
+                THEN 0.0
+                ELSE relpages/otta::float
+            END AS bloat,
             CASE
                 WHEN relpages < otta
-                THEN '0'
-                ELSE (bs*(
-                    table_bloat.relpages-otta)::bigint)::bigint
-            END AS raw_waste
+                THEN 0
+                ELSE (bs*(relpages-otta)::bigint)::bigint
+            END AS raw_waste,
+            relid AS oid
         FROM table_bloat
-        UNION
+        UNION ALL
         SELECT
             'index' AS type,
             schemaname,
             tablename || '::' || iname AS object_name,
-            ROUND(
-                CASE
-                    WHEN iotta=0 OR ipages=0
-                    THEN 0.0
-                    ELSE ipages/iotta::numeric
-                END,
-            1) AS bloat,
+            CASE
+                WHEN iotta=0 OR ipages=0
+                THEN 0.0
+                ELSE ipages/iotta::float
+            END AS bloat,
             CASE
                 WHEN ipages < iotta
-                THEN '0'
+                THEN 0
                 ELSE (bs*(ipages-iotta))::bigint
-            END AS raw_waste
+            END AS raw_waste,
+            indexrelid AS oid
         FROM index_bloat
     ) bloat_summary
     ORDER BY
         raw_waste DESC,
         bloat DESC
+    LIMIT %(limit)s
+"""
+
+# Exact bloat measurements for the candidates the estimate found. The
+# statements are run once per candidate, with the oid as a parameter.
+BTREE_INDEXES = """
+    SELECT c.oid
+    FROM pg_class c
+        JOIN pg_am am ON am.oid = c.relam
+    WHERE
+        c.oid = ANY(%(oids)s::oid[])
+        AND am.amname = 'btree'
+"""
+
+BLOAT_EXACT_TABLE = """
+    SELECT
+        CASE
+            WHEN table_len > waste
+            THEN table_len::float / (table_len - waste)
+            ELSE 0.0
+        END AS bloat,
+        waste
+    FROM (
+        SELECT
+            table_len,
+            (approx_free_space + dead_tuple_len)::bigint AS waste
+        FROM pgstattuple_approx(%(oid)s::regclass)
+    ) AS exact
+"""
+
+# pgstattuple before 1.3 (Postgres 9.5) has no pgstattuple_approx
+BLOAT_EXACT_TABLE_SCAN = """
+    SELECT
+        CASE
+            WHEN table_len > waste
+            THEN table_len::float / (table_len - waste)
+            ELSE 0.0
+        END AS bloat,
+        waste
+    FROM (
+        SELECT
+            table_len,
+            (free_space + dead_tuple_len)::bigint AS waste
+        FROM pgstattuple(%(oid)s::regclass)
+    ) AS exact
+"""
+
+BLOAT_EXACT_INDEX = """
+    SELECT
+        CASE
+            WHEN index_size > waste
+            THEN index_size::float / (index_size - waste)
+            ELSE 0.0
+        END AS bloat,
+        waste
+    FROM (
+        SELECT
+            index_size,
+            CASE
+                WHEN avg_leaf_density = 'NaN'
+                THEN 0
+                ELSE ((
+                    leaf_pages * (100 - avg_leaf_density::numeric) / 100
+                    + empty_pages + deleted_pages
+                ) * current_setting('block_size')::numeric)::bigint
+            END AS waste
+        FROM pgstatindex(%(oid)s::regclass)
+    ) AS exact
+"""
+
+# Measured candidates are sent back to be formatted like the estimate.
+BLOAT_EXACT_ROWS = """
+    SELECT *
+    FROM unnest(
+        %(type)s::text[],
+        %(schemaname)s::name[],
+        %(object_name)s::text[],
+        %(bloat)s::float[],
+        %(waste)s::bigint[],
+        %(oid)s::oid[]
+    ) AS bloat(type, schemaname, object_name, bloat, waste, oid)
 """
 
 LONG_RUNNING_QUERIES = """
@@ -295,96 +457,137 @@ LONG_RUNNING_QUERIES = """
     WHERE
         pg_stat_activity.{query_column} <> ''::text
         {idle}
-        AND now() - pg_stat_activity.query_start > interval '5 minutes'
+        AND now() - pg_stat_activity.query_start > %(min_duration)s::interval
     ORDER BY now() - pg_stat_activity.query_start DESC
+    LIMIT %(limit)s
 """
 
 SEQ_SCANS = """
      SELECT
+        schemaname,
         relname AS name,
         seq_scan AS count
      FROM pg_stat_user_tables
+     WHERE
+        (%(schemas)s::text[] IS NULL
+            OR schemaname = ANY(%(schemas)s::text[]))
+        AND (%(exclude_schemas)s::text[] IS NULL
+            OR schemaname <> ALL(%(exclude_schemas)s::text[]))
+        AND (%(relations)s::text[] IS NULL
+            OR relname = ANY(%(relations)s::text[]))
      ORDER BY seq_scan DESC
+     LIMIT %(limit)s
 """
 
 UNUSED_INDEXES = """
     SELECT
         schemaname || '.' || relname AS table,
         indexrelname AS index,
-        pg_size_pretty(pg_relation_size(i.indexrelid)) AS index_size,
+        pg_relation_size(i.indexrelid) AS index_size,
         idx_scan AS index_scans
     FROM pg_stat_user_indexes ui
         JOIN pg_index i ON ui.indexrelid = i.indexrelid
     WHERE
-        NOT indisunique AND idx_scan < 50
+        NOT indisunique AND idx_scan < %(max_scans)s
         AND pg_relation_size(relid) > 5 * 8192
+        AND pg_relation_size(i.indexrelid) >= %(min_size_bytes)s
     ORDER BY
         pg_relation_size(i.indexrelid) / nullif(idx_scan, 0) DESC
         NULLS FIRST,
         pg_relation_size(i.indexrelid) DESC
+    LIMIT %(limit)s
 """
 
 TOTAL_TABLE_SIZE = """
     SELECT
+        n.nspname AS schemaname,
         c.relname AS name,
-        pg_size_pretty(pg_total_relation_size(c.oid)) AS size
+        pg_total_relation_size(c.oid) AS size
     FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
     WHERE
         n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
         AND c.relkind='r'
+        AND pg_total_relation_size(c.oid) >= %(min_size_bytes)s
+        AND (%(schemas)s::text[] IS NULL
+            OR n.nspname = ANY(%(schemas)s::text[]))
+        AND (%(exclude_schemas)s::text[] IS NULL
+            OR n.nspname <> ALL(%(exclude_schemas)s::text[]))
+        AND (%(relations)s::text[] IS NULL
+            OR c.relname = ANY(%(relations)s::text[]))
     ORDER BY pg_total_relation_size(c.oid) DESC
+    LIMIT %(limit)s
 """
 
 TOTAL_INDEXES_SIZE = """
     SELECT
         c.relname AS table,
-        pg_size_pretty(pg_indexes_size(c.oid)) AS index_size
+        pg_indexes_size(c.oid) AS index_size
     FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
     WHERE
         n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
         AND c.relkind='r'
-    ORDER BY pg_indexes_size(c.oid) DESC;
+        AND pg_indexes_size(c.oid) >= %(min_size_bytes)s
+    ORDER BY pg_indexes_size(c.oid) DESC
+    LIMIT %(limit)s
 """
 
 TABLE_SIZE = """
      SELECT
+        n.nspname AS schemaname,
         c.relname AS name,
-        pg_size_pretty(pg_table_size(c.oid)) AS size
+        pg_table_size(c.oid) AS size
      FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
      WHERE
         n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
         AND c.relkind='r'
+        AND pg_table_size(c.oid) >= %(min_size_bytes)s
+        AND (%(schemas)s::text[] IS NULL
+            OR n.nspname = ANY(%(schemas)s::text[]))
+        AND (%(exclude_schemas)s::text[] IS NULL
+            OR n.nspname <> ALL(%(exclude_schemas)s::text[]))
+        AND (%(relations)s::text[] IS NULL
+            OR c.relname = ANY(%(relations)s::text[]))
      ORDER BY pg_table_size(c.oid) DESC
+     LIMIT %(limit)s
 """
 
 INDEX_SIZE = """
     SELECT
+        n.nspname AS schemaname,
         c.relname AS name,
-        pg_size_pretty(sum(c.relpages::bigint*8192)::bigint) AS size
+        sum(c.relpages::bigint*8192)::bigint AS size
     FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
     WHERE
         n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
         AND c.relkind='i'
-    GROUP BY c.relname
+        AND (%(schemas)s::text[] IS NULL
+            OR n.nspname = ANY(%(schemas)s::text[]))
+        AND (%(exclude_schemas)s::text[] IS NULL
+            OR n.nspname <> ALL(%(exclude_schemas)s::text[]))
+        AND (%(relations)s::text[] IS NULL
+            OR c.relname = ANY(%(relations)s::text[]))
+    GROUP BY n.nspname, c.relname
+    HAVING sum(c.relpages::bigint*8192) >= %(min_size_bytes)s
     ORDER BY sum(c.relpages) DESC
+    LIMIT %(limit)s
 """
 
 TOTAL_INDEX_SIZE = """
-    SELECT pg_size_pretty(sum(c.relpages::bigint*8192)::bigint) AS size
+    SELECT sum(c.relpages::bigint*8192)::bigint AS size
     FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
     WHERE
         n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
-        AND c.relkind='i';
+        AND c.relkind='i'
 """
 
 CACHE_HIT = """
@@ -403,13 +606,15 @@ CACHE_HIT = """
 TABLE_INDEXES_SIZE = """
     SELECT
         c.relname AS table,
-        pg_size_pretty(pg_indexes_size(c.oid)) AS index_size
+        pg_indexes_size(c.oid) AS index_size
     FROM pg_class c
         LEFT JOIN pg_namespace n ON (n.oid = c.relnamespace)
     WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
         AND n.nspname !~ '^pg_toast'
         AND c.relkind='r'
-    ORDER BY pg_indexes_size(c.oid) DESC;
+        AND pg_indexes_size(c.oid) >= %(min_size_bytes)s
+    ORDER BY pg_indexes_size(c.oid) DESC
+    LIMIT %(limit)s
 """
 
 PS = """
@@ -423,8 +628,192 @@ PS = """
         AND {pid_column} <> pg_backend_pid()
         {idle}
     ORDER BY query_start DESC
+    LIMIT %(limit)s
 """
 
 VERSION = """
     SELECT version()
 """
+
+STATEMENT_COUNTERS = """
+    SELECT
+        clock_timestamp() AS sampled_at,
+        userid,
+        dbid,
+        {queryid} AS queryid,
+        query,
+        calls,
+        {tot_time} AS total_time,
+        shared_blks_read + local_blks_read AS blks_read,
+        rows
+    FROM pg_stat_statements
+"""
+
+# When a sample of the statement counters has no rows
+SAMPLED_AT = """
+    SELECT clock_timestamp() AS sampled_at
+"""
+
+CALLS_TRUNCATED_SELECT = """
+    SELECT CASE
+        WHEN length(query) < 40
+        THEN query
+        ELSE substr(query, 0, 38) || '..'
+    END AS qry,
+"""
+
+OUTLIERS_TRUNCATED_QUERY = """
+    CASE WHEN length(query) < 40
+        THEN query
+        ELSE substr(query, 0, 38) || '..'
+    END
+"""
+
+SNAPSHOT_BEGIN = """
+    BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;
+"""
+
+SNAPSHOT = """
+    SELECT now() AS taken_at{columns}
+"""
+
+SNAPSHOT_COLUMN = """,
+    (
+        SELECT coalesce(json_agg(report), '[]')
+        FROM ({statement}) AS report
+    ) AS {report}
+"""
+
+# Reports select raw values (bytes, counts, timestamps, ratios). Unless raw
+# output is asked for, these projections turn them into the human friendly
+# strings the reports have always returned. A subquery's ORDER BY doesn't
+# carry over to the query around it, so each repeats the report's order on
+# the raw columns.
+PRETTY = {
+    'bloat': """
+        SELECT
+            type,
+            schemaname,
+            object_name,
+            round(bloat::numeric, 1) AS bloat,
+            pg_size_pretty(waste) AS waste
+        FROM ({statement}) AS report
+        ORDER BY report.waste DESC, report.bloat DESC
+    """,
+    'calls': """
+        SELECT
+            {qry},
+            exec_time,
+            to_char(prop_exec_time * 100, 'FM90D0') || '%%' AS prop_exec_time,
+            to_char(ncalls, 'FM999G999G990') AS ncalls,
+            sync_io_time
+        FROM ({statement}) AS report
+        ORDER BY report.ncalls DESC
+    """,
+    'index_size': """
+        SELECT name, pg_size_pretty(size) AS size
+        FROM ({statement}) AS report
+        ORDER BY report.size DESC
+    """,
+    'outliers': """
+        SELECT
+            qry,
+            exec_time,
+            to_char(prop_exec_time * 100, 'FM90D0') || '%%' AS prop_exec_time,
+            to_char(ncalls, 'FM999G999G999G990') AS ncalls,
+            sync_io_time
+        FROM ({statement}) AS report
+        ORDER BY report.exec_time DESC
+    """,
+    'table_indexes_size': """
+        SELECT "table", pg_size_pretty(index_size) AS index_size
+        FROM ({statement}) AS report
+        ORDER BY report.index_size DESC
+    """,
+    'table_size': """
+        SELECT name, pg_size_pretty(size) AS size
+        FROM ({statement}) AS report
+        ORDER BY report.size DESC
+    """,
+    'total_index_size': """
+        SELECT pg_size_pretty(size) AS size
+        FROM ({statement}) AS report
+    """,
+    'total_indexes_size': """
+        SELECT "table", pg_size_pretty(index_size) AS index_size
+        FROM ({statement}) AS report
+        ORDER BY report.index_size DESC
+    """,
+    'total_table_size': """
+        SELECT name, pg_size_pretty(size) AS size
+        FROM ({statement}) AS report
+        ORDER BY report.size DESC
+    """,
+    'unused_indexes': """
+        SELECT
+            "table",
+            index,
+            pg_size_pretty(index_size) AS index_size,
+            index_scans
+        FROM ({statement}) AS report
+        ORDER BY
+            report.index_size / nullif(report.index_scans, 0) DESC
+            NULLS FIRST,
+            report.index_size DESC
+    """,
+    'vacuum_stats': """
+        SELECT
+            schema,
+            "table",
+            to_char(last_vacuum, 'YYYY-MM-DD HH24:MI') AS last_vacuum,
+            to_char(last_autovacuum, 'YYYY-MM-DD HH24:MI') AS last_autovacuum,
+            to_char(rowcount, '9G999G999G999') AS rowcount,
+            to_char(dead_rowcount, '9G999G999G999') AS dead_rowcount,
+            to_char(autovacuum_threshold, '9G999G999G999')
+                AS autovacuum_threshold,
+            CASE WHEN expect_autovacuum THEN 'yes' END AS expect_autovacuum
+        FROM ({statement}) AS report
+        ORDER BY report.schema
+    """,
+}
+
+# Values for the query parameters of the reports. Every report statement is
+# executed with parameters, which is why a literal % is written as %%.
+PARAMS = {
+    'exclude_schemas': None,
+    'limit': None,
+    'max_scans': 50,
+    'min_duration': '5 minutes',
+    'min_size_bytes': 0,
+    'relations': None,
+    'schemas': None,
+}
+
+REPORT_PARAMS = {
+    'calls': {'limit': 10},
+    'outliers': {'limit': 10},
+}
+
+REPORTS = {
+    'bloat': BLOAT,
+    'blocking': BLOCKING,
+    'cache_hit': CACHE_HIT,
+    'calls': CALLS,
+    'index_size': INDEX_SIZE,
+    'index_usage': INDEX_USAGE,
+    'lock_graph': LOCK_GRAPH,
+    'locks': LOCKS,
+    'long_running_queries': LONG_RUNNING_QUERIES,
+    'outliers': OUTLIERS,
+    'ps': PS,
+    'seq_scans': SEQ_SCANS,
+    'statement_counters': STATEMENT_COUNTERS,
+    'table_indexes_size': TABLE_INDEXES_SIZE,
+    'table_size': TABLE_SIZE,
+    'total_index_size': TOTAL_INDEX_SIZE,
+    'total_indexes_size': TOTAL_INDEXES_SIZE,
+    'total_table_size': TOTAL_TABLE_SIZE,
+    'unused_indexes': UNUSED_INDEXES,
+    'vacuum_stats': VACUUM_STATS,
+    'version': VERSION,
+}
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+pg_stat_statements counters are cumulative since the last reset. Sampling
+them at two points and dividing the difference by the time in between shows
+what is expensive right now rather than since the beginning of time.
+"""
+
+import time
+from collections import namedtuple
+
+from . import sql_constants as sql
+from .base import is_error
+
+Sample = namedtuple(
+    'Sample', 'taken_at counters error', defaults=(None,)
+)
+
+Rate = namedtuple('Record', [
+    'queryid',
+    'query',
+    'calls_per_sec',
+    'exec_time_per_sec',
+    'blks_read_per_sec',
+    'rows_per_sec',
+    'mean_time',
+])
+
+COUNTERS = ('calls', 'total_time', 'blks_read', 'rows')
+
+
+def take_sample(pg):
+    """
+    Read the current pg_stat_statements counters.
+
+    :param pg: PgExtras instance
+    :returns: Sample, counters are keyed by (userid, dbid, queryid), error
+        is the timeout Record when reading them timed out
+    """
+
+    records = pg.run_report('statement_counters', row_format='record')
+
+    if is_error(records):
+        return Sample(None, {}, records[0])
+
+    counters = dict(
+        ((record.userid, record.dbid, record.queryid), record)
+        for record in records
+    )
+
+    if records:
+        taken_at = records[0].sampled_at
+    else:
+        # Right after pg_stat_statements_reset() or on a quiet server, the
+        # statements of the next sample still need a start to count from
+        taken_at = pg.execute(sql.SAMPLED_AT)[0].sampled_at
+
+    return Sample(taken_at, counters)
+
+
+def compute_rates(before, after, limit=None):
+    """
+    Per second rates for every statement between two samples, busiest
+    (most execution time per second) first.
+
+    Statements that were evicted before the second sample are left out, as
+    there is nothing to compare them with. Statements that showed up in
+    between, or whose counters went down because they were reset, are
+    measured from zero.
+
+    Record(
+        queryid=-2419287450163284467,
+        query='UPDATE pgbench_tellers SET tbalance = tbalance + $1',
+        calls_per_sec=412.5,
+        exec_time_per_sec=181.2,
+        blks_read_per_sec=0.0,
+        rows_per_sec=412.5,
+        mean_time=0.439
+    )
+
+    :param before: Sample
+    :param after: Sample
+    :param limit: only return this many statements
+    :returns: list of Records, times are in milliseconds
+    """
+
+    if before.taken_at is None or after.taken_at is None:
+        return []
+
+    elapsed = (after.taken_at - before.taken_at).total_seconds()
+
+    if elapsed <= 0:
+        return []
+
+    rates = []
+
+    for key, current in after.counters.items():
+        previous = before.counters.get(key)
+        deltas = [float(getattr(current, name)) for name in COUNTERS]
+
+        if previous is not None:
+            since_previous = [
+                delta - float(getattr(previous, name))
+                for delta, name in zip(deltas, COUNTERS)
+            ]
+
+            # A counter going backwards means the entry was reset (or evicted
+            # and created again), so everything it holds is new.
+            if min(since_previous) >= 0:
+                deltas = since_previous
+
+        calls, total_time, blks_read, rows = deltas
+
+        if not calls:
+            continue
+
+        rates.append(Rate(
+            current.queryid,
+            current.query,
+            calls / elapsed,
+            total_time / elapsed,
+            blks_read / elapsed,
+            rows / elapsed,
+            total_time / calls,
+        ))
+
+    rates.sort(key=lambda rate: rate.exec_time_per_sec, reverse=True)
+
+    return rates[:limit]
+
+
+class StatementSampler(object):
+    """
+    Keeps the previous sample around so rates can be reported interval by
+    interval:
+
+        >>> sampler = StatementSampler(pg)
+        >>> sampler.sample()
+        >>> time.sleep(10)
+        >>> sampler.sample()
+        [Record(queryid=..., calls_per_sec=412.5, ...), ...]
+    """
+
+    def __init__(self, pg, limit=None):
+        self.pg = pg
+        self.limit = limit
+        self.previous = None
+
+    def sample(self):
+        """
+        Take a sample and return the rates since the previous one.
+
+        :returns: list of Records, empty for the first sample, the timeout
+            Record when the sample timed out
+        """
+
+        current = take_sample(self.pg)
+
+        if current.error is not None:
+            # The next sample has nothing to be compared with either
+            self.previous = None
+
+            return [current.error]
+
+        previous, self.previous = self.previous, current
+
+        if previous is None:
+            return []
+
+        return compute_rates(previous, current, self.limit)
+
+    def run(self, interval, samples=2):
+        """
+        Sample every interval seconds, yielding the rates of each interval.
+        Sampling stops at the first sample that times out, after yielding
+        its timeout Record.
+
+        :param interval: seconds between samples
+        :param samples: number of samples to take, at least two
+        :returns: generator of lists of Records
+        """
+
+        rates = self.sample()
+
+        if self.previous is None:
+            yield rates
+            return
+
+        for _ in range(samples - 1):
+            time.sleep(interval)
+            rates = self.sample()
+
+            yield rates
+
+            if self.previous is None:
+                return
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+"""
+A top-like view of reports, refreshed in place every interval:
+
+    >>> with PgExtras(dsn=dsn, prepare=True) as pg:
+    ...     Watch(pg, ['ps', 'locks', 'blocking'], interval=0.5).run()
+
+One connection stays open and the reports run as prepared statements, so a
+tick costs little more than executing them. Only the lines of the terminal
+that changed are rewritten. Rows that are new since the last tick are shown
+in green, values that changed (a running_for that keeps growing) in bold
+yellow.
+"""
+
+import datetime
+import shutil
+import sys
+import time
+
+import psycopg2
+
+from .base import is_error
+from .rows import row_keys
+
+NEW = '\x1b[32m'
+CHANGED = '\x1b[1;33m'
+ERROR = '\x1b[31m'
+RESET = '\x1b[0m'
+
+
+def cell(value):
+    """
+    :returns: str, the value on a single line
+    """
+
+    if value is None:
+        return ''
+
+    return ' '.join(str(value).split())
+
+
+def fit(segments, width):
+    """
+    Cut a line of (text, style) segments to width characters.
+
+    :returns: str, with the styles as escape sequences
+    """
+
+    line = []
+
+    for text, style in segments:
+        if width <= 0:
+            break
+
+        text = text[:width]
+        width -= len(text)
+        line.append(style + text + RESET if style else text)
+
+    return ''.join(line)
+
+
+class Watch(object):
+    """
+    :param pg: PgExtras, best with prepare=True
+    :param reports: names of the report methods to show
+    :param interval: seconds from the start of one tick to the next
+    :param file: terminal to draw on, stdout by default
+    """
+
+    def __init__(self, pg, reports, interval=1.0, file=None):
+        self.pg = pg
+        self.reports = list(reports)
+        self.interval = interval
+        self.file = file if file is not None else sys.stdout
+        self.previous = {}
+        self.screen = []
+
+    def sample(self):
+        """
+        Run every report once.
+
+        :returns: dict of report to list of Records, or the error
+        """
+
+        results = {}
+
+        for report in self.reports:
+            try:
+                results[report] = getattr(self.pg, report)()
+            except psycopg2.Error as error:
+                results[report] = error
+
+                if isinstance(error, (psycopg2.OperationalError,
+                                      psycopg2.InterfaceError)):
+                    # The connection is most likely gone, a new one is
+                    # opened on the next tick
+                    self.pg.close_db_connection()
+
+        return results
+
+    def render(self, results, elapsed, size):
+        """
+        :param results: from sample()
+        :param elapsed: seconds sample() took
+        :param size: os.terminal_size to fit the lines in
+        :returns: list of lines, highlighting what changed since the
+            results rendered before
+        """
+
+        lines = [fit([(
+            'pgextras  {}  every {}s  sampled in {:.0f}ms'.format(
+                datetime.datetime.now().strftime('%H:%M:%S'),
+                self.interval,
+                elapsed * 1000
+            ),
+            ''
+        )], size.columns)]
+
+        for report in self.reports:
+            records = results[report]
+            lines.append('')
+            lines.append(fit([(report, '\x1b[1m')], size.columns))
+
+            if isinstance(records, Exception):
+                lines.append(fit(
+                    [(cell(records), ERROR)], size.columns
+                ))
+                continue
+
+            if is_error(records):
+                lines.extend(
+                    fit([(cell(record.error), ERROR)], size.columns)
+                    for record in records
+                )
+                continue
+
+            lines.extend(self._render_records(report, records, size.columns))
+
+        return lines[:size.lines]
+
+    def _render_records(self, report, records, columns):
+        previous = self.previous.get(report)
+        keys = row_keys(report, records)
+        self.previous[report] = dict(zip(keys, records))
+
+        if not records:
+            return ['No records']
+
+        fields = records[0]._fields
+        cells = [[cell(value) for value in record] for record in records]
+        widths = [
+            max([len(field)] + [len(row[position]) for row in cells])
+            for position, field in enumerate(fields)
+        ]
+        lines = [fit([(
+            '  '.join(
+                field.ljust(width) for field, width in zip(fields, widths)
+            ),
+            '\x1b[4m'
+        )], columns)]
+
+        for key, record, row in zip(keys, records, cells):
+            # Nothing is new on the first tick
+            new = previous is not None and key not in previous
+            before = previous.get(key) if previous else None
+            segments = []
+
+            for position, (value, text, width) in enumerate(
+                zip(record, row, widths)
+            ):
+                if position:
+                    segments.append(('  ', ''))
+
+                if new:
+                    style = NEW
+                elif before is not None and before[position] != value:
+                    style = CHANGED
+                else:
+                    style = ''
+
+                segments.append((text.ljust(width), style))
+
+            lines.append(fit(segments, columns))
+
+        return lines
+
+    def draw(self, lines):
+        """
+        Rewrite the lines that differ from what is on the screen.
+        """
+
+        output = []
+
+        for number, line in enumerate(lines):
+            if number >= len(self.screen) or self.screen[number] != line:
+                output.append('\x1b[{};1H{}\x1b[K'.format(number + 1, line))
+
+        if len(lines) < len(self.screen):
+            output.append('\x1b[{};1H\x1b[J'.format(len(lines) + 1))
+
+        self.screen = lines
+        self.file.write(''.join(output))
+        self.file.flush()
+
+    def tick(self):
+        started = time.time()
+        results = self.sample()
+        elapsed = time.time() - started
+        self.draw(self.render(
+            results, elapsed, shutil.get_terminal_size()
+        ))
+
+    def run(self, ticks=None):
+        """
+        Draw every interval until interrupted, or for ticks ticks.
+        """
+
+        # The alternate screen, without a cursor, like top
+        self.file.write('\x1b[?1049h\x1b[?25l\x1b[H\x1b[2J')
+        count = 0
+
+        try:
+            while ticks is None or count < ticks:
+                started = time.time()
+                self.tick()
+                count += 1
+
+                if ticks is None or count < ticks:
+                    time.sleep(
+                        max(self.interval - (time.time() - started), 0)
+                    )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.file.write('\x1b[?25h\x1b[?1049l')
+            self.file.flush()
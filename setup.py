@@ -36,6 +36,11 @@ setup(
         'prettytable',
         'psycopg2',
     ],
+    extras_require={
+        'async': ['aiopg'],
+        'arrow': ['pyarrow'],
+        'columnar': ['numpy'],
+    },
     license="BSD",
     zip_safe=False,
     keywords='pgextras',
@@ -44,11 +49,16 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
-        "Programming Language :: Python :: 2",
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
     ],
+    python_requires='>=3.7',
     test_suite='tests',
     scripts=['scripts/pgextras'],
 )
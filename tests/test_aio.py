@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+try:
+    from pgextras.aio import AsyncPgExtras
+except ImportError:
+    AsyncPgExtras = None
+
+from pgextras.profile import clear_profiles
+
+
+@unittest.skipIf(AsyncPgExtras is None, 'aiopg is not installed')
+class TestAsyncPgextras(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+        clear_profiles()
+
+    def run_reports(self, *reports):
+        async def run():
+            async with AsyncPgExtras(dsn=self.dsn, pool_size=2) as pg:
+                return await pg.run(reports)
+
+        return asyncio.run(run())
+
+    def test_reports_match_the_blocking_client(self):
+        results = self.run_reports('version', 'index_size', 'seq_scans')
+
+        self.assertEqual(len(results['version']), 1)
+        self.assertEqual(len(results['index_size']), 3)
+        self.assertTrue(len(results['seq_scans']), 4)
+
+    def test_missing_pg_stat_statement_returns_error_record(self):
+        async def run():
+            async with AsyncPgExtras(dsn=self.dsn) as pg:
+                if pg.pg_stat_statement():
+                    return None
+
+                return await pg.calls()
+
+        results = asyncio.run(run())
+
+        if results is not None:
+            self.assertIsNotNone(results[0].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+
+from pgextras import PgExtras
+from pgextras.cache import (
+    MemoryBackend, ResultCache, SQLiteBackend, dump_records, load_records
+)
+
+Record = namedtuple('Record', 'name size')
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_survive_a_round_trip(self):
+        records = [Record('a', 1), Record('b', 2)]
+
+        self.assertEqual(load_records(dump_records(records)), records)
+        self.assertEqual(load_records(dump_records([])), [])
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryBackend(max_entries=2)
+        backend.set('a', 0, [Record('a', 1)])
+        backend.set('b', 0, [Record('b', 1)])
+        backend.get('a')
+        backend.set('c', 0, [Record('c', 1)])
+
+        self.assertIsNotNone(backend.get('a'))
+        self.assertIsNone(backend.get('b'))
+        self.assertIsNotNone(backend.get('c'))
+
+    def test_memory_backend_is_bounded_by_size(self):
+        records = [Record('x' * 1000, 1)]
+        backend = MemoryBackend(max_bytes=len(dump_records(records)) * 2)
+
+        for key in 'abc':
+            backend.set(key, 0, records)
+
+        self.assertIsNone(backend.get('a'))
+        self.assertLessEqual(backend.size, backend.max_bytes)
+
+    def test_memory_backend_hits_can_not_be_changed_by_callers(self):
+        records = [Record('a', 1)]
+        backend = MemoryBackend()
+        backend.set('a', 0, records)
+        records.append(Record('b', 2))
+        backend.get('a').records.append(Record('c', 3))
+
+        self.assertEqual(backend.get('a').records, [Record('a', 1)])
+
+    def test_sqlite_backend_is_shared_and_bounded(self):
+        SQLiteBackend(self.path, max_entries=2).set('a', 10, [Record('a', 1)])
+        backend = SQLiteBackend(self.path, max_entries=2)
+
+        self.assertEqual(backend.get('a').records, [Record('a', 1)])
+
+        backend.set('b', 10, [Record('b', 1)])
+        backend.set('c', 10, [Record('c', 1)])
+
+        self.assertIsNone(backend.get('a'))
+
+    def test_only_one_caller_refreshes(self):
+        runs = []
+
+        def run():
+            runs.append(1)
+            time.sleep(0.2)
+            return [Record('a', len(runs))]
+
+        cache = ResultCache(backend=SQLiteBackend(self.path))
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    cache.get_or_run('key', 'bloat', run)
+                )
+            )
+            for _ in range(4)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(results, [[Record('a', 1)]] * 4)
+
+    def test_stale_entries_are_served_while_refreshing(self):
+        cache = ResultCache()
+        cache.backend.set('key', 0, [Record('stale', 1)])
+        cache.backend.acquire('key', 60)
+
+        self.assertEqual(
+            cache.get_or_run('key', 'bloat', lambda: [Record('new', 1)]),
+            [Record('stale', 1)]
+        )
+
+    def test_reports_without_ttl_and_errors_are_not_cached(self):
+        Error = namedtuple('Record', 'error')
+        cache = ResultCache(ttls={'bloat': None})
+
+        cache.get_or_run('ps', 'ps', lambda: [Record('a', 1)])
+        cache.get_or_run('bloat', 'bloat', lambda: [Record('a', 1)])
+        cache.get_or_run('version', 'version', lambda: [Error('timeout')])
+
+        self.assertEqual(cache.backend.size, 0)
+
+    def test_pgextras_reuses_results(self):
+        cache = ResultCache(ttls={'seq_scans': 60})
+
+        with PgExtras(dsn=self.dsn, cache=cache) as pg:
+            first = pg.seq_scans()
+
+            with PgExtras(dsn=self.dsn, cache=cache) as other:
+                other.execute = None
+
+                self.assertEqual(other.seq_scans(), first)
+                self.assertEqual(len(pg.seq_scans(limit=1)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pgextras import PgExtras
+from pgextras.export import load_pyarrow
+from pgextras.fleet import export_fleet, export_path
+
+pyarrow = load_pyarrow()
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+        self.pgextras = PgExtras(dsn=self.dsn)
+
+    def tearDown(self):
+        self.pgextras.close_db_connection()
+
+    def test_csv_has_a_header_and_every_row(self):
+        export_file = io.BytesIO()
+        rows = self.pgextras.export('vacuum_stats', export_file, raw=True)
+        lines = list(csv.reader(
+            io.StringIO(export_file.getvalue().decode('utf-8'))
+        ))
+
+        self.assertEqual(rows, len(self.pgextras.vacuum_stats()))
+        self.assertEqual(len(lines), rows + 1)
+        self.assertEqual(lines[0][:2], ['schema', 'table'])
+
+    def test_ndjson_has_an_object_per_line(self):
+        export_file = io.BytesIO()
+        rows = self.pgextras.export(
+            'table_size', export_file, 'ndjson', params={'limit': 2}
+        )
+        lines = export_file.getvalue().decode('utf-8').splitlines()
+
+        self.assertEqual(len(lines), rows)
+        self.assertLessEqual(rows, 2)
+
+        for line in lines:
+            self.assertIn('name', json.loads(line))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            self.pgextras.export('version', io.BytesIO(), 'xml')
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_is_typed_by_the_columns(self):
+        import pyarrow.parquet
+
+        export_file = io.BytesIO()
+        rows = self.pgextras.export(
+            'vacuum_stats', export_file, 'parquet', raw=True
+        )
+        export_file.seek(0)
+        table = pyarrow.parquet.read_table(export_file)
+
+        self.assertEqual(table.num_rows, rows)
+        self.assertEqual(table.schema.field('dead_rowcount').type,
+                         pyarrow.int64())
+
+    def test_fleet_writes_a_file_per_host_and_report(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        hosts = list(export_fleet([self.dsn], ['version'], directory))
+        path = export_path(directory, self.dsn, 'version', 'csv')
+
+        self.assertIsNone(hosts[0].error)
+        self.assertEqual(hosts[0].results, {'version': 1})
+        self.assertEqual(
+            os.path.basename(path), 'python_pgextras_unittest_version.csv'
+        )
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import time
+import unittest
+
+import psycopg2
+from mock import patch
+
+from pgextras import PgExtras
+from pgextras.exporter import Exporter, Sample, render_metrics, target_label
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+
+    def test_render_metrics(self):
+        text = render_metrics([
+            Sample('pgextras_table_seq_scans', [('table', 'a"b')], 3),
+            Sample('pgextras_exclusive_lock_max_age_seconds', [],
+                   datetime.timedelta(seconds=1.5)),
+            Sample('pgextras_table_last_vacuum_timestamp_seconds',
+                   [('table', 'a')], None),
+        ])
+
+        self.assertIn('# TYPE pgextras_table_seq_scans counter\n', text)
+        self.assertIn(
+            'pgextras_table_seq_scans_total{table="a\\"b"} 3\n', text
+        )
+        self.assertIn('pgextras_exclusive_lock_max_age_seconds 1.5\n', text)
+        self.assertNotIn('last_vacuum_timestamp_seconds{', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_password_is_not_a_label(self):
+        self.assertEqual(
+            target_label(self.dsn + ' password=secret'), self.dsn
+        )
+
+    def test_scrape(self):
+        exporter = Exporter([self.dsn])
+
+        try:
+            text = exporter.scrape()
+        finally:
+            exporter.close()
+
+        self.assertIn(
+            'pgextras_collector_up{{target="{}",collector="cache_hit"}} 1'
+            .format(self.dsn),
+            text
+        )
+        self.assertIn('pgextras_cache_hit_ratio{', text)
+        self.assertIn('pgextras_table_live_rows{', text)
+
+    def test_same_named_tables_are_told_apart_by_schema(self):
+        conn = psycopg2.connect(self.dsn)
+        self.addCleanup(conn.close)
+
+        with conn:
+            conn.cursor().execute(
+                'CREATE SCHEMA IF NOT EXISTS s2;'
+                'CREATE TABLE IF NOT EXISTS s2.pgbench_tellers '
+                '(LIKE public.pgbench_tellers)'
+            )
+
+        exporter = Exporter([self.dsn], collectors=['seq_scans'])
+
+        try:
+            series = [
+                line.rsplit(' ', 1)[0]
+                for line in exporter.scrape().splitlines()
+                if line.startswith('pgextras_table_seq_scans_total{')
+            ]
+        finally:
+            exporter.close()
+
+        self.assertEqual(len(series), len(set(series)))
+        self.assertIn(
+            'pgextras_table_seq_scans_total{{target="{}",schema="s2",'
+            'table="pgbench_tellers"}}'.format(self.dsn),
+            series
+        )
+
+    @patch.object(PgExtras, 'render', return_value='SELECT pg_sleep(1)')
+    def test_a_report_timing_out_marks_its_collector_down(self, render):
+        exporter = Exporter([self.dsn], collectors=['cache_hit'],
+                            statement_timeout='50ms')
+
+        try:
+            text = exporter.scrape()
+        finally:
+            exporter.close()
+
+        self.assertIn(
+            'pgextras_collector_up{{target="{}",collector="cache_hit"}} 0'
+            .format(self.dsn),
+            text
+        )
+        self.assertNotIn('pgextras_cache_hit_ratio{', text)
+
+    def test_slow_collectors_do_not_delay_a_scrape(self):
+        def slow(pg):
+            time.sleep(2)
+            return []
+
+        exporter = Exporter([self.dsn], collectors=['cache_hit'],
+                            scrape_timeout=0.5)
+        exporter.collectors.append(('slow', slow))
+        exporter.ttls['slow'] = 60
+
+        try:
+            started = time.time()
+            text = exporter.scrape()
+            elapsed = time.time() - started
+        finally:
+            exporter.close()
+
+        self.assertLess(elapsed, 1.5)
+        self.assertIn('pgextras_cache_hit_ratio{', text)
+        self.assertNotIn('collector="slow"', text)
+
+    def test_results_are_cached_for_their_ttl(self):
+        exporter = Exporter([self.dsn], collectors=['cache_hit'],
+                            ttls={'cache_hit': 60})
+
+        try:
+            first = exporter.scrape()
+            self.assertEqual(exporter.scrape(), first)
+        finally:
+            exporter.close()
+
+    def test_unknown_collector(self):
+        self.assertRaises(ValueError, Exporter, [self.dsn], ['nope'])
+
+
+if __name__ == '__main__':
+    unittest.main()
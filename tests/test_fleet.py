@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from psycopg2.extensions import parse_dsn
+
+from pgextras.fleet import (
+    on_pool, record_fleet, run_fleet, run_parallel, with_timeout
+)
+from pgextras.history import History
+
+
+class TestFleet(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+
+    def test_every_host_reports_back(self):
+        dsns = [self.dsn, self.dsn, 'dbname=python_pgextras_missing']
+        hosts = list(run_fleet(dsns, ['version'], max_workers=2, timeout=5))
+
+        self.assertEqual(len(hosts), 3)
+        self.assertEqual(len([host for host in hosts if host.error]), 1)
+
+        for host in hosts:
+            if host.error is None:
+                self.assertEqual(len(host.results['version']), 1)
+
+    def test_parallel_reports_each_come_back_once(self):
+        results = dict(run_parallel(
+            self.dsn, ['version', 'table_size', 'lock_graph'], max_workers=3
+        ))
+
+        self.assertEqual(
+            sorted(results), ['lock_graph', 'table_size', 'version']
+        )
+        self.assertEqual(len(results['version']), 1)
+
+    def test_timeout_is_added_to_the_dsn(self):
+        dsn = parse_dsn(
+            with_timeout(self.dsn + ' options=-cwork_mem=4MB', 2.5)
+        )
+
+        self.assertEqual(dsn['connect_timeout'], '3')
+        self.assertEqual(dsn['options'], '-cwork_mem=4MB')
+
+    def test_slow_hosts_are_given_up_on(self):
+        def host(dsn):
+            time.sleep(2 if dsn == 'slow' else 0)
+            return dsn
+
+        started = time.time()
+        hosts = list(on_pool(['slow', 'fast'], 2, host, timeout=0.5))
+
+        self.assertLess(time.time() - started, 1.5)
+        self.assertEqual(hosts[0], 'fast')
+        self.assertEqual(hosts[1].dsn, 'slow')
+        self.assertIsInstance(hosts[1].error, TimeoutError)
+
+    def test_fleet_is_recorded_under_the_original_dsn(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        history = History(os.path.join(directory, 'history.db'))
+
+        hosts = list(record_fleet(
+            [self.dsn], history, ['table_size'], timeout=5
+        ))
+
+        self.assertIsNone(hosts[0].error)
+        self.assertIn('table_size', hosts[0].results)
+        self.assertEqual(history.targets(), [self.dsn])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from collections import namedtuple
+
+from pgextras import PgExtras
+from pgextras.history import History
+
+Size = namedtuple('Record', 'name size')
+SchemaSize = namedtuple('Record', 'schemaname name size')
+Counter = namedtuple(
+    'Record', 'sampled_at userid dbid queryid query calls'
+)
+Timeout = namedtuple('Record', 'report error')
+
+DAY = 86400
+
+
+class FakePgExtras(object):
+    dsn = 'dbname=app password=secret'
+
+    def __init__(self):
+        self.results = {}
+        self.statements = True
+
+    def pg_stat_statement(self):
+        return self.statements
+
+    def run_report(self, report, row_format='record', **options):
+        return self.results.get(report, [])
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'history.db')
+        self.history = History(self.path, resolution=[(DAY, 3600)])
+        self.pg = FakePgExtras()
+        self.now = 10 * DAY
+
+    def record(self, sizes, taken_at):
+        self.pg.results['table_size'] = [Size(*size) for size in sizes]
+
+        return self.history.record(
+            self.pg, ['table_size'], taken_at=taken_at
+        )
+
+    def test_unchanged_rows_are_stored_once(self):
+        self.assertEqual(self.record([('a', 1), ('b', 1)], 0), {
+            'table_size': 2
+        })
+        self.assertEqual(self.record([('a', 1), ('b', 2)], 60), {
+            'table_size': 1
+        })
+        self.assertEqual(self.record([('a', 1), ('b', 2)], 120), {
+            'table_size': 0
+        })
+
+        target = self.history.targets()[0]
+        points = self.history.series(target, 'table_size')
+
+        self.assertEqual(target, 'dbname=app')
+        self.assertEqual(
+            [(point.name, point.size) for point in points],
+            [('a', 1), ('b', 1), ('b', 2)]
+        )
+        self.assertEqual(points[0].last_seen.timestamp(), 120)
+        self.assertEqual(points[1].last_seen.timestamp(), 0)
+        self.assertEqual(
+            [point.size for point in
+             self.history.series(target, 'table_size', name='b')],
+            [1, 2]
+        )
+        self.assertEqual(len(self.history.snapshots(target, 'table_size')), 3)
+
+    def test_same_named_tables_are_told_apart_by_schema(self):
+        for taken_at, sizes in [(0, [10, 20]), (60, [30, 20])]:
+            # Sorted by size, so the two tables swap places
+            self.pg.results['table_size'] = sorted(
+                [SchemaSize('public', 't', sizes[0]),
+                 SchemaSize('s2', 't', sizes[1])],
+                key=lambda record: record.size
+            )
+            self.history.record(self.pg, ['table_size'], taken_at=taken_at)
+
+        self.assertEqual(
+            [point.size for point in self.history.series(
+                'dbname=app', 'table_size', schemaname='public', name='t'
+            )],
+            [10, 30]
+        )
+        self.assertEqual(
+            [point.size for point in self.history.series(
+                'dbname=app', 'table_size', schemaname='s2', name='t'
+            )],
+            [20]
+        )
+
+    def test_a_row_that_was_gone_starts_a_new_point(self):
+        self.record([('a', 1)], 0)
+        self.record([], 60)
+        self.record([('a', 1)], 120)
+
+        points = self.history.series('dbname=app', 'table_size')
+
+        self.assertEqual(len(points), 2)
+
+    def test_old_points_are_downsampled(self):
+        start = self.now - 2 * DAY
+
+        for minute in range(120):
+            self.record([('a', minute)], start + minute * 60)
+
+        self.record([('a', 120)], self.now)
+        self.history.compact(self.now)
+
+        points = self.history.series('dbname=app', 'table_size')
+        snapshots = self.history.snapshots('dbname=app', 'table_size')
+
+        # Two hours of minutes spread over at most three hourly intervals
+        self.assertLessEqual(len(points), 4)
+        self.assertLessEqual(len(snapshots), 4)
+        self.assertEqual(points[-1].size, 120)
+        self.assertEqual(points[-2].size, 119)
+        self.assertEqual(points[0].first_seen.timestamp(), start)
+
+    def test_retention_drops_old_points(self):
+        history = History(self.path, retention=DAY)
+        self.record([('a', 1)], self.now - 2 * DAY)
+        self.record([('b', 1)], self.now)
+        history.compact(self.now)
+
+        points = history.series('dbname=app', 'table_size')
+
+        self.assertEqual([point.name for point in points], ['b'])
+
+    def test_sampled_at_and_failed_reports_are_ignored(self):
+        self.pg.results['statement_counters'] = [
+            Counter(datetime.datetime.now(), 10, 1, 42, 'SELECT 1', 5)
+        ]
+        self.pg.results['table_size'] = [Timeout('table_size', 'timeout')]
+
+        reports = ['statement_counters', 'table_size']
+
+        self.assertEqual(self.history.record(self.pg, reports, 0), {
+            'statement_counters': 1
+        })
+        self.assertEqual(self.history.record(self.pg, reports, 60), {
+            'statement_counters': 0
+        })
+
+        self.pg.statements = False
+
+        self.assertEqual(self.history.record(self.pg, reports, 120), {})
+
+    def test_the_query_is_stored_once_per_statement(self):
+        query = 'SELECT * FROM pgbench_accounts WHERE aid = $1'
+
+        for taken_at, calls in [(0, 5), (60, 7), (120, 9)]:
+            self.pg.results['statement_counters'] = [
+                Counter(None, 10, 1, 42, query, calls)
+            ]
+            self.history.record(self.pg, ['statement_counters'], taken_at)
+
+        db = sqlite3.connect(self.path)
+        self.addCleanup(db.close)
+        values = [row[0] for row in db.execute('SELECT value FROM points')]
+
+        self.assertEqual(sorted(values), ['[5]', '[7]', '[9]'])
+        self.assertEqual(
+            [(point.query, point.calls) for point in
+             self.history.series('dbname=app', 'statement_counters')],
+            [(query, 5), (query, 7), (query, 9)]
+        )
+
+    def test_records_the_default_reports(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            changed = self.history.record(pg)
+
+        self.assertIn('vacuum_stats', changed)
+        self.assertTrue(self.history.series(self.dsn, 'table_size'))
+
+
+if __name__ == '__main__':
+    unittest.main()
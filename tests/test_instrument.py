@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pgextras.instrument import Execution, Timings, result_size
+
+
+def execution(report, wall_time, rows=1, server_time=None, error=None):
+    return Execution(report, 'SELECT 1', None, wall_time, 0.5, server_time,
+                     rows, 10, error)
+
+
+class TestTimings(unittest.TestCase):
+    def test_summary_is_per_report_most_expensive_first(self):
+        timings = Timings()
+        timings.after_execute(execution('ps', 2.0))
+        timings.after_execute(execution('bloat', 30.0, rows=5))
+        timings.after_execute(execution('bloat', 10.0, rows=5))
+        timings.after_execute(execution('ps', 1.0, error=Exception()))
+
+        bloat, ps = timings.summary()
+
+        self.assertEqual(bloat.report, 'bloat')
+        self.assertEqual(bloat.calls, 2)
+        self.assertEqual(bloat.total_time, 40.0)
+        self.assertEqual(bloat.mean_time, 20.0)
+        self.assertEqual(bloat.max_time, 30.0)
+        self.assertEqual(bloat.rows, 10)
+        self.assertEqual(bloat.decode_time, 1.0)
+        self.assertIsNone(bloat.server_time)
+        self.assertEqual(ps.errors, 1)
+
+    def test_server_time_is_summed_when_measured(self):
+        timings = Timings()
+        timings.after_execute(execution('ps', 2.0, server_time=1.5))
+        timings.after_execute(execution('ps', 2.0, server_time=0.5))
+
+        self.assertEqual(timings.summary()[0].server_time, 2.0)
+
+    def test_reset(self):
+        timings = Timings()
+        timings.after_execute(execution('ps', 2.0))
+        timings.reset()
+
+        self.assertEqual(timings.summary(), [])
+
+    def test_result_size(self):
+        self.assertEqual(result_size([('abc', 12, None), ('d', 3, 4)]), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from collections import namedtuple
+
+from pgextras.lockgraph import build_lock_graph, strongly_connected
+
+Wait = namedtuple('Record', 'pid blocked_by duration query')
+
+
+class TestLockGraph(unittest.TestCase):
+    def graph(self, *waits):
+        rows = [Wait(pid, blocked_by, None, None) for pid, blocked_by in waits]
+
+        return dict((node.pid, node) for node in build_lock_graph(rows))
+
+    def test_chain_leads_to_the_root_blocker(self):
+        nodes = self.graph((1, []), (2, [1]), (3, [1]), (4, [2]))
+
+        self.assertEqual(nodes[1].depth, 0)
+        self.assertEqual(nodes[4].depth, 2)
+        self.assertEqual(nodes[4].root_blockers, [1])
+        self.assertEqual(nodes[1].fan_out, 2)
+        self.assertEqual(nodes[1].blocked_total, 3)
+        self.assertEqual(nodes[2].blocked_total, 1)
+        self.assertIsNone(nodes[1].cycle)
+
+    def test_blockers_without_a_row_are_roots(self):
+        nodes = self.graph((2, [0]), (3, [2]))
+
+        self.assertEqual(nodes[0].blocked_by, [])
+        self.assertEqual(nodes[3].root_blockers, [0])
+        self.assertIsNone(nodes[0].query)
+
+    def test_cycles_are_found(self):
+        nodes = self.graph((1, [2]), (2, [1]), (3, [1]))
+
+        self.assertEqual(nodes[1].cycle, [1, 2])
+        self.assertEqual(nodes[2].cycle, [1, 2])
+        self.assertIsNone(nodes[3].cycle)
+        self.assertEqual(nodes[3].root_blockers, [1, 2])
+        self.assertEqual(nodes[1].blocked_total, 2)
+
+    def test_roots_come_first(self):
+        rows = [
+            Wait(5, [1], None, None),
+            Wait(1, [], None, None),
+            Wait(2, [], None, None),
+            Wait(3, [2], None, None),
+            Wait(4, [2], None, None),
+        ]
+
+        pids = [node.pid for node in build_lock_graph(rows)]
+
+        self.assertEqual(pids, [2, 1, 3, 4, 5])
+
+    def test_long_chains_do_not_recurse(self):
+        edges = dict((pid, [pid - 1]) for pid in range(1, 20000))
+        edges[0] = []
+
+        components = strongly_connected(sorted(edges), edges)
+
+        self.assertEqual(len(components), 20000)
+        self.assertEqual(components[0], [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import csv
+import datetime
+import decimal
+import io
+import json
+import unittest
+from collections import namedtuple
+
+from pgextras.output import get_writer
+from pgextras.rows import RecordStream
+
+Record = namedtuple('Record', 'name size vacuumed')
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            Record('accounts', decimal.Decimal('1.5'),
+                   datetime.datetime(2014, 5, 6, 10, 1, 22)),
+            Record('branches', 2, None),
+        ]
+
+    def write(self, format, host=None):
+        output = io.StringIO()
+        writer = get_writer(format, output)
+        writer.write('table_size', iter(self.records), host=host)
+        writer.write('version', [])
+        writer.close()
+
+        return output.getvalue()
+
+    def test_json_is_one_document(self):
+        reports = json.loads(self.write('json', host='dbname=db'))
+
+        self.assertEqual([report['report'] for report in reports],
+                         ['table_size', 'version'])
+        self.assertEqual(reports[0]['host'], 'dbname=db')
+        self.assertEqual(reports[0]['records'][0], {
+            'name': 'accounts',
+            'size': 1.5,
+            'vacuumed': '2014-05-06T10:01:22',
+        })
+        self.assertEqual(reports[1]['records'], [])
+
+    def test_json_without_reports(self):
+        output = io.StringIO()
+        get_writer('json', output).close()
+
+        self.assertEqual(json.loads(output.getvalue()), [])
+
+    def test_ndjson_has_a_line_per_record(self):
+        lines = self.write('ndjson').splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[1]), {
+            'report': 'table_size',
+            'record': {'name': 'branches', 'size': 2, 'vacuumed': None},
+        })
+        self.assertEqual(
+            json.loads(lines[2]), {'report': 'version', 'record': None}
+        )
+
+    def test_csv_starts_with_the_header(self):
+        rows = list(csv.reader(io.StringIO(self.write('csv', host='db'))))
+
+        self.assertEqual(rows[0], ['table_size'])
+        self.assertEqual(rows[1], ['host', 'name', 'size', 'vacuumed'])
+        self.assertEqual(rows[3], ['db', 'branches', '2', ''])
+        # version has no rows and no known columns, only its name
+        self.assertEqual(rows[4:], [[], ['version']])
+
+    def test_csv_header_without_rows(self):
+        stream = RecordStream()
+        stream.columns = ['name', 'size']
+        output = io.StringIO()
+        writer = get_writer('csv', output)
+        writer.write('table_size', stream)
+        writer.close()
+
+        self.assertEqual(output.getvalue(), 'table_size\nname,size\n')
+
+    def test_csv_error_records_have_a_block_of_their_own(self):
+        Timeout = namedtuple('Record', 'error report setting value')
+        self.records.append(
+            Timeout('canceling statement', 'table_size', 'lock_timeout', '1s')
+        )
+        rows = list(csv.reader(io.StringIO(self.write('csv'))))
+
+        self.assertEqual(rows[4:6], [[], ['table_size']])
+        self.assertEqual(rows[6], ['error', 'report', 'setting', 'value'])
+        self.assertEqual(rows[7][0], 'canceling statement')
+
+    def test_table(self):
+        output = self.write('table')
+
+        self.assertIn('accounts', output)
+        self.assertIn('No records', output)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            get_writer('xml')
+
+
+if __name__ == '__main__':
+    unittest.main()
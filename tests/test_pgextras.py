@@ -6,8 +6,13 @@ import unittest
 from mock import patch
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 
-from pgextras import PgExtras, sql_constants as sql
+from pgextras import (
+    Hook, PgExtras, ServerProfile, Timings, sql_constants as sql
+)
+from pgextras.profile import clear_profiles
+from pgextras.statements import StatementSampler
 
 
 class TestPgextras(unittest.TestCase):
@@ -19,6 +24,7 @@ class TestPgextras(unittest.TestCase):
             cursor_factory=psycopg2.extras.NamedTupleCursor
         )
         self.cursor = self.conn.cursor()
+        clear_profiles()
 
     def drop_pg_stat_statement(self):
         if self.is_pg_stat_statement_installed():
@@ -32,6 +38,15 @@ class TestPgextras(unittest.TestCase):
             self.cursor.execute(statement)
             self.conn.commit()
 
+    def create_same_named_table(self):
+        # pgbench_tellers once more, in another schema
+        self.cursor.execute(
+            'CREATE SCHEMA IF NOT EXISTS s2;'
+            'CREATE TABLE IF NOT EXISTS s2.pgbench_tellers '
+            '(LIKE public.pgbench_tellers)'
+        )
+        self.conn.commit()
+
     def is_pg_stat_statement_installed(self):
         self.cursor.execute(sql.PG_STAT_STATEMENT)
         results = self.cursor.fetchall()
@@ -121,7 +136,7 @@ class TestPgextras(unittest.TestCase):
         async_conn = psycopg2.connect(
             database=self.dbname,
             cursor_factory=psycopg2.extras.NamedTupleCursor,
-            async=1
+            async_=1
         )
 
         psycopg2.extras.wait_select(async_conn)
@@ -133,6 +148,167 @@ class TestPgextras(unittest.TestCase):
 
         self.assertEqual(len(results), 1)
 
+    def test_lock_graph(self):
+        statement = "SELECT pg_advisory_lock(4242)"
+
+        blocking_conn = psycopg2.connect(database=self.dbname)
+        blocking_conn.cursor().execute(statement)
+
+        async_conn = psycopg2.connect(database=self.dbname, async_=1)
+        psycopg2.extras.wait_select(async_conn)
+        async_conn.cursor().execute(statement)
+
+        try:
+            with PgExtras(dsn=self.dsn) as pg:
+                nodes = dict((node.pid, node) for node in pg.lock_graph())
+
+            root = nodes[blocking_conn.get_backend_pid()]
+            waiter = nodes[async_conn.get_backend_pid()]
+
+            self.assertEqual(waiter.blocked_by, [root.pid])
+            self.assertEqual(waiter.root_blockers, [root.pid])
+            self.assertEqual(waiter.depth, 1)
+            self.assertEqual(root.fan_out, 1)
+        finally:
+            async_conn.close()
+            blocking_conn.close()
+
+    def test_lock_timeout_returns_a_timeout_record(self):
+        self.cursor.execute(
+            'LOCK TABLE pgbench_branches IN ACCESS EXCLUSIVE MODE'
+        )
+
+        try:
+            with PgExtras(
+                dsn=self.dsn,
+                lock_timeout='100ms',
+                timeouts={'version': {'lock_timeout': None}}
+            ) as pg:
+                results = pg.table_size()
+
+                self.assertEqual(len(results), 1)
+                self.assertEqual(results[0].report, 'table_size')
+                self.assertEqual(results[0].setting, 'lock_timeout')
+                self.assertEqual(results[0].value, '100ms')
+                self.assertEqual(pg.timeout_settings('version'), [])
+                self.assertEqual(len(pg.version()), 1)
+
+                with pg.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute('SHOW lock_timeout')
+
+                    self.assertEqual(cursor.fetchone()[0], '0')
+        finally:
+            self.conn.rollback()
+
+    @patch.object(PgExtras, 'render', return_value='SELECT pg_sleep(1)')
+    def test_lock_graph_passes_the_timeout_record_through(self, render):
+        with PgExtras(dsn=self.dsn, statement_timeout='50ms') as pg:
+            results = pg.lock_graph()
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].report, 'lock_graph')
+        self.assertEqual(results[0].setting, 'statement_timeout')
+
+    @patch.object(PgExtras, 'render', return_value='SELECT pg_sleep(1)')
+    def test_statement_sampling_stops_at_a_timeout(self, render):
+        with PgExtras(dsn=self.dsn, statement_timeout='50ms') as pg:
+            results = list(StatementSampler(pg).run(0, samples=3))
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0].report, 'statement_counters')
+        self.assertEqual(results[0][0].setting, 'statement_timeout')
+
+    def test_iter_report_ends_with_the_timeout_record(self):
+        self.cursor.execute(
+            'LOCK TABLE pgbench_branches IN ACCESS EXCLUSIVE MODE'
+        )
+
+        try:
+            with PgExtras(dsn=self.dsn, lock_timeout='100ms') as pg:
+                records = list(pg.iter_report('table_size'))
+
+                self.assertEqual(records[-1].setting, 'lock_timeout')
+                self.assertEqual(len(pg.version()), 1)
+        finally:
+            self.conn.rollback()
+
+    def test_sessions_are_read_only_and_never_idle_in_transaction(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            pg.bloat()
+            list(pg.iter_report('seq_scans', itersize=1))
+
+            with pg.connection() as conn:
+                self.assertEqual(
+                    conn.get_transaction_status(),
+                    psycopg2.extensions.TRANSACTION_STATUS_IDLE
+                )
+                self.assertRaises(
+                    psycopg2.InternalError,
+                    conn.cursor().execute,
+                    'UPDATE pgbench_branches SET bid = bid WHERE false'
+                )
+
+        with PgExtras(dsn=self.dsn, autocommit=False, readonly=False) as pg:
+            pg.version()
+
+            with pg.connection() as conn:
+                self.assertEqual(
+                    conn.get_transaction_status(),
+                    psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+                )
+
+    def test_hooks_see_every_report(self):
+        class Recorder(Hook):
+            def __init__(self):
+                self.statements = []
+                self.executions = []
+
+            def before_execute(self, statement):
+                self.statements.append(statement)
+
+            def after_execute(self, execution):
+                self.executions.append(execution)
+
+        recorder = Recorder()
+        timings = Timings()
+
+        with PgExtras(dsn=self.dsn, hooks=[recorder, timings],
+                      explain=True) as pg:
+            records = pg.seq_scans(limit=2)
+
+        self.assertEqual(recorder.statements[0].report, 'seq_scans')
+        self.assertEqual(
+            recorder.statements[0].statement, pg.render('seq_scans')
+        )
+
+        execution = recorder.executions[0]
+        self.assertEqual(execution.rows, len(records))
+        self.assertGreater(execution.bytes, 0)
+        self.assertGreaterEqual(execution.wall_time, execution.decode_time)
+        self.assertGreater(execution.server_time, 0)
+        self.assertIsNone(execution.error)
+        self.assertEqual(timings.summary()[0].report, 'seq_scans')
+
+    def test_row_formats(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            records = pg.vacuum_stats(raw=True)
+
+        with PgExtras(dsn=self.dsn, row_format='tuple') as pg:
+            rows = pg.vacuum_stats(raw=True)
+            self.assertEqual(rows.columns, list(records[0]._fields))
+            self.assertEqual(rows.records(), records)
+            self.assertEqual(pg.lock_graph(), [])
+
+        with PgExtras(dsn=self.dsn, row_format='columnar') as pg:
+            columns = pg.vacuum_stats(raw=True)
+            self.assertEqual(columns.length, len(records))
+            self.assertEqual(
+                list(columns['table']), [record.table for record in records]
+            )
+
+        self.assertRaises(ValueError, PgExtras, self.dsn, row_format='dict')
+
     def test_ps(self):
         """
         If the test suite is ran back to back within one second of each other
@@ -150,7 +326,7 @@ class TestPgextras(unittest.TestCase):
         async_conn = psycopg2.connect(
             database=self.dbname,
             cursor_factory=psycopg2.extras.NamedTupleCursor,
-            async=1
+            async_=1
         )
 
         psycopg2.extras.wait_select(async_conn)
@@ -180,19 +356,217 @@ class TestPgextras(unittest.TestCase):
             mockery.return_value = True
             self.assertEqual(pg.query_column,  'query')
 
-    @patch.object(PgExtras, 'version')
-    def test_parsing_postgres_version_number(self, mockery):
-        Record = type('Record', (object, ), {
-            'version': 'PostgreSQL 9.3.3 on x86_64-apple-darwin13.0.0'
-        })
-        mockery.return_value = [Record]
-
+    def test_server_version_comes_from_the_profile(self):
         with PgExtras(dsn=self.dsn) as pg:
+            pg._profile = ServerProfile(90303, {})
             self.assertTrue(pg.is_pg_at_least_nine_two())
-            Record.version = 'PostgreSQL 9.1.1 on x86_64-apple-darwin13.0.0'
-            pg._is_pg_at_least_nine_two = None
+            self.assertFalse(pg.is_pg_at_least_thirteen())
+            self.assertEqual(pg.total_time_column, 'total_time')
+
+            pg._profile = ServerProfile(90101, {})
             self.assertFalse(pg.is_pg_at_least_nine_two())
 
+    def test_profile_is_shared_between_instances(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            profile = pg.profile
+
+        with PgExtras(dsn=self.dsn) as pg:
+            with patch('pgextras.ServerProfile') as mockery:
+                self.assertIs(pg.profile, profile)
+                self.assertEqual(pg.pid_column, 'pid')
+                self.assertFalse(mockery.called)
+
+    def test_snapshot_shares_one_timestamp(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            snapshot = pg.snapshot(['locks', 'blocking', 'ps', 'seq_scans'])
+
+            self.assertIsNotNone(snapshot.taken_at)
+            self.assertEqual(
+                sorted(snapshot.results),
+                ['blocking', 'locks', 'ps', 'seq_scans']
+            )
+            self.assertEqual(
+                len(snapshot.results['seq_scans']), len(pg.seq_scans())
+            )
+
+    def test_snapshot_rejects_unknown_reports(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            self.assertRaises(ValueError, pg.snapshot, ['not_a_report'])
+
+    def test_external_connection_is_left_open(self):
+        with PgExtras(connection=self.conn) as pg:
+            self.assertEqual(len(pg.version()), 1)
+
+        self.assertFalse(self.conn.closed)
+
+    def test_pool_connections_are_borrowed_per_report(self):
+        pool = psycopg2.pool.ThreadedConnectionPool(1, 1, self.dsn)
+
+        try:
+            first = PgExtras(pool=pool)
+            second = PgExtras(pool=pool)
+
+            self.assertEqual(len(first.version()), 1)
+            self.assertEqual(len(second.version()), 1)
+            self.assertEqual(len(first.snapshot(['version']).results), 1)
+        finally:
+            pool.closeall()
+
+    def test_prepared_reports_are_reused(self):
+        with PgExtras(dsn=self.dsn, prepare=True) as pg:
+            first = pg.seq_scans()
+            second = pg.seq_scans()
+
+            self.assertEqual(len(first), len(second))
+
+            with pg.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT name FROM pg_prepared_statements')
+                    names = [row[0] for row in cursor.fetchall()]
+
+            self.assertEqual(len(names), 1)
+            self.assertTrue(names[0].startswith('pgextras_seq_scans_'))
+
+    def test_prepared_reports_survive_a_server_reset(self):
+        with PgExtras(dsn=self.dsn, prepare=True) as pg:
+            first = pg.seq_scans()
+
+            with pg.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+
+            self.assertEqual(len(pg.seq_scans()), len(first))
+
+    def test_render_is_cached(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            self.assertIs(pg.render('ps'), pg.render('ps'))
+            self.assertNotIn('\n', pg.render('bloat'))
+
+    def test_iter_report_knows_its_columns_without_rows(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            records = pg.iter_report(
+                'seq_scans', params={'relations': ['no_such_table']}
+            )
+
+            self.assertEqual(list(records), [])
+            self.assertEqual(records.columns, ['schemaname', 'name', 'count'])
+
+    def test_iter_report_streams_every_row(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            records = list(pg.iter_report('seq_scans', itersize=1))
+
+            self.assertEqual(records, pg.seq_scans())
+
+    def test_raw_reports_return_numbers(self):
+        self.create_same_named_table()
+
+        with PgExtras(dsn=self.dsn) as pg:
+            pretty = pg.total_table_size()
+            raw = pg.total_table_size(raw=True)
+
+            self.assertEqual(len(pretty), len(raw))
+            self.assertEqual(
+                [record.name for record in pretty],
+                [record.name for record in raw]
+            )
+
+            for record in raw:
+                self.assertIsInstance(record.size, int)
+
+            self.assertIn(
+                ('s2', 'pgbench_tellers'),
+                [(record.schemaname, record.name) for record in raw]
+            )
+
+            for record in pg.vacuum_stats(raw=True):
+                self.assertIsInstance(record.dead_rowcount, int)
+                self.assertIn(record.expect_autovacuum, (True, False))
+
+    def test_pretty_reports_keep_the_report_order(self):
+        names = {
+            'index_size': 'name',
+            'table_indexes_size': 'table',
+            'table_size': 'name'
+        }
+
+        with PgExtras(dsn=self.dsn) as pg:
+            for report, name in names.items():
+                self.assertEqual(
+                    [getattr(record, name) for record in
+                     getattr(pg, report)()],
+                    [getattr(record, name) for record in
+                     getattr(pg, report)(raw=True)]
+                )
+
+    def test_limits_and_thresholds_are_applied_by_the_server(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            sizes = pg.table_size(raw=True)
+            smallest = min(record.size for record in sizes)
+
+            self.assertEqual(pg.table_size(raw=True, limit=2), sizes[:2])
+            self.assertEqual(
+                pg.table_size(raw=True, min_size_bytes=smallest + 1),
+                [record for record in sizes if record.size > smallest]
+            )
+            self.assertEqual(pg.long_running_queries(min_duration='1 day'), [])
+
+    def test_catalog_reports_filter_schemas_and_relations(self):
+        self.create_same_named_table()
+
+        with PgExtras(dsn=self.dsn) as pg:
+            tables = [record.name for record in pg.table_size()]
+
+            self.assertEqual(
+                [r.name for r in pg.table_size(schemas=['public'])],
+                [r.name for r in pg.table_size(exclude_schemas=['s2'])]
+            )
+            self.assertEqual(pg.table_size(schemas=['no_such_schema']), [])
+            self.assertEqual(
+                [r.name for r in pg.table_size(relations=[tables[0]])],
+                [name for name in tables if name == tables[0]]
+            )
+
+            for record in pg.seq_scans(relations=('pgbench_branches',)):
+                self.assertEqual(record.name, 'pgbench_branches')
+
+    def test_bloat_is_joined_by_oid(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            records = pg.bloat(raw=True)
+
+            self.assertEqual(len(records), len(pg.bloat()))
+
+            for record in records:
+                self.cursor.execute(
+                    'SELECT relname FROM pg_class WHERE oid = %s',
+                    (record.oid,)
+                )
+                relname = self.cursor.fetchone().relname
+
+                self.assertEqual(record.object_name.split('::')[-1], relname)
+
+    def test_exact_bloat(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            results = pg.bloat(exact=True, exact_top=3, max_workers=2)
+
+            if pg.profile.has_extension('pgstattuple'):
+                self.assertTrue(len(results) <= 3)
+
+                for record in pg.bloat(exact=True, exact_top=3, raw=True):
+                    self.assertIsInstance(record.waste, int)
+            else:
+                self.assertIsNotNone(results[0].error)
+
+    def test_prepared_reports_take_parameters(self):
+        with PgExtras(dsn=self.dsn, prepare=True) as pg:
+            self.assertEqual(len(pg.index_size(limit=1)), 1)
+            self.assertEqual(len(pg.index_size(limit=2)), 2)
+
+    def test_statements_are_executed_as_written_in_sql_constants(self):
+        with PgExtras(dsn=self.dsn) as pg:
+            records = pg.execute("SELECT '100%%' AS ratio")
+
+            self.assertEqual(records[0].ratio, '100%')
+
     def test_error_property_exists_for_missing_pg_stat_statement(self):
         with PgExtras(dsn=self.dsn) as pg:
             results = pg.get_missing_pg_stat_statement_error()
@@ -203,5 +577,6 @@ class TestPgextras(unittest.TestCase):
         self.cursor.close()
         self.conn.close()
 
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pgextras.rows import Columns, Rows, format_rows, load_numpy
+
+numpy = load_numpy()
+
+
+class TestRows(unittest.TestCase):
+    def setUp(self):
+        self.columns = ['name', 'count']
+        self.rows = [('a', 1), ('b', 2)]
+
+    def test_rows_are_plain_tuples(self):
+        rows = format_rows(self.columns, self.rows, 'tuple')
+
+        self.assertIsInstance(rows, Rows)
+        self.assertEqual(rows.columns, self.columns)
+        self.assertEqual(rows[1], ('b', 2))
+        self.assertEqual(rows.records()[1].count, 2)
+
+    def test_columns_hold_the_values_of_each_column(self):
+        columns = format_rows(self.columns, self.rows, 'columnar')
+
+        self.assertIsInstance(columns, Columns)
+        self.assertEqual(columns.columns, self.columns)
+        self.assertEqual(columns.length, 2)
+        self.assertEqual(list(columns['count']), [1, 2])
+        self.assertEqual(columns.rows(), self.rows)
+        self.assertEqual(columns.records()[0].name, 'a')
+
+    def test_empty_columns(self):
+        columns = Columns(self.columns, [])
+
+        self.assertEqual(columns.columns, self.columns)
+        self.assertEqual(columns.rows(), [])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_columns_are_numpy_arrays(self):
+        columns = Columns(['pid', 'blocked_by'], [(1, [2, 3]), (2, [])])
+
+        self.assertEqual(columns['pid'].sum(), 3)
+        self.assertEqual(columns['blocked_by'][0], [2, 3])
+
+    def test_records(self):
+        records = format_rows(self.columns, self.rows, 'record')
+
+        self.assertEqual(records[0].name, 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported on first use only, see benchmarks/startup.py for the timings
+LAZY = [
+    'concurrent.futures',
+    'hashlib',
+    'http.server',
+    'numpy',
+    'pgextras.cache',
+    'pgextras.export',
+    'prettytable',
+    'psycopg2.extras',
+    'pyarrow',
+    'sqlite3',
+]
+
+
+def loaded_modules(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [path for path in [env.get('PYTHONPATH')] if path]
+    )
+    output = subprocess.check_output(
+        [sys.executable, '-c', code + '\nimport json, sys\n'
+         'print(json.dumps(sorted(sys.modules)))'],
+        env=env, universal_newlines=True
+    )
+
+    return set(json.loads(output.splitlines()[-1]))
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_leaves_the_heavy_modules_alone(self):
+        modules = loaded_modules('import pgextras')
+
+        self.assertEqual([module for module in LAZY if module in modules], [])
+
+    def test_lazy_names_still_import(self):
+        modules = loaded_modules('from pgextras import ResultCache')
+
+        self.assertIn('pgextras.cache', modules)
+
+    def test_cli_help_imports_no_pgextras(self):
+        modules = loaded_modules(
+            'import runpy, sys\n'
+            'sys.argv = ["pgextras", "--help"]\n'
+            'try:\n'
+            '    runpy.run_path({!r}, run_name="__main__")\n'
+            'except SystemExit:\n'
+            '    pass'.format(os.path.join(ROOT, 'scripts', 'pgextras'))
+        )
+
+        self.assertNotIn('pgextras', modules)
+        self.assertNotIn('psycopg2', modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+from collections import namedtuple
+
+from pgextras.statements import Sample, compute_rates, take_sample
+
+Counters = namedtuple(
+    'Record', 'queryid query calls total_time blks_read rows'
+)
+
+
+class EmptyPgExtras(object):
+    def __init__(self, now):
+        self.now = now
+
+    def run_report(self, report, params=None, row_format=None, **options):
+        return []
+
+    def execute(self, statement, params=None, report=None,
+                row_format='record'):
+        return [namedtuple('Record', 'sampled_at')(self.now)]
+
+
+class TestStatementRates(unittest.TestCase):
+    def setUp(self):
+        self.start = datetime.datetime(2014, 5, 6, 10, 0, 0)
+
+    def sample(self, seconds, *counters):
+        return Sample(
+            self.start + datetime.timedelta(seconds=seconds),
+            dict(((10, 1, record.queryid), record) for record in counters)
+        )
+
+    def test_rates_are_per_second_and_busiest_first(self):
+        before = self.sample(
+            0,
+            Counters(1, 'SELECT 1', 100, 50.0, 10, 100),
+            Counters(2, 'SELECT 2', 10, 500.0, 0, 10),
+        )
+        after = self.sample(
+            10,
+            Counters(1, 'SELECT 1', 200, 150.0, 30, 200),
+            Counters(2, 'SELECT 2', 20, 2500.0, 0, 20),
+        )
+
+        rates = compute_rates(before, after)
+
+        self.assertEqual([rate.queryid for rate in rates], [2, 1])
+        self.assertEqual(rates[1].calls_per_sec, 10.0)
+        self.assertEqual(rates[1].exec_time_per_sec, 10.0)
+        self.assertEqual(rates[1].blks_read_per_sec, 2.0)
+        self.assertEqual(rates[1].mean_time, 1.0)
+        self.assertEqual(rates[0].mean_time, 200.0)
+
+    def test_new_and_reset_statements_count_from_zero(self):
+        before = self.sample(0, Counters(1, 'SELECT 1', 500, 500.0, 0, 500))
+        after = self.sample(
+            5,
+            Counters(1, 'SELECT 1', 5, 10.0, 0, 5),
+            Counters(3, 'SELECT 3', 50, 5.0, 0, 50),
+        )
+
+        rates = compute_rates(before, after)
+        rates = dict((rate.queryid, rate) for rate in rates)
+
+        self.assertEqual(rates[1].calls_per_sec, 1.0)
+        self.assertEqual(rates[3].calls_per_sec, 10.0)
+
+    def test_evicted_and_idle_statements_are_skipped(self):
+        before = self.sample(
+            0,
+            Counters(1, 'SELECT 1', 5, 1.0, 0, 5),
+            Counters(2, 'SELECT 2', 5, 1.0, 0, 5),
+        )
+        after = self.sample(5, Counters(2, 'SELECT 2', 5, 1.0, 0, 5))
+
+        self.assertEqual(compute_rates(before, after), [])
+
+    def test_limit(self):
+        before = self.sample(0)
+        after = self.sample(
+            1,
+            Counters(1, 'SELECT 1', 5, 1.0, 0, 5),
+            Counters(2, 'SELECT 2', 5, 2.0, 0, 5),
+        )
+
+        self.assertEqual(len(compute_rates(before, after, limit=1)), 1)
+
+    def test_an_empty_sample_still_has_a_time(self):
+        before = take_sample(EmptyPgExtras(self.start))
+        after = self.sample(2, Counters(1, 'SELECT 1', 4, 1.0, 0, 4))
+
+        self.assertEqual(before.taken_at, self.start)
+        self.assertEqual(before.counters, {})
+        self.assertEqual(compute_rates(before, after)[0].calls_per_sec, 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import unittest
+from collections import namedtuple
+
+from pgextras import PgExtras
+from pgextras.watch import (
+    CHANGED, ERROR, NEW, RESET, Watch, fit, row_keys
+)
+
+Record = namedtuple('Record', 'pid running_for query')
+SIZE = os.terminal_size((80, 24))
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        self.dsn = 'dbname=python_pgextras_unittest'
+        self.watch = Watch(None, ['ps'], file=io.StringIO())
+
+    def render(self, records):
+        return self.watch.render({'ps': records}, 0.001, SIZE)
+
+    def test_new_rows_and_changed_values_are_highlighted(self):
+        first = self.render([Record(1, '0:00:01', 'SELECT 1')])
+        second = self.render([
+            Record(1, '0:00:02', 'SELECT 1'),
+            Record(2, '0:00:00', 'SELECT 2'),
+        ])
+
+        self.assertNotIn(CHANGED, ''.join(first))
+        self.assertNotIn(NEW, ''.join(first))
+        self.assertIn(CHANGED + '0:00:02', second[4])
+        self.assertNotIn(CHANGED + '1', second[4])
+        self.assertIn(NEW + '2', second[5])
+
+    def test_error_records_are_shown_as_errors(self):
+        Timeout = namedtuple('Record', 'error report setting value')
+        self.watch.reports = ['locks', 'ps']
+        lines = self.watch.render({
+            'locks': [Timeout('canceling statement due to statement timeout',
+                              'locks', 'statement_timeout', '50ms')],
+            'ps': [Record(1, '0:00:01', 'SELECT 1')],
+        }, 0.001, SIZE)
+
+        self.assertEqual(
+            lines[3],
+            ERROR + 'canceling statement due to statement timeout' + RESET
+        )
+        self.assertIn('SELECT 1', lines[7])
+
+    def test_only_changed_lines_are_redrawn(self):
+        self.watch.draw(['a', 'b', 'c'])
+        self.watch.file = io.StringIO()
+        self.watch.draw(['a', 'x'])
+
+        self.assertEqual(
+            self.watch.file.getvalue(), '\x1b[2;1Hx\x1b[K\x1b[3;1H\x1b[J'
+        )
+
+    def test_rows_with_the_same_key_are_told_apart(self):
+        records = [Record(1, None, 'a'), Record(1, None, 'b')]
+
+        self.assertEqual(row_keys('ps', records), [(1, 1), (1, 2)])
+
+    def test_lines_fit_the_terminal(self):
+        self.assertEqual(fit([('abcdef', ''), ('ghi', NEW)], 7),
+                         'abcdef' + NEW + 'g\x1b[0m')
+
+    def test_ticks_reuse_the_connection(self):
+        output = io.StringIO()
+
+        with PgExtras(dsn=self.dsn, prepare=True) as pg:
+            watch = Watch(pg, ['ps', 'version'], interval=0, file=output)
+            watch.run(ticks=2)
+
+            with pg.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT count(*) FROM pg_prepared_statements')
+
+                self.assertEqual(cursor.fetchone()[0], 2)
+
+        self.assertIn('PostgreSQL', output.getvalue())
+        self.assertTrue(output.getvalue().endswith('\x1b[?1049l'))
+
+
+if __name__ == '__main__':
+    unittest.main()